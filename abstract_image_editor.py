@@ -1,24 +1,45 @@
 #--------------------------------------------------------------------------------------
-Copyright (c) 2022 Alvaro Angel
-    This program is free software: you can redistribute it and/or modify it
-    under the terms of the GNU General Public License as published by 
-    the Free Software Foundation, either version 3 of the License, 
-    or (at your option) any later version.
-
-    This program is distributed in the hope that it will be useful, 
-    but WITHOUT ANY WARRANTY; without even the implied warranty 
-    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
-    See the GNU General Public License for more details.
-
-    You should have received a copy of the GNU 
-    General Public License along with this program. 
-    If not, see <https://www.gnu.org/licenses/>. 
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by 
+#    the Free Software Foundation, either version 3 of the License, 
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful, 
+#    but WITHOUT ANY WARRANTY; without even the implied warranty 
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU 
+#    General Public License along with this program. 
+#    If not, see <https://www.gnu.org/licenses/>. 
 #--------------------------------------------------------------------------------------
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtWidgets import QMainWindow, QApplication, QPushButton, QLabel, QFileDialog, QSlider, QMessageBox
-from PyQt5 import uic
+import time
+#when the editor started loading, see shown_first()
+STARTED = time.perf_counter()
+from PyQt5.QtCore import QTimer, Qt, pyqtSignal
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtWidgets import (QMainWindow, QApplication, QFileDialog, QMessageBox, QShortcut, QDockWidget,
+                             QListWidget, QListWidgetItem)
 from random import Random
-import math
+import lazy_modules
+#the engines and NumPy are only loaded once the window is shown, see shown_first()
+effects_engine = lazy_modules.lazy_import('effects_engine')
+brush_engine = lazy_modules.lazy_import('brush_engine')
+tiled_engine = lazy_modules.lazy_import('tiled_engine')
+batch_executor = lazy_modules.lazy_import('batch_executor')
+working_canvas = lazy_modules.lazy_import('working_canvas')
+proxy_preview = lazy_modules.lazy_import('proxy_preview')
+effect_graph = lazy_modules.lazy_import('effect_graph')
+pipeline = lazy_modules.lazy_import('pipeline')
+image_writer = lazy_modules.lazy_import('image_writer')
+import canvas_opener
+import effect_gallery
+import render_worker
+import slider_scheduler
+import profiler
+import ui_loader
+import os
 import sys
 
 #CONSTANTS: to help in iterations and in conditionals.
@@ -27,45 +48,95 @@ MIN_RGB_VALUE = 0
 SLIDER_DEFAULT_VALUE = 49
 PIXEL_CONTENTS = 4
 R_G_B = 3
-MAX_IMAGE_SIZE = 1500 #Larger images slow down the program considerably.
 MIN_IMAGE_SIZE = 4
 
-#Arbitrary value for comparing RGB values. Can be changed at will.
-SIMILARITY_RANGE = 15
-
-#Keeps the proportions of the confetti shape similar, independent of image dimensions.
-CONFETTI_PROPORTION = 14899
+#The wash slider repaints the image while it is dragged, so it uses the fast brush kernels.
+#brush_engine.FAST, written out so the engines aren't loaded before the window shows.
+WASH_SLIDER_MODE = 'fast'
+#Milliseconds a dragged slider is held still before its moves are rendered at full resolution.
+PREVIEW_IDLE_TIME = 300
+#Effects of the Gallery panel, in the order of their thumbnails, and the setting of their step.
+GALLERY_EFFECTS = (('neon', None), ('wild_west', None), ('zeus', None), ('mint', None), ('brighter', None),
+                   ('sketch', None), ('pattern', None), ('strie', None), ('diamond', None), ('zombie', None),
+                   ('dust', None), ('metal', None))
+#Choices of the save dialog and their (JPEG quality, PNG compression), see image_writer.SaveOptions.
+#-1 is the encoder's default, written out so image_writer isn't loaded before the window shows.
+SAVE_FILTERS = {
+    "JPEG (*.jpg *.jpeg)": (-1, -1),
+    "JPEG, high quality (*.jpg *.jpeg)": (95, -1),
+    "PNG (*.png)": (-1, -1),
+    "PNG, fast and bigger (*.png)": (-1, 1),
+    "All Files (*.*) ": (-1, -1),
+}
         
 class UI(QMainWindow):
-    
-    def __init__(self):
+    #a save is over: the file path, and why it failed or an empty string
+    saved = pyqtSignal(str, str)
+
+    def __init__(self, startup_time=False):
         """ Load everything onto the main window and display it.
+
+        Args:
+            startup_time (bool): Print how long the window took to show up, see shown_first().
         """
         super(UI, self).__init__()
-        uic.loadUi("abstract_image_editor.ui", self)
+        self.startup_time = startup_time
+        form = ui_loader.load_ui(self)
         
         #initialize the global variables
         self.past_slider_value = 0
         self.rand_int = Random()
+        #the open image, effects change its pixels in place
+        self.canvas = None
+        #large JPEGs are shown decoded at a reduced size while the full image is decoded here
+        self.opener = canvas_opener.CanvasOpener(self)
+        self.opener.finished.connect(self.opened_canvas)
+        #saves are written on a background thread, from a copy of the canvas
+        self.writer = None
+        self.saved.connect(self.saved_image)
+        #(name, setting, mode, seed) of the effects drawn on the preview while the image opens
+        self.opening_steps = []
+        #the canvas is shown once per turn of the event loop, see update_display()
+        self.display_pending = False
+        #image from before the current run of back to back table effects
+        self.table_base = None
+        self.table_gray = False
+        #worker processes for the bands of large images, started on the first one
+        self.tile_executor = None
+        #effects run on a background thread and show up when they are done
+        self.renderer = render_worker.RenderWorker(self)
+        self.renderer.published.connect(self.update_display)
+        self.renderer.progress.connect(self.show_progress)
+        #tells render_stopped() the render was cancelled with Esc
+        self.render_cancelled = False
+        #the last slider released, its moves are reported once the render is over
+        self.released_key = None
+        #low resolution copy of the image the dragged sliders are rendered on, see apply_steps()
+        self.preview = None
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_IDLE_TIME)
+        self.preview_timer.timeout.connect(self.commit_preview)
+        self.renderer.failed.connect(self.show_render_error)
         #initialize the image label
-        self.image_label = self.findChild(QLabel, "imageLabel")
+        self.image_label = form.imageLabel
         
         #initialize the buttons
-        self.open_button = self.findChild(QPushButton, "openButton")
-        self.reset_button = self.findChild(QPushButton, "resetButton")
-        self.save_button = self.findChild(QPushButton, "saveButton")
-        self.neon_button = self.findChild(QPushButton, "neonButton")
-        self.ww_button = self.findChild(QPushButton, "wwButton")
-        self.zeus_button = self.findChild(QPushButton, "zeusButton")
-        self.mint_button = self.findChild(QPushButton, "mintButton")
-        self.diamond_button = self.findChild(QPushButton, "diamondButton")
-        self.strie_button = self.findChild(QPushButton, "strieButton")
-        self.pattern_button = self.findChild(QPushButton, "patternButton")
-        self.zombie_button = self.findChild(QPushButton, "zombieButton")
-        self.sketch_button = self.findChild(QPushButton, "sketchButton")
-        self.dust_button = self.findChild(QPushButton, "dustButton")
-        self.neon_metal_button = self.findChild(QPushButton, "neonMetalButton")
-        self.brighter_button = self.findChild(QPushButton, "brighterButton")
+        self.open_button = form.openButton
+        self.reset_button = form.resetButton
+        self.save_button = form.saveButton
+        self.neon_button = form.neonButton
+        self.ww_button = form.wwButton
+        self.zeus_button = form.zeusButton
+        self.mint_button = form.mintButton
+        self.diamond_button = form.diamondButton
+        self.strie_button = form.strieButton
+        self.pattern_button = form.patternButton
+        self.zombie_button = form.zombieButton
+        self.sketch_button = form.sketchButton
+        self.dust_button = form.dustButton
+        self.neon_metal_button = form.neonMetalButton
+        self.brighter_button = form.brighterButton
         #connect the buttons
         self.open_button.clicked.connect(self.clicked_open_button)
         self.reset_button.clicked.connect(self.clicked_reset_button)
@@ -84,49 +155,193 @@ class UI(QMainWindow):
         self.brighter_button.clicked.connect(self.clicked_brighter_button)
         
         #initialize the sliders
-        self.melt_slider = self.findChild(QSlider, "meltSlider")
-        self.wash_slider = self.findChild(QSlider, "washSlider")
-        self.confetti_slider = self.findChild(QSlider, "confettiSlider")
-        #connect the sliders 
-        self.melt_slider.valueChanged.connect(self.moved_melt_slider)
-        self.wash_slider.valueChanged.connect(self.moved_wash_slider)
-        self.confetti_slider.valueChanged.connect(self.moved_confetti_slider)
+        self.melt_slider = form.meltSlider
+        self.wash_slider = form.washSlider
+        self.confetti_slider = form.confettiSlider
+        #connect the sliders, their moves are coalesced so a drag doesn't queue up renders
+        self.slider_scheduler = slider_scheduler.SliderScheduler(self.sliders_wait, self)
+        #moves held during a render go first, render_stopped() only reports once nothing is left
+        self.renderer.idle.connect(self.slider_scheduler.flush)
+        self.renderer.idle.connect(self.render_stopped)
+        self.slider_scheduler.add_slider('melt', self.melt_slider, self.moved_melt_slider)
+        self.slider_scheduler.add_slider('wash', self.wash_slider, self.moved_wash_slider)
+        #every confetti move paints squares of its own, so none is dropped
+        self.slider_scheduler.add_slider('confetti', self.confetti_slider, self.moved_confetti_slider,
+                                         slider_scheduler.ALL)
+        self.melt_slider.sliderReleased.connect(lambda: self.released_slider('melt'))
+        self.wash_slider.sliderReleased.connect(lambda: self.released_slider('wash'))
+        self.confetti_slider.sliderReleased.connect(lambda: self.released_slider('confetti'))
+
+        #undo and redo, Ctrl+Z and Ctrl+Y or Ctrl+Shift+Z
+        QShortcut(QKeySequence.Undo, self, self.undo_edit)
+        QShortcut(QKeySequence.Redo, self, self.redo_edit)
+        QShortcut(QKeySequence("Ctrl+Shift+Z"), self, self.redo_edit)
+
+        #the chain of effects of the image, steps can be switched off or changed, see edited_step()
+        self.chain_list = QListWidget()
+        self.chain_list.itemChanged.connect(self.edited_step)
+        QShortcut(QKeySequence.Delete, self.chain_list, self.removed_step)
+        self.chain_dock = QDockWidget("Edits", self)
+        self.chain_dock.setWidget(self.chain_list)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.chain_dock)
+        self.chain_dock.setFloating(True)
+        self.chain_dock.hide()
+        #the chain the list shows
+        self.shown_chain = ()
+        QShortcut(QKeySequence("Ctrl+E"), self, self.chain_dock.toggleViewAction().trigger)
+
+        #every effect button tried on the image at once, Ctrl+G, a thumbnail clicks its button
+        self.effect_buttons = {
+            'neon': self.neon_button, 'wild_west': self.ww_button, 'zeus': self.zeus_button,
+            'mint': self.mint_button, 'brighter': self.brighter_button, 'sketch': self.sketch_button,
+            'pattern': self.pattern_button, 'strie': self.strie_button, 'diamond': self.diamond_button,
+            'zombie': self.zombie_button, 'dust': self.dust_button, 'metal': self.neon_metal_button,
+        }
+        self.gallery_dock = effect_gallery.GalleryPanel(
+            [(self.effect_buttons[name].text(), (name, setting)) for name, setting in GALLERY_EFFECTS], self)
+        self.gallery_dock.chosen.connect(self.chosen_thumbnail)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.gallery_dock)
+        self.gallery_dock.setFloating(True)
+        self.gallery_dock.hide()
+        QShortcut(QKeySequence("Ctrl+G"), self, self.gallery_dock.toggleViewAction().trigger)
+
+        #timings of the effects, only when profiling is on, Ctrl+Shift+P
+        self.profile_dock = None
+        if profiler.PROFILER.enabled:
+            import profile_panel
+            self.profile_dock = profile_panel.ProfilePanel(self)
+            self.addDockWidget(Qt.RightDockWidgetArea, self.profile_dock)
+            self.profile_dock.setFloating(True)
+            self.profile_dock.hide()
+            QShortcut(QKeySequence("Ctrl+Shift+P"), self, self.profile_dock.toggleViewAction().trigger)
         
         #display the main window
         self.show()
+        QTimer.singleShot(0, self.shown_first)
         
+    def shown_first(self):
+        """ Called once the window is shown for the first time.
+            Records how long the window took to show up, and prints it with --startup-time,
+            then loads the engines while nothing is asked of them yet, so the first effect
+            doesn't wait for them.
+        """
+        profiler.PROFILER.mark('startup', 'first window', STARTED)
+        if self.startup_time:
+            print(f'First window after {(time.perf_counter() - STARTED) * 1000:.0f} ms', file=sys.stderr, flush=True)
+        with profiler.span('load', 'engines'):
+            lazy_modules.load([effects_engine, brush_engine, tiled_engine, batch_executor, working_canvas,
+                               proxy_preview, effect_graph, pipeline])
+
     def clicked_open_button(self):
         """ Called whenever the open image button is clicked.
             Opens up a load image dialog box and then if an image is selected
-            it checks if the image size is within the allowed range.
+            it checks if the image is not too small.
             If the image meets the requirements, it is displayed.
         """
         self.reset_sliders()
+        self.drop_slider_moves()
         fileName = QFileDialog.getOpenFileName(self, "Open File",'',"JPEG (*.jpg *.jpeg);;PNG (*.png)")
         #if the fileName is not empty
         if fileName[0] != '':
-            self.pixmap = QPixmap(fileName[0])
-            
-            self.backUpImage = self.pixmap.toImage()
-            self.image_height = self.backUpImage.height()
-            self.image_width = self.backUpImage.width()
-            
-            #if the image is too large
-            if (self.image_height > MAX_IMAGE_SIZE) or (self.image_width > MAX_IMAGE_SIZE):
-                message = f"Image can't be greater than {MAX_IMAGE_SIZE} by {MAX_IMAGE_SIZE} pixels!"
-                self.display_warning_message_box(message, "Try Again.")
+            path = fileName[0]
+            #the size is read from the header, so files that can't be opened aren't decoded
+            try:
+                height, width, kind = pipeline.probe_image(path)
+            except (OSError, ValueError) as error:
+                #e.g. the image is too small
+                self.display_warning_message_box(str(error), "Try Again.")
+                return
+
+            if kind == 'jpeg' and height and proxy_preview.worth_a_proxy(
+                    height, width, self.image_label.height(), self.image_label.width()):
+                self.open_in_background(path, height, width)
                 return
-            #if the image is too small
-            if (self.image_height < MIN_IMAGE_SIZE) or (self.image_width < MIN_IMAGE_SIZE):
-                message = f"Image can't be less than {MIN_IMAGE_SIZE} by {MIN_IMAGE_SIZE} pixels!"
-                self.display_warning_message_box(message, "Try Again.")
+
+            #the image is read once, in the format the effects work on
+            try:
+                canvas = working_canvas.open_canvas(path)
+            except (OSError, ValueError) as error:
+                self.display_warning_message_box(str(error), "Try Again.")
                 return
             
-            #display image
-            self.image_label.setPixmap(self.pixmap)
-            
-            #array is the list of RGB pointer values that represent the pixels of the image.
-            self.array = []
+            self.stop_rendering()
+            self.close_canvas()
+            self.show_canvas(canvas)
+
+    def open_in_background(self, path, height, width):
+        """ Helper method to show a large JPEG decoded at the size of the label right away,
+            and decode the full image on a background thread.
+            Effects are drawn on the reduced image until the full one is ready,
+            and rendered on it then, see opened_canvas().
+        """
+        bound_height, bound_width = self.image_label.height(), self.image_label.width()
+        proxy_height, proxy_width = proxy_preview.proxy_size(height, width, bound_height, bound_width)
+        try:
+            with profiler.span('load', 'reduced decode') as span:
+                image = pipeline.load_scaled_image(path, proxy_height, proxy_width)
+                span.nbytes = image.sizeInBytes()
+        except OSError as error:
+            self.display_warning_message_box(str(error), "Try Again.")
+            return
+
+        self.stop_rendering()
+        self.close_canvas()
+        self.image_height = height
+        self.image_width = width
+        self.table_base = None
+        self.preview = proxy_preview.ProxyPreview(image, height, width, bound_height, bound_width)
+        self.opener.open(path)
+        self.statusBar().showMessage("Opening...")
+        self.refresh_display()
+
+    def opened_canvas(self):
+        """ Called once the image opened in the background is decoded.
+            The effects drawn on the reduced image are rendered on it, and the reduced
+            image stays on screen until they are done.
+        """
+        canvas, error = self.opener.take()
+        if canvas is None and error is None:
+            #already taken, see finish_opening()
+            return
+        steps = self.opening_steps
+        self.opening_steps = []
+        self.statusBar().clearMessage()
+        if canvas is None:
+            self.preview = None
+            self.refresh_display()
+            self.display_warning_message_box(error, "Try Again.")
+            return
+
+        self.show_canvas(canvas, keep_preview=True)
+        for name, setting, mode, seed in steps:
+            chain = self.canvas.graph.append(name, setting, mode, seed)
+            self.preview.keep([(name, setting)], mode, Random(seed), chain)
+        if steps:
+            self.commit_preview()
+        elif not self.dragging_slider():
+            self.preview = None
+            self.update_display()
+
+    def finish_opening(self):
+        """ Helper method to wait for the image opening in the background, if any,
+            e.g. before it is saved.
+        """
+        if self.opener.busy():
+            self.opener.wait()
+            self.opened_canvas()
+
+    def show_canvas(self, canvas, keep_preview=False):
+        """ Helper method to make a canvas the open image and display it.
+        """
+        self.canvas = canvas
+        self.image_height = canvas.height
+        self.image_width = canvas.width
+        
+        #display image
+        self.table_base = None
+        if not keep_preview:
+            self.preview = None
+        self.refresh_display()
             
     def display_warning_message_box(self, text, informative):
         """ Helper method to display a warning message box.
@@ -143,177 +358,50 @@ class UI(QMainWindow):
         """ Called whenever the zeus button is pressed.
             The pixels of the image are shuffled painting
             the image with various colors.
-        """        
+        """
         if self.has_no_image(''):
             return
         
-        qImage = self.get_QImage()
-        
-        #Arbitrary value that can be changed at will to create different effects.
-        zeus_value = 100
-        
-        for position in range(0, len(self.array), PIXEL_CONTENTS):
-            
-            for iteration in range(R_G_B):
-                    
-                value = self.array[position] + zeus_value
-                
-                #The next integers in the if, elif, 
-                #and else statements represent RGB values from 0 to 255.
-                #The values can be changed at will as long as they are kept in the 0-255 range.
-                if  value >= 0 and value <= 50:
-                    self.array[position] = 70
-                elif value >= 51 and value <= 100:
-                    self.array[position] = 120
-                elif value >= 101 and value <= 150:
-                    self.array[position] = 170
-                elif value >= 151 and value <= 200:
-                    self.array[position] = 225
-                else:
-                    self.array[position] = 45
-
-                #Arbitrary value that can be changed at will to create different effects.
-                #May cause index out of bounds errors.
-                position += 1 #go forward 1 rgb value
-        
-        self.pixmap = QPixmap.fromImage(qImage)
-        self.image_label.setPixmap(self.pixmap)
+        self.apply_table_effect('zeus')
 
         
     def clicked_brighter_button(self):
         """ Called whenever the brighter button is pressed.
             The pixel values are incremented by the arbitrary brighter value,
             increasing the brightness of the image.
-        """   
+        """
         if self.has_no_image(''):
             return
-
-        #Arbitrary value that can be changed at will to create different effects.     
-        brighter_value = 5
         
-        qImage = self.get_QImage()
-        
-        for position in range(0, len(self.array), PIXEL_CONTENTS):
-            
-            blue_green_red = [self.array[position], self.array[position + 1]  , self.array[position + 2]]
-            
-            for color in blue_green_red:
-                if (color + brighter_value) > MAX_RGB_VALUE:
-                        self.array[position] = color - brighter_value 
-                else:
-                    self.array[position] = color + brighter_value 
-
-                #Arbitrary value that can be changed at will to create different effects.
-                #May cause index out of bounds errors.
-                position += 1 #go forward 1 rgb value
-                     
-        self.pixmap = QPixmap.fromImage(qImage)
-        self.image_label.setPixmap(self.pixmap)
+        self.apply_table_effect('brighter')
         
     def clicked_neon_button(self):
         """ Called whenever the neon button is pressed.
             The rgb values are shuffled, painting the image in 
             various neon colors.
-        """    
+        """
         if self.has_no_image(''):
             return
         
-        #Arbitrary values that can be changed at will to create different effects.
-        neon_list = [-100, 70] 
-
-        qImage = self.get_QImage()
-        
-        for value in neon_list:
-        
-            for position in range(1, len(self.array)-PIXEL_CONTENTS, PIXEL_CONTENTS):
-                
-                blue_green_red = [self.array[position], self.array[position + 1]  , self.array[position + 2]]
-                
-                for color in blue_green_red:
-                    if (color + value) < MIN_RGB_VALUE:
-                            self.array[position] = self.array[position + 1]
-                    elif (color + value) > MAX_RGB_VALUE:
-                            self.array[position] = self.array[position - 1]
-                    else:
-                        self.array[position] = color + value 
-
-                    #Arbitrary value that can be changed at will to create different effects.
-                    #May cause index out of bounds errors.    
-                    position += 1 #go forward 1 grb value
-                     
-        self.pixmap = QPixmap.fromImage(qImage)
-        self.image_label.setPixmap(self.pixmap)
+        self.apply_steps([('neon', None)])
     
     def clicked_wild_west_button(self):
         """ Called whenever the wild west button is pressed.
             Creates a contrast of colors on the image.
-        """  
+        """
         if self.has_no_image(''):
             return
-
-        #Arbitrary value that can be changed at will to create different effects.
-        ww_value = 100
-
-        qImage = self.get_QImage()
         
-        for position in range(0, len(self.array)-PIXEL_CONTENTS, PIXEL_CONTENTS):
-            
-            blue_green_red = [self.array[position], self.array[position+2], self.array[position+1]]
-            
-            for color in blue_green_red:
-                if (color + ww_value) < MIN_RGB_VALUE:
-                        self.array[position] = MAX_RGB_VALUE + color + ww_value
-                elif (color + ww_value) > MAX_RGB_VALUE:
-                        self.array[position] = color + ww_value - MAX_RGB_VALUE 
-                else:
-                    self.array[position] = color + ww_value 
-
-                #Arbitrary value that can be changed at will to create different effects.
-                #May cause index out of bounds errors.
-                position += 2 #go forward 2 rgb values
-                    
-        self.pixmap = QPixmap.fromImage(qImage)
-        self.image_label.setPixmap(self.pixmap) 
+        self.apply_steps([('wild_west', None)])
     
     def clicked_mint_button(self):
         """ Called whenever the mint button is pressed.
             Creates a contrast of colors on the image.
-        """        
+        """
         if self.has_no_image(''):
             return
         
-        #Arbitrary value that can be changed at will to create different effects.
-        mint_value = 1 
-        
-        qImage = self.get_QImage()
-        
-        for position in range(0, len(self.array), PIXEL_CONTENTS):
-            
-            for iteration in range(R_G_B):
-                    
-                value = self.array[position] + mint_value
-                
-                #The next integers in the if, elif,
-                #and else statements represent RGB values from 0 to 255.
-                #The values can be changed at will to create different effects
-                #as long as they are kept in the 0-255 range.
-                if  value >= 0 and value <= 50:
-                    self.array[position] = 225
-                elif value >= 51 and value <= 100:
-                    self.array[position] = 170
-                elif value >= 101 and value <= 150:
-                    self.array[position] = 120
-                elif value >= 151 and value <= 200:
-                    self.array[position] = 70
-                else:
-                    self.array[position] = 30
-
-                #Arbitrary value that can be changed at will to create different effects.
-                #May cause index out of bounds errors.
-                position += 1 #go forward 1 rgb value
-        
-        self.pixmap = QPixmap.fromImage(qImage)
-        self.image_label.setPixmap(self.pixmap)
+        self.apply_table_effect('mint')
         
     def clicked_strie_button(self):
         """ Called whenever the strie button is pressed.
@@ -337,28 +425,11 @@ class UI(QMainWindow):
         """ Called whenever the sketch button is pressed.
             Most of the colors of the image are reduced to a few colors 
             turning the image similar to a sketch.
-        """        
+        """
         if self.has_no_image(''):
             return
-         
-        qImage = self.get_QImage()
         
-        for position in range(len(self.array) - PIXEL_CONTENTS):
-    
-            rgb = [self.array[position], self.array[position + 1], self.array[position + 2]]
-            
-            for color in rgb:
-                
-                #The next integers in the if, elif, 
-                #and else statements represent RGB values from 0 to 255.
-                #The values can be changed at will as long as they are kept in the 0-255 range.
-                if color > 200:
-                    self.array[position] = MIN_RGB_VALUE
-                elif color < 50:
-                    self.array[position] = MAX_RGB_VALUE
-
-        self.pixmap = QPixmap.fromImage(qImage)
-        self.image_label.setPixmap(self.pixmap)
+        self.apply_steps([('sketch', None)])
         
     def clicked_dust_button(self):
         """ Called whenever the dust button is pressed.
@@ -383,34 +454,11 @@ class UI(QMainWindow):
         """ Called whenever the pattern button is pressed. 
             Wraps the RGB values around the range of 0-255.
             Creates a pattern on the image and reduces the amount of colors.
-        """       
+        """
         if self.has_no_image(''):
             return
         
-        #Arbitrary value that can be changed at will to create different effects.
-        pattern_value = 100
-
-        qImage = self.get_QImage()
-        
-        for position in range(0, len(self.array) - PIXEL_CONTENTS, PIXEL_CONTENTS):
-            
-            blue_green_red = [self.array[position - 3], self.array[position - 2]  , self.array[position - 1]]
-            
-            for color in blue_green_red:
-                if (color + pattern_value) < MIN_RGB_VALUE:
-                        self.array[position] = MAX_RGB_VALUE + color + pattern_value
-                elif (color + pattern_value) > MAX_RGB_VALUE:
-                        self.array[position] = color + pattern_value - MAX_RGB_VALUE 
-                else:
-                    self.array[position] = color + pattern_value 
-                    
-
-                #Arbitrary value that can be changed at will to create different effects.
-                #May cause index out of bounds errors.
-                position += 3 #go forward 3 rgb values
-                     
-        self.pixmap = QPixmap.fromImage(qImage)
-        self.image_label.setPixmap(self.pixmap)
+        self.apply_steps([('pattern', None)])
     
     def clicked_zombie_button(self):
         """ Called whenever the zombie button is pressed. 
@@ -421,7 +469,7 @@ class UI(QMainWindow):
 
         self.brush_effects('zombie', 'cross')
         
-    def brush_effects(self, effect, pattern):
+    def brush_effects(self, effect, pattern, mode=None):
         """ Called whenever a brush slider or button is interacted with. 
             The brush effects are: Wash, Zombie, Strié, Diamond, Dust, and Metal.
             For every pixel, some of it's encircling pixels are selected. 
@@ -433,96 +481,347 @@ class UI(QMainWindow):
             effect (str): The name of the effect button pressed.    
             pattern (str): The pattern specifies how the encircling pixels
             of the current spot or pixel are selected.
+            mode (str): brush_engine.EXACT to get the same pixels as the original loop,
+            or brush_engine.FAST for a close and much faster approximation of Wash. EXACT if None.
         """        
-        qImage = self.get_QImage()
-        
-        values_per_row = self.image_width * PIXEL_CONTENTS
-        total_rows = self.image_height - 2
-        row_start =  values_per_row + PIXEL_CONTENTS
-        row_end = (values_per_row * 2) - PIXEL_CONTENTS
-        perimeter = []
-        
-        for row in range(total_rows):
-            for column in range(row_start, row_end, PIXEL_CONTENTS):
-                #select encircling pixels
-                #diagonal pattern
-                if pattern == 'diagonal': 
-                    perimeter.append(column + values_per_row - PIXEL_CONTENTS) #bottom left pixel
-                    perimeter.append(column - values_per_row + PIXEL_CONTENTS) #top right pixel
-                #cross pattern 
-                else: 
-                    perimeter.append(column - values_per_row) #top pixel
-                    perimeter.append(column + PIXEL_CONTENTS) #side right pixel
-                    perimeter.append(column + values_per_row) #bottom pixel
-                    perimeter.append(column - PIXEL_CONTENTS) #side left pixel
-                    
-                current_red = self.array[column + 2]
-                current_green = self.array[column + 1]
-                current_blue = self.array[column]
-                
-                for perimeter_pixel in perimeter:
-                    
-                    red_diff = self.array[perimeter_pixel + 2] - current_red
-                    gre_diff = self.array[perimeter_pixel + 1] - current_green
-                    blu_diff = self.array[perimeter_pixel] - current_blue
-                    
-                    if red_diff <= SIMILARITY_RANGE and red_diff >= (SIMILARITY_RANGE * -1):
-                        if gre_diff <= SIMILARITY_RANGE and gre_diff >= (SIMILARITY_RANGE * -1):
-                            if blu_diff <= SIMILARITY_RANGE and blu_diff >= (SIMILARITY_RANGE * -1):
-                        
-                                if effect == 'wash' or effect == 'zombie':
-                                    self.array[column] = self.array[perimeter_pixel]
-                                    self.array[column+1] = self.array[perimeter_pixel + 1]
-                                    self.array[column+2] = self.array[perimeter_pixel + 2]
-                                    
-                                    if effect == 'zombie':
-                                    #Arbitrary position value that can be changed at will 
-                                    #to create different effects.
-                                    #May cause index out of bounds errors.
-                                    #This applies to all of the position variables in this method.
-                                        column += 1 #go forward 1 rgb value 
-                                        
-                                elif effect == 'strie' or effect == 'diamond':
-                                    self.array[perimeter_pixel] = self.array[column]
-                                    self.array[perimeter_pixel + 1] = self.array[column + 1]
-                                    self.array[perimeter_pixel + 2] = self.array[column + 2]
-                                    
-                                    if effect == 'strie':
-                                        column += 8 #go forward 2 pixels
-                                    elif effect == 'diamond':
-                                        column += 1 #go forward 1 rgb value 
-                                    
-                                elif effect == 'dust':
-                                    self.array[column] = self.array[perimeter_pixel]
-                                    self.array[column + 1] = self.array[perimeter_pixel + 1]
-                                    self.array[column + 2] = self.array[perimeter_pixel + 2]
-                                    column += 4 #go forward 1 pixel 
-                                    
-                                    self.array[perimeter_pixel] = self.array[column]
-                                    self.array[perimeter_pixel + 1] = self.array[column + 1]
-                                    self.array[perimeter_pixel + 2] = self.array[column + 2]
-                                    column += -20 #go back 5 pixels
-                                    
-                                    self.array[perimeter_pixel] = self.array[column]
-                                    self.array[perimeter_pixel + 1] = self.array[column + 1]
-                                    self.array[perimeter_pixel + 2] = self.array[column + 2]
-                                    column += 8 #go forward 2 pixels
-                                    
-                                elif effect == 'metal':
-                                    self.array[column] = self.array[perimeter_pixel+1]
-                                    self.array[column + 1] = self.array[perimeter_pixel + 2]
-                                    self.array[column + 2] = self.array[perimeter_pixel]
-                                    column += -5 #go back 5 rgb values 
-                                        
-                perimeter.clear()
-            
-            #move row_start and row_end to the next row  
-            row_start += values_per_row
-            row_end += values_per_row
-        
-        self.pixmap = QPixmap.fromImage(qImage)
-        self.image_label.setPixmap(self.pixmap)
+        self.apply_steps([(effect, pattern if effect == 'wash' else None)], mode)
         
+    def apply_steps(self, steps, mode=None):
+        """ Helper method to apply effects to the image on the background thread.
+            The image is shown again once they are done.
+            Large images are worked on one band of rows at a time,
+            and the bands are spread over a pool of worker processes.
+            Every step is added to the chain of the image, Confetti with a seed
+            of its own so the chain can be rendered again.
+
+        Args:
+            steps (list): (name, setting) tuples, see pipeline.parse_chain.
+            mode (str): brush_engine.EXACT or brush_engine.FAST for the brush effects, EXACT if None.
+        """
+        if mode is None:
+            mode = brush_engine.EXACT
+        if self.canvas is None:
+            #the image is still opening, the steps are drawn on the reduced image and wait for it
+            for name, setting in steps:
+                seed = self.rand_int.getrandbits(32) if name in effect_graph.SEEDED_EFFECTS else None
+                self.preview.draw([(name, setting)], mode)
+                self.opening_steps.append((name, setting, mode, seed))
+            self.update_display()
+            return
+        #any other effect ends the current run of table effects
+        self.table_base = None
+        preview = self.dragging_slider() and (self.preview is not None or proxy_preview.worth_a_proxy(
+            self.image_height, self.image_width, self.image_label.height(), self.image_label.width()))
+        for name, setting in steps:
+            seed = self.rand_int.getrandbits(32) if name in effect_graph.SEEDED_EFFECTS else None
+            chain = self.canvas.graph.append(name, setting, mode, seed)
+            if preview:
+                self.preview_steps([(name, setting)], mode, Random(seed), chain)
+            else:
+                self.submit_steps([(name, setting)], mode, Random(seed), chain)
+
+    def band_executor(self):
+        """ Helper method to get the worker processes for the bands of the image,
+            None if the image is a single band.
+        """
+        if self.image_height <= tiled_engine.tile_rows_for(self.image_width):
+            return None
+        if self.tile_executor is None:
+            self.tile_executor = batch_executor.BatchExecutor()
+        return self.tile_executor
+
+    def submit_steps(self, steps, mode, rand, chain):
+        """ Helper method to send effects to the background render, see apply_steps().
+        """
+        self.renderer.submit(steps, mode, rand, self.canvas, self.band_executor(), chain)
+
+    def preview_steps(self, steps, mode, rand, chain):
+        """ Helper method to render the moves of a dragged slider on a low resolution copy
+            of the image, for instant feedback. They are rendered on the image itself
+            once the slider is let go or held still for PREVIEW_IDLE_TIME.
+        """
+        if self.preview is None:
+            #the copy has to include every effect already asked for
+            self.renderer.wait()
+            self.preview = proxy_preview.canvas_proxy(self.canvas, self.image_label.height(),
+                                                      self.image_label.width())
+        self.preview.render(steps, mode, rand, chain)
+        self.preview_timer.start()
+        self.update_display()
+
+    def commit_preview(self):
+        """ Sends the moves rendered on the preview to the background render.
+            The preview is shown until the image has caught up with it.
+        """
+        self.preview_timer.stop()
+        if self.preview is None or self.canvas is None:
+            return
+        for steps, mode, rand, chain in self.preview.take_steps():
+            self.submit_steps(steps, mode, rand, chain)
+        if not self.renderer.busy():
+            self.render_stopped()
+
+    def dragging_slider(self):
+        """ Helper method to tell if one of the effect sliders is being dragged.
+        """
+        return any(slider.isSliderDown() for slider in (self.melt_slider, self.wash_slider, self.confetti_slider))
+
+    def sliders_wait(self):
+        """ Tells the slider scheduler to hold the slider moves, while a render is running,
+            unless they are rendered on the preview.
+        """
+        previewed = self.preview is not None and self.dragging_slider()
+        return self.renderer.busy() and not previewed
+
+    def show_progress(self, percent):
+        """ Shows how far the background render is in the status bar.
+        """
+        self.statusBar().showMessage(f"Rendering... {percent}% (Esc to cancel)")
+
+    def render_stopped(self):
+        """ Clears the progress once the background render is over.
+        """
+        if self.renderer.busy():
+            return
+        if self.canvas is not None and (self.preview is None or not self.preview.steps):
+            #effects cancelled or failed leave the chain
+            self.canvas.sync_chain()
+            self.update_display()
+        if self.canvas is not None and self.preview is not None and not self.preview.steps:
+            #the image has caught up with the preview
+            if self.dragging_slider():
+                self.preview.visible = False
+            else:
+                self.preview = None
+            self.update_display()
+        if self.render_cancelled:
+            self.render_cancelled = False
+            self.statusBar().showMessage("Cancelled.", 2000)
+        elif self.released_key is not None:
+            key = self.released_key
+            self.released_key = None
+            self.statusBar().showMessage(f"{key.capitalize()}: {self.slider_scheduler.summary(key)}.", 3000)
+        else:
+            self.statusBar().clearMessage()
+
+    def released_slider(self, key):
+        """ Called whenever a slider is released, renders its last move right away
+            and reports how many moves of the drag were rendered and dropped.
+
+        Args:
+            key (str): Name of the slider in the slider scheduler.
+        """
+        #the preview's moves go before the ones still held
+        self.commit_preview()
+        self.slider_scheduler.flush()
+        self.released_key = key
+        self.render_stopped()
+
+    def drop_slider_moves(self):
+        """ Helper method to forget the slider moves not rendered yet, e.g. the ones
+            reset_sliders() makes before the image is reset.
+            The melt and wash sliders still take note of where they are.
+        """
+        latest = self.slider_scheduler.drop()
+        for key in ('melt', 'wash'):
+            if key in latest:
+                self.past_slider_value = latest[key]
+
+    def show_render_error(self, message):
+        """ Called when an effect fails on the background thread.
+        """
+        self.display_warning_message_box("The effect couldn't be applied!", message)
+
+    def stop_rendering(self):
+        """ Helper method to throw away the background render and the preview, e.g. before a reset.
+        """
+        self.preview_timer.stop()
+        self.preview = None
+        self.renderer.cancel(keep_done=False)
+        self.renderer.wait()
+
+    def keyPressEvent(self, event):
+        """ Esc cancels the effects that are still rendering or only previewed,
+            the ones already done are kept.
+        """
+        if event.key() == Qt.Key_Escape and self.canvas is not None and (self.renderer.busy() or
+                                                                         self.preview is not None):
+            self.render_cancelled = True
+            self.preview_timer.stop()
+            self.preview = None
+            self.renderer.cancel()
+            if not self.renderer.busy():
+                self.render_stopped()
+            self.update_display()
+            return
+        super(UI, self).keyPressEvent(event)
+
+    def undo_edit(self):
+        """ Called by the undo shortcut, takes back the last effect or reset.
+            Effects still previewed or rendering are finished first.
+        """
+        self.finish_opening()
+        self.step_history(self.canvas.undo if self.canvas is not None else None, "Nothing to undo.")
+
+    def redo_edit(self):
+        """ Called by the redo shortcut, makes the last undone effect or reset again.
+        """
+        self.finish_opening()
+        self.step_history(self.canvas.redo if self.canvas is not None else None, "Nothing to redo.")
+
+    def step_history(self, step, message):
+        """ Helper method to undo or redo an edit once the canvas is settled.
+
+        Args:
+            step (function): WorkingCanvas.undo or WorkingCanvas.redo, None if there is no image.
+            message (str): Shown in the status bar if there was nothing to undo or redo.
+        """
+        if step is None:
+            return
+        self.drop_slider_moves()
+        self.commit_preview()
+        self.renderer.wait()
+        self.preview = None
+        #the image no longer is the one the table run started from
+        self.table_base = None
+        if not step():
+            self.statusBar().showMessage(message, 2000)
+        self.update_display()
+
+    def update_display(self):
+        """ Helper method to show the canvas once the current event is handled.
+            Effects that run in the same turn of the event loop are uploaded
+            to the screen together, as a single QPixmap.
+        """
+        if not self.display_pending:
+            self.display_pending = True
+            QTimer.singleShot(0, self.refresh_display)
+
+    def refresh_display(self):
+        """ Helper method to upload the canvas to the image label right away.
+        """
+        self.display_pending = False
+        if self.preview is not None and self.preview.visible:
+            self.image_label.show_image(self.preview)
+        elif self.canvas is not None:
+            self.canvas.show(self.image_label)
+            self.gallery_dock.image_changed(self.canvas)
+        else:
+            return
+        self.show_chain()
+
+    def chosen_thumbnail(self, index):
+        """ Called whenever a thumbnail of the Gallery panel is clicked,
+            its effect is applied to the image by clicking its button.
+
+        Args:
+            index (int): Position of the thumbnail, see GALLERY_EFFECTS.
+        """
+        self.effect_buttons[GALLERY_EFFECTS[index][0]].click()
+
+    def show_chain(self):
+        """ Helper method to show the chain of the image in the Edits list, if it changed.
+            Steps added at the end are added to the list, so a drag doesn't rebuild it.
+        """
+        chain = () if self.canvas is None else self.canvas.graph.snapshot()
+        if chain == self.shown_chain:
+            return
+        first = len(self.shown_chain)
+        if chain[:first] != self.shown_chain:
+            first = 0
+        self.chain_list.blockSignals(True)
+        if first == 0:
+            self.chain_list.clear()
+        for step in chain[first:]:
+            item = QListWidgetItem(effect_graph.format_step(step))
+            item.setFlags(item.flags() | Qt.ItemIsEditable | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if step.enabled else Qt.Unchecked)
+            if step.seed is not None:
+                item.setToolTip('seed {}'.format(step.seed))
+            self.chain_list.addItem(item)
+        self.chain_list.blockSignals(False)
+        self.shown_chain = chain
+
+    def edited_step(self, item):
+        """ Called whenever a step of the Edits list is switched or its text edited,
+            e.g. "melt:20". The chain is rendered again from the step that changed,
+            the steps before it come from the cache.
+
+        Args:
+            item (QListWidgetItem): The step.
+        """
+        if self.canvas is None:
+            return
+        graph = self.canvas.graph
+        index = self.chain_list.row(item)
+        step = graph.steps[index]
+        enabled = item.checkState() == Qt.Checked
+        if enabled != step.enabled:
+            graph.set_enabled(index, enabled)
+        else:
+            try:
+                (name, setting), = pipeline.parse_chain(item.text())
+            except ValueError as error:
+                self.display_warning_message_box(str(error), "Write a single effect, e.g. melt:20.")
+                self.shown_chain = ()
+                self.update_display()
+                return
+            graph.replace(index, name, setting)
+        self.render_chain()
+
+    def removed_step(self):
+        """ Called when Delete is pressed on the Edits list, takes the selected step out of the chain.
+        """
+        index = self.chain_list.currentRow()
+        if self.canvas is None or index < 0:
+            return
+        self.canvas.graph.remove(index)
+        self.render_chain()
+
+    def render_chain(self):
+        """ Helper method to render the chain of the image again, over the original,
+            after the effects already asked for.
+        """
+        self.commit_preview()
+        self.table_base = None
+        self.renderer.submit_chain(self.canvas.graph, self.canvas.graph.snapshot(), self.canvas,
+                                   self.band_executor())
+        self.update_display()
+
+    def close_canvas(self):
+        """ Helper method to let go of the open image, and of its canvas files if any.
+            An image still opening is dropped.
+        """
+        self.opener.cancel()
+        self.opening_steps = []
+        if self.canvas is not None:
+            self.gallery_dock.image_changed(None)
+            self.image_label.clear_image()
+            self.canvas.close()
+            self.canvas = None
+
+    def closeEvent(self, event):
+        """ Stops the worker processes and closes the image when the window is closed.
+        """
+        self.stop_rendering()
+        self.opener.cancel()
+        self.opener.wait()
+        self.gallery_dock.close_pool()
+        if self.writer is not None:
+            #the saves still queued are written before the window goes
+            self.writer.close()
+            self.writer = None
+        if self.tile_executor is not None:
+            self.tile_executor.close()
+            self.tile_executor = None
+        self.close_canvas()
+        if profiler.PROFILER.trace_path is not None:
+            try:
+                profiler.PROFILER.export_trace(profiler.PROFILER.trace_path)
+            except OSError as error:
+                print(f'The trace could not be written: {error}', file=sys.stderr)
+        super(UI, self).closeEvent(event)
+
     def moved_melt_slider(self, melt_value):
         """ Called whenever the melt slider is moved.
             The pixels of the image form squares and either blend towards 
@@ -535,62 +834,10 @@ class UI(QMainWindow):
         if self.has_no_image('melt'):
             return
         
-        qImage = self.get_QImage() 
         direction = self.get_slider_direction(melt_value)
         rows_to_melt = self.get_slider_difference(melt_value)
-        rgb_values_per_row = self.image_width * PIXEL_CONTENTS
-        
-        if direction > 0: #slide up
-            pixel_position = (rows_to_melt * rgb_values_per_row) - 1
-        else: #slide down
-            pixel_position = (len(self.array) - (rows_to_melt * rgb_values_per_row)) - 1
-            
-        column = 0
-        done = False
-        
-        while not done: 
-            row_number = rgb_values_per_row
-            #travel up or down the current column for all of the n rows_to_melt
-            for pixel in range(rows_to_melt): 
-                if direction > 0: #slide up
-                    #paint the current pixel equal to the pixel that is row_number rows below
-                    self.array[pixel_position - row_number] = self.array[pixel_position]
-                    self.array[(pixel_position - 1) - row_number] = self.array[pixel_position - 1]
-                    self.array[(pixel_position - 2) - row_number] = self.array[pixel_position - 2]
-                    self.array[(pixel_position - 3) - row_number] = self.array[pixel_position - 3]
-                else: #slide down
-                    #paint the current pixel equal to the pixel that is row_number rows above
-                    self.array[pixel_position + row_number] = self.array[pixel_position]
-                    self.array[(pixel_position - 1) + row_number] = self.array[pixel_position - 1]
-                    self.array[(pixel_position - 2) + row_number] = self.array[pixel_position - 2]
-                    self.array[(pixel_position - 3) + row_number] = self.array[pixel_position - 3]
-        
-                #move on to the next row
-                row_number += rgb_values_per_row
-            
-            #move on to the next column
-            column += PIXEL_CONTENTS
-
-            #check if the current row is finished
-            if column == rgb_values_per_row:
-                column = 0
-                #skip n rows_to_melt 
-                if direction > 0:#slide up
-                    pixel_position += (rows_to_melt * rgb_values_per_row)
-                else:#slide down
-                    pixel_position -= (rows_to_melt * rgb_values_per_row)
-            else:
-                #move on to the next pixel
-                if direction > 0:#slide up
-                    pixel_position += PIXEL_CONTENTS 
-                else:#slide down
-                    pixel_position -= PIXEL_CONTENTS
-                    
-            if pixel_position < 0 or pixel_position > len(self.array):
-                done = True
-                    
-        self.pixmap = QPixmap.fromImage(qImage)
-        self.image_label.setPixmap(self.pixmap)
+        #the sign of the melt setting is the direction
+        self.apply_steps([('melt', rows_to_melt if direction > 0 else -rows_to_melt)])
         
     def moved_wash_slider(self, wash_value):
         """ Called whenever the wash slider is moved. 
@@ -612,7 +859,7 @@ class UI(QMainWindow):
         else:
             direction = "cross"
         
-        self.brush_effects('wash', direction)
+        self.brush_effects('wash', direction, WASH_SLIDER_MODE)
         
     def moved_confetti_slider(self, confetti_value):
         """ Called whenever the confetti slider is moved.
@@ -625,57 +872,7 @@ class UI(QMainWindow):
             return
         
         confetti_quantity = self.get_slider_difference(confetti_value)
-        qImage = self.get_QImage()
-        total_pixels = self.image_height * self.image_width
-        confetti_side = int(math.sqrt(total_pixels / CONFETTI_PROPORTION))
-        
-        #ensure a minimum length for the side of a confetti shape
-        if confetti_side == 0:
-            confetti_side = 1
-        
-        rgb_values_per_row = self.image_width * PIXEL_CONTENTS
-        left_side_margin = confetti_side * PIXEL_CONTENTS
-        right_side_margin = rgb_values_per_row - left_side_margin
-        rows_to_skip = rgb_values_per_row * confetti_side
-        range_start =  rows_to_skip + left_side_margin
-        range_end = len(self.array) - rows_to_skip - left_side_margin
-        perimeter_pixels = []
-        
-        for confetti in range(confetti_quantity):
-            found = False
-            random_pixel = 0
-            
-            while(not found):
-                #choose a random R value from the RGB values of a pixel on the image
-                random_pixel = self.rand_int.randrange(range_start, range_end, PIXEL_CONTENTS)
-                #find the position of the chosen pixel on the row 
-                pixel_position = ((random_pixel / rgb_values_per_row) % 1) * rgb_values_per_row
-                #check if the random pixel is within the allowed range
-                if pixel_position >= left_side_margin and pixel_position < right_side_margin:
-                    found = True
-            
-            #move from the random center pixel to the top left corner pixel of the confetti shape     
-            start_pixel = random_pixel - left_side_margin
-            start_pixel = start_pixel - rows_to_skip  
-            #select the pixels that form a square confetti shape starting from the top left corner
-            for row in range(confetti_side):
-                current_pixel = start_pixel
-                for pixel in range(confetti_side):
-                    perimeter_pixels.append(current_pixel)
-                    current_pixel += PIXEL_CONTENTS
-                start_pixel += rgb_values_per_row
-            
-            #process the selected pixels
-            for perimeter_pixel_position in perimeter_pixels:
-                #paint the encircling pixels equal to the color of the center random pixel
-                self.array[perimeter_pixel_position] = self.array[random_pixel]
-                self.array[perimeter_pixel_position + 1] = self.array[random_pixel + 1]
-                self.array[perimeter_pixel_position + 2] = self.array[random_pixel + 2]
-            #clean the array for the next confetti shape            
-            perimeter_pixels.clear()
-        
-        self.pixmap = QPixmap.fromImage(qImage)
-        self.image_label.setPixmap(self.pixmap)  
+        self.apply_steps([('confetti', confetti_quantity)])
         
     def clicked_reset_button(self):
         """ Resets the image and the sliders' positions
@@ -685,9 +882,15 @@ class UI(QMainWindow):
             return
 
         self.reset_sliders()
+        self.drop_slider_moves()
+        self.finish_opening()
+        if self.canvas is None:
+            return
         
-        self.pixmap = QPixmap.fromImage(self.backUpImage)
-        self.image_label.setPixmap(self.pixmap)
+        self.stop_rendering()
+        self.table_base = None
+        self.canvas.reset()
+        self.update_display()
         
     def clicked_save_button(self):
         """ Saves the image whenever the save button is pressed.
@@ -697,13 +900,43 @@ class UI(QMainWindow):
             None (None): If the file path cannot be resolved or 
             there is no image on the UI screen to save.
         """
-        filePath = QFileDialog.getSaveFileName(self, "Save Image", "",
-                         "JPEG (*.jpg *.jpeg);;PNG (*.png);;All Files (*.*) ")
+        filePath = QFileDialog.getSaveFileName(self, "Save Image", "", ";;".join(SAVE_FILTERS))
         
         if filePath[0] == "" or self.has_no_image('save'):
             return
+        
+        #save the effects still previewed or rendering too
+        self.finish_opening()
+        if self.canvas is None:
+            return
+        self.commit_preview()
+        self.renderer.wait()
+        #the copy is written in the background while the image can be edited again
+        path = filePath[0]
+        options = image_writer.SaveOptions(*SAVE_FILTERS.get(filePath[1], (-1, -1)))
+        source, release = self.canvas.snapshot()
+
+        def done(error):
+            release()
+            self.saved.emit(path, error or "")
+
+        if self.writer is None:
+            self.writer = image_writer.ImageWriter()
+        self.statusBar().showMessage(f"Saving {os.path.basename(path)}...")
+        self.writer.submit(source, path, options, done)
+
+    def saved_image(self, path, error):
+        """ Called once a save is written, or failed.
+
+        Args:
+            path (str): The file saved.
+            error (str): Why it couldn't be written, empty if it was.
+        """
+        if error:
+            self.statusBar().clearMessage()
+            self.display_warning_message_box(error, "Try another file name or type.")
         else:
-            self.pixmap.save(filePath[0])
+            self.statusBar().showMessage(f"Saved {os.path.basename(path)}.", 2000)
 
     def get_slider_direction(self, new_slider_value):
         """ Helper method to get the slider's direction (positive or negative) 
@@ -745,8 +978,9 @@ class UI(QMainWindow):
     def has_no_image(self, type):
         """ Helper method that makes sure that there is an open image on the UI screen label
             before any operation on the image is performed.
+            An image still opening in the background counts as open.
         """
-        if self.image_label.pixmap() == None:
+        if self.canvas is None and not self.opener.busy():
             
             if type == 'save':
                 message = "There is no image to save!"
@@ -765,23 +999,57 @@ class UI(QMainWindow):
         self.wash_slider.setValue(SLIDER_DEFAULT_VALUE)
         self.confetti_slider.setValue(SLIDER_DEFAULT_VALUE)
             
-    def get_QImage(self):
-        """ Helper method to initialize the array that points to the image's pixels,
-            and to return it's QImage from the UI screen.
-        
-        Returns:
-            qImage (QImage): Object of the current image on the UI screen.
+    def apply_table_effect(self, name):
+        """ Helper method for the effects that only map every byte to a new value.
+            Back to back clicks are fused into a single table that is applied
+            to the image from before the first click, so every click costs one pass
+            over the pixels no matter how many effects are stacked.
+
+        Args:
+            name (str): Name of the effect in effects_engine.TABLE_EFFECTS.
         """
-        qImage = self.pixmap.toImage()
-        pointer = qImage.bits()
-        pointer.setsize(qImage.byteCount())
-        self.array = pointer.asarray()
-        return qImage
+        if self.renderer.busy() or self.canvas is None:
+            #the canvas is about to change or still opening, the effect waits its turn
+            self.apply_steps([(name, None)])
+            return
+        if self.table_base is None:
+            self.table_base = self.canvas.pixels.copy()
+            self.table = effects_engine.identity_table()
+            #table effects keep gray images gray, the whole run can look up a pixel at a time
+            self.table_gray = self.canvas.is_gray()
+            
+        effect_table = effects_engine.TABLE_EFFECTS[name]()
+        self.table = effects_engine.compose_tables(self.table, effect_table)
+        chain = self.canvas.graph.append(name, None)
+        #every click is its own edit in the undo history, the render's buffers are free
+        with profiler.span('kernel', name, self.table_base.nbytes):
+            result = effects_engine.apply_table(self.table_base, self.table, out=self.canvas.scratch()[0],
+                                                gray=self.table_gray)
+        self.canvas.commit(result, chain)
+        self.update_display()
             
 if __name__ == '__main__':            
     """ Top Level.
-        Runs the QApplication object.
+        Runs the batch, bench, golden, serve or build-ui command if asked to, otherwise runs the QApplication object,
+        profiled if ABSTRACT_IMAGE_EDITOR_PROFILE is set or with --profile, see profiler.
+        --startup-time prints how long the window took to show up.
     """
-    app = QApplication(sys.argv)
-    UIWindow = UI()
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(pipeline.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        import benchmark
+        sys.exit(benchmark.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'golden':
+        import golden_harness
+        sys.exit(golden_harness.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        import render_server
+        sys.exit(render_server.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'build-ui':
+        sys.exit(ui_loader.main(sys.argv[2:]))
+
+    profiler.enable_from(sys.argv[1:])
+    app = QApplication([argument for argument in sys.argv
+                        if not argument.startswith('--profile') and argument != '--startup-time'])
+    UIWindow = UI('--startup-time' in sys.argv[1:])
     app.exec_()
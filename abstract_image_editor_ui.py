@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+# Form implementation generated from reading ui file 'abstract_image_editor.ui'
+#
+# Created by: PyQt5 UI code generator 5.15.11
+#
+# WARNING: Any manual changes made to this file will be lost when pyuic5 is
+# run again.  Do not edit this file unless you know what you are doing.
+
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+
+class Ui_mainWIndow(object):
+    def setupUi(self, mainWIndow):
+        mainWIndow.setObjectName("mainWIndow")
+        mainWIndow.resize(1149, 698)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        mainWIndow.setFont(font)
+        icon = QtGui.QIcon.fromTheme("accessories-text-editor")
+        mainWIndow.setWindowIcon(icon)
+        self.centralwidget = QtWidgets.QWidget(mainWIndow)
+        self.centralwidget.setObjectName("centralwidget")
+        self.openButton = QtWidgets.QPushButton(self.centralwidget)
+        self.openButton.setGeometry(QtCore.QRect(40, 30, 271, 33))
+        font = QtGui.QFont()
+        font.setFamily("Microsoft YaHei UI Light")
+        font.setPointSize(14)
+        self.openButton.setFont(font)
+        self.openButton.setObjectName("openButton")
+        self.imageLabel = CanvasView(self.centralwidget)
+        self.imageLabel.setGeometry(QtCore.QRect(350, 30, 761, 631))
+        self.imageLabel.setText("")
+        self.imageLabel.setScaledContents(True)
+        self.imageLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.imageLabel.setObjectName("imageLabel")
+        self.layoutWidget = QtWidgets.QWidget(self.centralwidget)
+        self.layoutWidget.setGeometry(QtCore.QRect(40, 250, 271, 331))
+        self.layoutWidget.setObjectName("layoutWidget")
+        self.gridLayout = QtWidgets.QGridLayout(self.layoutWidget)
+        self.gridLayout.setContentsMargins(0, 0, 0, 0)
+        self.gridLayout.setObjectName("gridLayout")
+        self.neonButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.neonButton.setFont(font)
+        self.neonButton.setObjectName("neonButton")
+        self.gridLayout.addWidget(self.neonButton, 0, 0, 1, 1)
+        self.strieButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.strieButton.setFont(font)
+        self.strieButton.setObjectName("strieButton")
+        self.gridLayout.addWidget(self.strieButton, 0, 1, 1, 1)
+        self.mintButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.mintButton.setFont(font)
+        self.mintButton.setObjectName("mintButton")
+        self.gridLayout.addWidget(self.mintButton, 1, 0, 1, 1)
+        self.zeusButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.zeusButton.setFont(font)
+        self.zeusButton.setObjectName("zeusButton")
+        self.gridLayout.addWidget(self.zeusButton, 1, 1, 1, 1)
+        self.wwButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.wwButton.setFont(font)
+        self.wwButton.setObjectName("wwButton")
+        self.gridLayout.addWidget(self.wwButton, 2, 0, 1, 1)
+        self.sketchButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.sketchButton.setFont(font)
+        self.sketchButton.setObjectName("sketchButton")
+        self.gridLayout.addWidget(self.sketchButton, 2, 1, 1, 1)
+        self.diamondButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.diamondButton.setFont(font)
+        self.diamondButton.setObjectName("diamondButton")
+        self.gridLayout.addWidget(self.diamondButton, 3, 0, 1, 1)
+        self.dustButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.dustButton.setFont(font)
+        self.dustButton.setObjectName("dustButton")
+        self.gridLayout.addWidget(self.dustButton, 3, 1, 1, 1)
+        self.patternButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.patternButton.setFont(font)
+        self.patternButton.setObjectName("patternButton")
+        self.gridLayout.addWidget(self.patternButton, 4, 0, 1, 1)
+        self.zombieButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.zombieButton.setFont(font)
+        self.zombieButton.setObjectName("zombieButton")
+        self.gridLayout.addWidget(self.zombieButton, 4, 1, 1, 1)
+        self.neonMetalButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.neonMetalButton.setFont(font)
+        self.neonMetalButton.setObjectName("neonMetalButton")
+        self.gridLayout.addWidget(self.neonMetalButton, 5, 0, 1, 1)
+        self.brighterButton = QtWidgets.QPushButton(self.layoutWidget)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.brighterButton.setFont(font)
+        self.brighterButton.setObjectName("brighterButton")
+        self.gridLayout.addWidget(self.brighterButton, 5, 1, 1, 1)
+        self.layoutWidget1 = QtWidgets.QWidget(self.centralwidget)
+        self.layoutWidget1.setGeometry(QtCore.QRect(40, 75, 271, 176))
+        self.layoutWidget1.setObjectName("layoutWidget1")
+        self.gridLayout_2 = QtWidgets.QGridLayout(self.layoutWidget1)
+        self.gridLayout_2.setContentsMargins(0, 0, 0, 0)
+        self.gridLayout_2.setObjectName("gridLayout_2")
+        self.washLabel = QtWidgets.QLabel(self.layoutWidget1)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft YaHei UI Light")
+        font.setPointSize(14)
+        self.washLabel.setFont(font)
+        self.washLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.washLabel.setObjectName("washLabel")
+        self.gridLayout_2.addWidget(self.washLabel, 2, 0, 1, 1)
+        self.washSlider = QtWidgets.QSlider(self.layoutWidget1)
+        self.washSlider.setCursor(QtGui.QCursor(QtCore.Qt.OpenHandCursor))
+        self.washSlider.setMaximum(99)
+        self.washSlider.setSingleStep(2)
+        self.washSlider.setPageStep(2)
+        self.washSlider.setProperty("value", 49)
+        self.washSlider.setSliderPosition(49)
+        self.washSlider.setOrientation(QtCore.Qt.Horizontal)
+        self.washSlider.setObjectName("washSlider")
+        self.gridLayout_2.addWidget(self.washSlider, 3, 0, 1, 1)
+        self.confettiSlider = QtWidgets.QSlider(self.layoutWidget1)
+        self.confettiSlider.setCursor(QtGui.QCursor(QtCore.Qt.OpenHandCursor))
+        self.confettiSlider.setMaximum(99)
+        self.confettiSlider.setSingleStep(10)
+        self.confettiSlider.setPageStep(10)
+        self.confettiSlider.setProperty("value", 49)
+        self.confettiSlider.setSliderPosition(49)
+        self.confettiSlider.setOrientation(QtCore.Qt.Horizontal)
+        self.confettiSlider.setObjectName("confettiSlider")
+        self.gridLayout_2.addWidget(self.confettiSlider, 5, 0, 1, 1)
+        self.meltSlider = QtWidgets.QSlider(self.layoutWidget1)
+        self.meltSlider.setCursor(QtGui.QCursor(QtCore.Qt.OpenHandCursor))
+        self.meltSlider.setMaximum(99)
+        self.meltSlider.setSingleStep(1)
+        self.meltSlider.setPageStep(1)
+        self.meltSlider.setProperty("value", 49)
+        self.meltSlider.setOrientation(QtCore.Qt.Horizontal)
+        self.meltSlider.setObjectName("meltSlider")
+        self.gridLayout_2.addWidget(self.meltSlider, 1, 0, 1, 1)
+        self.confettiLabel = QtWidgets.QLabel(self.layoutWidget1)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft YaHei UI Light")
+        font.setPointSize(16)
+        self.confettiLabel.setFont(font)
+        self.confettiLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.confettiLabel.setObjectName("confettiLabel")
+        self.gridLayout_2.addWidget(self.confettiLabel, 4, 0, 1, 1)
+        self.meltLabel = QtWidgets.QLabel(self.layoutWidget1)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.meltLabel.setFont(font)
+        self.meltLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.meltLabel.setObjectName("meltLabel")
+        self.gridLayout_2.addWidget(self.meltLabel, 0, 0, 1, 1)
+        self.layoutWidget2 = QtWidgets.QWidget(self.centralwidget)
+        self.layoutWidget2.setGeometry(QtCore.QRect(40, 580, 271, 91))
+        self.layoutWidget2.setObjectName("layoutWidget2")
+        self.verticalLayout = QtWidgets.QVBoxLayout(self.layoutWidget2)
+        self.verticalLayout.setContentsMargins(0, 0, 0, 0)
+        self.verticalLayout.setObjectName("verticalLayout")
+        self.resetButton = QtWidgets.QPushButton(self.layoutWidget2)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft JhengHei UI Light")
+        font.setPointSize(14)
+        self.resetButton.setFont(font)
+        self.resetButton.setObjectName("resetButton")
+        self.verticalLayout.addWidget(self.resetButton)
+        self.saveButton = QtWidgets.QPushButton(self.layoutWidget2)
+        font = QtGui.QFont()
+        font.setFamily("Microsoft YaHei UI Light")
+        font.setPointSize(14)
+        self.saveButton.setFont(font)
+        self.saveButton.setObjectName("saveButton")
+        self.verticalLayout.addWidget(self.saveButton)
+        mainWIndow.setCentralWidget(self.centralwidget)
+        self.menubar = QtWidgets.QMenuBar(mainWIndow)
+        self.menubar.setGeometry(QtCore.QRect(0, 0, 1149, 31))
+        self.menubar.setObjectName("menubar")
+        mainWIndow.setMenuBar(self.menubar)
+        self.statusbar = QtWidgets.QStatusBar(mainWIndow)
+        self.statusbar.setObjectName("statusbar")
+        mainWIndow.setStatusBar(self.statusbar)
+
+        self.retranslateUi(mainWIndow)
+        QtCore.QMetaObject.connectSlotsByName(mainWIndow)
+
+    def retranslateUi(self, mainWIndow):
+        _translate = QtCore.QCoreApplication.translate
+        mainWIndow.setWindowTitle(_translate("mainWIndow", "Abstract Image Editor"))
+        self.openButton.setText(_translate("mainWIndow", "Open Image"))
+        self.neonButton.setText(_translate("mainWIndow", "Neon"))
+        self.strieButton.setText(_translate("mainWIndow", "Strié"))
+        self.mintButton.setText(_translate("mainWIndow", "Wild Mint"))
+        self.zeusButton.setText(_translate("mainWIndow", "Zeus"))
+        self.wwButton.setText(_translate("mainWIndow", "Wild West"))
+        self.sketchButton.setText(_translate("mainWIndow", "Sketch"))
+        self.diamondButton.setText(_translate("mainWIndow", "Diamond"))
+        self.dustButton.setText(_translate("mainWIndow", "Dust"))
+        self.patternButton.setText(_translate("mainWIndow", "Pattern"))
+        self.zombieButton.setText(_translate("mainWIndow", "Zombie"))
+        self.neonMetalButton.setText(_translate("mainWIndow", "Neon Metal"))
+        self.brighterButton.setText(_translate("mainWIndow", "Brighter"))
+        self.washLabel.setText(_translate("mainWIndow", "Wash"))
+        self.confettiLabel.setText(_translate("mainWIndow", "Confetti"))
+        self.meltLabel.setText(_translate("mainWIndow", "Melt"))
+        self.resetButton.setText(_translate("mainWIndow", "Reset Image"))
+        self.saveButton.setText(_translate("mainWIndow", "Save Image"))
+from canvas_view import CanvasView
+
+#checksum of the .ui file, see ui_loader
+UI_CHECKSUM = 1130854927
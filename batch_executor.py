@@ -0,0 +1,456 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Spreads batches of images over a pool of processes.
+
+    Every image in flight gets a slot, a block of shared memory owned by this process.
+    The worker decodes the image into its slot, runs the effect chain there and
+    encodes the result straight from it, and images given as arrays are copied into
+    a slot and read back from it, so pixels are never pickled between processes.
+    Slots are reused from one image to the next and there are never more than
+    max_in_flight of them, so memory stays flat however long the batch is.
+    A slot only grows when an image doesn't fit in it.
+
+    Images bigger than raw_canvas.CANVAS_BYTES don't go through a slot, they are decoded into a
+    raw_canvas file in the temp folder (TMPDIR) and edited there a band at a time.
+
+    A failing image is reported and the batch goes on. If a worker process dies,
+    the pool is restarted and its images are tried once more.
+"""
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque, namedtuple
+from multiprocessing import shared_memory
+from random import Random
+from PyQt5.QtGui import QImage
+from PyQt5 import sip
+import multiprocessing
+import os
+import tempfile
+import time
+import numpy as np
+import pipeline
+import tiled_engine
+import brush_engine
+import effects_engine
+import image_writer
+import raw_canvas
+
+PIXEL_CONTENTS = 4
+MEGABYTE = 1024 * 1024
+
+#Fits the largest image the window opens, bigger images grow their slot.
+DEFAULT_SLOT_SIZE = 1500 * 1500 * PIXEL_CONTENTS
+#Jobs waiting per worker, so a worker never idles while its next job is sent.
+IN_FLIGHT_PER_WORKER = 2
+#Times an image is tried when its worker process dies.
+MAX_ATTEMPTS = 2
+
+#Worker processes are started by a fork server, not forked from the thread that asks for
+#them: the window and the render server have other threads running, whose locks a fork would copy.
+POOL_START_METHOD = 'forkserver'
+
+#What a worker sends back.
+DONE = 'done'
+GROW = 'grow'
+ERROR = 'error'
+
+BatchResult = namedtuple('BatchResult', 'index source destination nbytes error')
+
+
+def pool_context():
+    """ The multiprocessing context worker pools are started with, spawn where there is no fork server.
+    """
+    if POOL_START_METHOD in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context(POOL_START_METHOD)
+    return multiprocessing.get_context('spawn')
+
+
+class BatchStats:
+    """ Counts the images and pixel bytes of a batch, for the throughput report.
+        The bytes are those of the decoded pixels, not of the files.
+    """
+    def __init__(self):
+        self.images = 0
+        self.failed = 0
+        self.nbytes = 0
+        self.started = time.perf_counter()
+
+    def add(self, result):
+        if result.error is None:
+            self.images += 1
+            self.nbytes += result.nbytes
+        else:
+            self.failed += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def images_per_second(self):
+        return self.images / max(self.elapsed(), 1e-9)
+
+    def megabytes_per_second(self):
+        return self.nbytes / MEGABYTE / max(self.elapsed(), 1e-9)
+
+    def summary(self):
+        return (f'{self.images} of {self.images + self.failed} images written in {self.elapsed():.2f} s, '
+                f'{self.images_per_second():.2f} images/s, {self.megabytes_per_second():.1f} MB/s.')
+
+
+class SharedSlot:
+    """ A block of shared memory that holds the pixels of one image in flight.
+    """
+    def __init__(self, size):
+        #whole megabytes, so sizes close to each other share a slot
+        size = -(-max(size, 1) // MEGABYTE) * MEGABYTE
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def size(self):
+        return self.memory.size
+
+    def pixels(self, shape):
+        """ Helper to see the start of the slot as a (height, width, 4) uint8 array.
+        """
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.memory.buf)
+
+    def release(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def slot_image(memory, height, width, image_format):
+    """ Helper to wrap the start of a shared memory block in a QImage without copying.
+        The block must stay open while the image is used.
+    """
+    return QImage(sip.voidptr(memory.buf), width, height, width * PIXEL_CONTENTS, image_format)
+
+
+def render_canvas(source, destination, steps, seed, mode, options=image_writer.DEFAULT_OPTIONS):
+    """ Applies a chain to an image through a raw canvas file in the temp folder,
+        the image is never fully in memory.
+
+    Returns:
+        nbytes (int): The pixel bytes of the image.
+    """
+    handle, path = tempfile.mkstemp(suffix='.canvas')
+    os.close(handle)
+    try:
+        canvas = raw_canvas.import_image(source, path)
+        try:
+            tiled_engine.apply_chain(canvas.pixels, steps, Random(seed), mode)
+            image_writer.write_canvas(canvas, destination, options)
+            return canvas.pixels.nbytes
+        finally:
+            canvas.close()
+    finally:
+        os.remove(path)
+
+
+def render_file(slot_name, slot_size, source, destination, steps, seed, mode,
+                options=image_writer.DEFAULT_OPTIONS):
+    """ Worker side of a file job: decode into the slot, apply the chain, encode.
+
+    Returns:
+        outcome (tuple): (DONE, pixel bytes), (GROW, bytes needed) or (ERROR, message).
+    """
+    try:
+        if raw_canvas.decoded_bytes(source) >= raw_canvas.CANVAS_BYTES:
+            return DONE, render_canvas(source, destination, steps, seed, mode, options)
+        image, gray = pipeline.decode_image(source)
+    except (OSError, ValueError, IndexError) as error:
+        return ERROR, str(error)
+
+    height, width = image.height(), image.width()
+    nbytes = height * width * PIXEL_CONTENTS
+    if nbytes > slot_size:
+        return GROW, nbytes
+
+    memory = shared_memory.SharedMemory(name=slot_name)
+    try:
+        pixels = np.ndarray((height, width, PIXEL_CONTENTS), dtype=np.uint8, buffer=memory.buf)
+        pixels[:] = effects_engine.qimage_view(image)
+        image_format = image.format()
+        del image
+        tiled_engine.apply_chain(pixels, steps, Random(seed), mode, gray=gray)
+        del pixels
+        result = slot_image(memory, height, width, image_format)
+        try:
+            pipeline.save_image(result, destination, options)
+        finally:
+            del result
+    except (OSError, ValueError, IndexError) as error:
+        return ERROR, str(error)
+    finally:
+        memory.close()
+    return DONE, nbytes
+
+
+def render_pixels(slot_name, shape, steps, seed, mode):
+    """ Worker side of an array job: the pixels are already in the slot,
+        apply the chain in place.
+
+    Returns:
+        outcome (tuple): (DONE, pixel bytes) or (ERROR, message).
+    """
+    memory = shared_memory.SharedMemory(name=slot_name)
+    try:
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+        tiled_engine.apply_chain(pixels, steps, Random(seed), mode)
+        del pixels
+    except (ValueError, IndexError) as error:
+        return ERROR, str(error)
+    finally:
+        memory.close()
+    return DONE, int(np.prod(shape))
+
+
+class BatchExecutor:
+    """ Runs effect chains on many images with a process pool.
+
+    Args:
+        workers (int): Worker processes, one per CPU if None.
+        max_in_flight (int): Most images being worked on at once,
+        IN_FLIGHT_PER_WORKER per worker if None.
+        mode (str): brush_engine.EXACT or brush_engine.FAST for the brush effects.
+    """
+    def __init__(self, workers=None, max_in_flight=None, mode=brush_engine.EXACT):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.workers * IN_FLIGHT_PER_WORKER
+        self.mode = mode
+        self.pool = None
+        self.free_slots = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Stops the workers and frees the shared memory.
+        """
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        for slot in self.free_slots:
+            slot.release()
+        self.free_slots = []
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=pool_context())
+        return self.pool
+
+    def take_slot(self, size):
+        """ Helper to get a free slot of at least size bytes.
+        """
+        for position, slot in enumerate(self.free_slots):
+            if slot.size >= size:
+                return self.free_slots.pop(position)
+        if self.free_slots:
+            #too small for this image, replace it with a bigger one
+            self.free_slots.pop().release()
+        return SharedSlot(size)
+
+    def run(self, jobs, submit, finish, job_size=None):
+        """ Keeps up to max_in_flight jobs running and yields their results as they finish.
+
+        Args:
+            jobs (iterable): Anything, one per image, read lazily.
+            submit (function): submit(pool, slot, job) sends a job to the pool, returns its future.
+            finish (function): finish(slot, job, outcome) turns a worker outcome into a result.
+            job_size (function): Bytes a job needs, DEFAULT_SLOT_SIZE if None.
+
+        Returns:
+            results (generator): The result of every job, in the order they finish.
+        """
+        jobs = iter(jobs)
+        pending = {}
+        attempts = {}
+        retry = []
+        exhausted = False
+
+        try:
+            while pending or retry or not exhausted:
+                while len(pending) < self.max_in_flight:
+                    if retry:
+                        job, slot = retry.pop()
+                    else:
+                        try:
+                            job = next(jobs)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        slot = self.take_slot(job_size(job) if job_size else DEFAULT_SLOT_SIZE)
+                    future = submit(self.get_pool(), slot, job)
+                    pending[future] = (job, slot)
+                if not pending:
+                    continue
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                crashed = False
+                for future in done:
+                    try:
+                        outcome = future.result()
+                    except BrokenProcessPool:
+                        crashed = True
+                        continue
+                    except Exception as error:
+                        outcome = ERROR, f'{type(error).__name__}: {error}'
+                    job, slot = pending.pop(future)
+
+                    if outcome[0] == GROW:
+                        slot.release()
+                        retry.append((job, SharedSlot(outcome[1])))
+                        continue
+                    result = finish(slot, job, outcome)
+                    self.free_slots.append(slot)
+                    yield result
+
+                if crashed:
+                    #every job still in the dead pool went down with it
+                    self.pool.shutdown(wait=False)
+                    self.pool = None
+                    for job, slot in pending.values():
+                        attempts[id(job)] = attempts.get(id(job), 0) + 1
+                        if attempts[id(job)] < MAX_ATTEMPTS:
+                            retry.append((job, slot))
+                        else:
+                            self.free_slots.append(slot)
+                            yield finish(slot, job, (ERROR, 'worker process died'))
+                    pending = {}
+        finally:
+            #left behind when the caller stops early, close() frees them
+            for job, slot in list(pending.values()) + retry:
+                self.free_slots.append(slot)
+
+    def map_files(self, jobs, options=image_writer.DEFAULT_OPTIONS):
+        """ Applies effect chains to image files.
+
+        Args:
+            jobs (iterable): (source, destination, steps, seed) tuples, read lazily.
+            options (SaveOptions): JPEG quality and PNG compression of the outputs.
+
+        Returns:
+            results (generator): A BatchResult per file, in the order they finish.
+        """
+        def submit(pool, slot, job):
+            index, (source, destination, steps, seed) = job
+            return pool.submit(render_file, slot.name, slot.size, source, destination,
+                               steps, seed, self.mode, options)
+
+        def finish(slot, job, outcome):
+            index, (source, destination, steps, seed) = job
+            status, value = outcome
+            if status == DONE:
+                return BatchResult(index, source, destination, value, None)
+            return BatchResult(index, source, destination, 0, value)
+
+        return self.run(enumerate(jobs), submit, finish)
+
+    def map_pixels(self, jobs):
+        """ Applies effect chains to images already in memory.
+            Every array is changed in place once its result is yielded.
+
+        Args:
+            jobs (iterable): (pixels, steps, seed) tuples, pixels being (height, width, 4) uint8 arrays.
+
+        Returns:
+            results (generator): A BatchResult per array, in the order they finish.
+        """
+        def submit(pool, slot, job):
+            index, (pixels, steps, seed) = job
+            slot.pixels(pixels.shape)[:] = pixels
+            return pool.submit(render_pixels, slot.name, pixels.shape, steps, seed, self.mode)
+
+        def finish(slot, job, outcome):
+            index, (pixels, steps, seed) = job
+            status, value = outcome
+            if status == DONE:
+                pixels[:] = slot.pixels(pixels.shape)
+                return BatchResult(index, None, None, value, None)
+            return BatchResult(index, None, None, 0, value)
+
+        return self.run(enumerate(jobs), submit, finish, lambda job: job[1][0].nbytes)
+
+
+def run_files(jobs, workers=None, max_in_flight=None, mode=brush_engine.EXACT, report=None,
+              options=image_writer.DEFAULT_OPTIONS):
+    """ Runs file jobs and counts them, in this process if there is a single worker.
+
+    Args:
+        jobs (iterable): (source, destination, steps, seed) tuples.
+        workers (int): Worker processes, one per CPU if None.
+        max_in_flight (int): Most images being worked on at once.
+        mode (str): brush_engine.EXACT or brush_engine.FAST for the brush effects.
+        report (function): Called with every BatchResult as it finishes.
+        options (SaveOptions): JPEG quality and PNG compression of the outputs.
+
+    Returns:
+        stats (BatchStats): Counts and throughput of the batch.
+    """
+    stats = BatchStats()
+    executor = None
+    if workers == 1:
+        results = run_serial(jobs, mode, options)
+    else:
+        executor = BatchExecutor(workers, max_in_flight, mode)
+        results = executor.map_files(jobs, options)
+    try:
+        for result in results:
+            stats.add(result)
+            if report is not None:
+                report(result)
+    finally:
+        if executor is not None:
+            executor.close()
+    return stats
+
+
+def run_serial(jobs, mode, options=image_writer.DEFAULT_OPTIONS):
+    """ Helper to run file jobs one after another without a pool.
+        Every image is encoded by an ImageWriter while the next one is worked on,
+        the writer's queue bounds the images held in memory.
+    """
+    written = deque()
+
+    def written_file(index, source, destination, nbytes):
+        def done(error):
+            written.append(BatchResult(index, source, destination, 0 if error else nbytes, error))
+        return done
+
+    with image_writer.ImageWriter() as writer:
+        for index, (source, destination, steps, seed) in enumerate(jobs):
+            try:
+                if raw_canvas.decoded_bytes(source) >= raw_canvas.CANVAS_BYTES:
+                    nbytes = render_canvas(source, destination, steps, seed, mode, options)
+                    yield BatchResult(index, source, destination, nbytes, None)
+                else:
+                    image, gray = pipeline.decode_image(source)
+                    tiled_engine.apply_chain(effects_engine.qimage_view(image), steps, Random(seed), mode, gray=gray)
+                    writer.submit(image, destination, options,
+                                  written_file(index, source, destination, image.sizeInBytes()))
+            except (OSError, ValueError, IndexError) as error:
+                yield BatchResult(index, source, destination, 0, str(error))
+            while written:
+                yield written.popleft()
+    while written:
+        yield written.popleft()
@@ -0,0 +1,410 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Times every effect headless, over synthetic and real images of many sizes.
+
+    Every effect of the window runs on its own: the color effects, the brush effects
+    in the exact mode and Wash in the fast one too, wash with both patterns, melt both ways and confetti.
+    The synthetic images are squares of seeded noise, MIN_IMAGE_SIZE pixels and up,
+    real images are timed at their own size. Every step runs on every engine of ENGINES:
+        pipeline: pipeline.apply_chain() on the whole image at once.
+        tiled: tiled_engine.apply_chain() a band at a time in this process, like the
+        batch and server workers do.
+        bands: tiled_engine.apply_chain() with the bands spread over worker processes,
+        like the window does for large images.
+        batch: the image sent to a worker process of a BatchExecutor and back.
+    Every case runs once to warm up, then repeat times on a fresh copy of the image,
+    and reports the median and p95 time, the megapixels per second at the median,
+    the peak RSS over the timed runs of the process that worked on the pixels (the
+    largest of the worker processes for the bands and batch engines, Linux only), and
+    the most memory Python and NumPy allocated in this process during the warm up run.
+
+    The results can be written to a JSON file and a later run compared against it,
+    cases that got slower by more than the tolerance are reported as regressions.
+    Run it as "python -m abstract_image_editor bench ...".
+"""
+from random import Random
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import effects_engine
+import brush_engine
+import batch_executor
+import pipeline
+import tiled_engine
+
+MEGABYTE = 1024 * 1024
+
+DEFAULT_SIZES = (pipeline.MIN_IMAGE_SIZE, 512, 1500, 3000)
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.2
+MELT_ROWS = 20
+CONFETTI_SQUARES = 1000
+#Seed of the synthetic images and of the confetti positions.
+BENCH_SEED = 1
+#Name of the synthetic images in the results.
+SYNTHETIC = 'noise'
+
+#How a step is run, see run_step().
+PIPELINE = 'pipeline'
+TILED = 'tiled'
+BANDS = 'bands'
+BATCH = 'batch'
+ENGINES = (PIPELINE, TILED, BANDS, BATCH)
+
+
+def default_steps():
+    """ Helper to list the steps timed when none are asked for, every effect of the window.
+    """
+    steps = [(name, None) for name in effects_engine.COLOR_EFFECTS]
+    steps += [(name, None) for name in pipeline.BRUSH_PATTERNS]
+    steps += [('wash', pattern) for pattern in pipeline.WASH_PATTERNS]
+    steps += [('melt', MELT_ROWS), ('melt', -MELT_ROWS), ('confetti', CONFETTI_SQUARES)]
+    return steps
+
+
+def step_modes(step, modes):
+    """ Helper to get the modes a step is timed in, only the effects of brush_engine.FAST_EFFECTS have two.
+    """
+    if step[0] in brush_engine.FAST_EFFECTS:
+        return modes
+    return (brush_engine.EXACT,)
+
+
+def synthetic_image(size):
+    """ Makes a square image of seeded noise, the same for every run.
+
+    Returns:
+        pixels (ndarray): (size, size, 4) uint8 BGRA array, opaque.
+    """
+    generator = np.random.default_rng(BENCH_SEED)
+    pixels = generator.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    return pixels
+
+
+def image_pixels(path):
+    """ Reads an image file the way the window does.
+
+    Returns:
+        pixels (ndarray): (height, width, 4) uint8 BGRA array, a copy.
+    """
+    return effects_engine.qimage_view(pipeline.load_image(path)).copy()
+
+
+def run_step(pixels, step, mode, engine, executors):
+    """ Helper to apply a step in place with an engine of ENGINES.
+
+    Args:
+        executors (dict): A BatchExecutor per brush mode, for the bands and batch engines.
+    """
+    rand = Random(BENCH_SEED)
+    if engine == PIPELINE:
+        pipeline.apply_chain(pixels, [step], rand, mode)
+    elif engine == TILED:
+        tiled_engine.apply_chain(pixels, [step], rand, mode)
+    elif engine == BANDS:
+        tiled_engine.apply_chain(pixels, [step], rand, mode, executors[mode])
+    else:
+        for result in executors[mode].map_pixels([(pixels, [step], BENCH_SEED)]):
+            if result.error is not None:
+                raise ValueError(result.error)
+
+
+def engine_processes(engine, pixels):
+    """ Helper to get the ids of the processes an engine works on the pixels in.
+        The worker processes only exist once the engine has run, and the bands engine
+        works in this process on images that fit in a single band.
+    """
+    height, width = pixels.shape[:2]
+    if engine == BATCH or (engine == BANDS and height > tiled_engine.tile_rows_for(width)):
+        return [process.pid for process in multiprocessing.active_children()]
+    return [os.getpid()]
+
+
+def reset_peak_rss(pids):
+    """ Helper to start the peak RSS of processes over from their current RSS, see peak_rss().
+    """
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+        except OSError:
+            pass
+
+
+def peak_rss(pids):
+    """ Helper to get the largest peak RSS of processes, in bytes.
+        It is read from /proc, so it is None on systems other than Linux.
+    """
+    peaks = []
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as status:
+                peaks += [int(line.split()[1]) * 1024 for line in status if line.startswith('VmHWM:')]
+        except OSError:
+            return None
+    return max(peaks) if peaks else None
+
+
+def time_step(pixels, step, mode, repeat, engine=PIPELINE, executors=None):
+    """ Times a step on fresh copies of an image, after a run to warm up.
+        The warm up run is traced to find the most memory Python and NumPy allocate,
+        the timed runs are not, tracing slows allocations down. The peak RSS is
+        measured over the timed runs.
+
+    Returns:
+        samples (list): Seconds of every timed run.
+        rss (int): Peak RSS of the processes of the engine during the timed runs, None if unknown.
+        traced (int): Most bytes allocated at once in this process during the warm up run.
+    """
+    work = np.empty_like(pixels)
+    samples = []
+    tracemalloc.start()
+    try:
+        #the first run pays for caches, lookup tables and starting the workers
+        np.copyto(work, pixels)
+        run_step(work, step, mode, engine, executors)
+    finally:
+        traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    pids = engine_processes(engine, pixels)
+    reset_peak_rss(pids)
+    for run in range(repeat):
+        np.copyto(work, pixels)
+        start = time.perf_counter()
+        run_step(work, step, mode, engine, executors)
+        samples.append(time.perf_counter() - start)
+    return samples, peak_rss(pids), traced
+
+
+def percentile(samples, share):
+    """ Helper to get the nearest rank percentile of a list of numbers, share from 0 to 1.
+    """
+    ordered = sorted(samples)
+    rank = max(1, int(np.ceil(share * len(ordered))))
+    return ordered[rank - 1]
+
+
+def run_cases(images, steps, modes, repeat, report=None, engines=(PIPELINE,), executors=None):
+    """ Times every step in every mode on every engine over every image.
+
+    Args:
+        images (list): (name, pixels) tuples, pixels a (height, width, 4) uint8 array.
+        steps (list): Steps from pipeline.parse_chain.
+        modes (tuple): Modes the brush effects are timed in.
+        repeat (int): Timed runs of every case.
+        report (function): Called with every result as soon as it is known.
+        engines (tuple): Engines from ENGINES.
+        executors (dict): A BatchExecutor per brush mode, needed by the bands and batch engines.
+
+    Returns:
+        results (list): A dict per case, see case_result().
+    """
+    results = []
+    for name, pixels in images:
+        for step in steps:
+            for mode in step_modes(step, modes):
+                for engine in engines:
+                    samples, rss, traced = time_step(pixels, step, mode, repeat, engine, executors)
+                    result = case_result(name, pixels.shape, step, mode, samples, engine, rss, traced)
+                    results.append(result)
+                    if report is not None:
+                        report(result)
+    return results
+
+
+def case_result(image, shape, step, mode, samples, engine=PIPELINE, rss=None, traced=0):
+    """ Helper to sum up the runs of a case.
+
+    Returns:
+        result (dict): effect, mode, engine, image, height, width, runs, median_ms, p95_ms,
+        megapixels_per_s, peak_rss_mb (None if unknown) and traced_peak_mb, see time_step().
+    """
+    height, width = shape[:2]
+    median = float(np.median(samples))
+    return {
+        'effect': pipeline.format_chain([step]),
+        'mode': mode,
+        'engine': engine,
+        'image': image,
+        'height': height,
+        'width': width,
+        'runs': len(samples),
+        'median_ms': median * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'megapixels_per_s': height * width / 1e6 / max(median, 1e-9),
+        'peak_rss_mb': None if rss is None else rss / MEGABYTE,
+        'traced_peak_mb': traced / MEGABYTE,
+    }
+
+
+def case_key(result):
+    #results written before the engines were timed are all pipeline ones
+    return (result['effect'], result['mode'], result.get('engine', PIPELINE), result['image'],
+            result['height'], result['width'])
+
+
+def format_result(result):
+    """ Helper to write a result as a line of the report.
+    """
+    rss = '-' if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:.0f} MB"
+    return (f"{result['effect']:<15} {result['mode']:<5} {result['engine']:<8} {result['image']:<12} "
+            f"{result['width']:>5}x{result['height']:<5} median {result['median_ms']:10.2f} ms  "
+            f"p95 {result['p95_ms']:10.2f} ms  {result['megapixels_per_s']:9.1f} MP/s  "
+            f"peak RSS {rss}  traced {result['traced_peak_mb']:.1f} MB")
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Finds the cases that got slower than in an earlier run.
+
+    Args:
+        results (list): Results of this run.
+        baseline (list): Results of the earlier run, cases missing from either are skipped.
+        tolerance (float): Share the median can grow by before it counts as slower.
+
+    Returns:
+        regressions (list): (result, earlier result) of the cases that got slower.
+    """
+    earlier = {case_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = earlier.get(case_key(result))
+        if old is not None and result['median_ms'] > old['median_ms'] * (1 + tolerance):
+            regressions.append((result, old))
+    return regressions
+
+
+def run_info():
+    """ Helper to describe what the benchmark ran on, stored with the results.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def build_parser():
+    """ Helper to build the command line arguments of the bench command.
+    """
+    parser = argparse.ArgumentParser(prog='python -m abstract_image_editor bench',
+                                     description='Time every effect over synthetic and real images.')
+    parser.add_argument('images', nargs='*', help='real image files, folders or glob patterns, timed at their size')
+    parser.add_argument('-s', '--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='sides of the synthetic images, comma separated, empty for none '
+                             f'(default: {",".join(str(size) for size in DEFAULT_SIZES)})')
+    parser.add_argument('-e', '--effects', help='only time these steps, e.g. "neon,melt:20" (default: every effect)')
+    parser.add_argument('-r', '--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f'timed runs of every case (default: {DEFAULT_REPEAT})')
+    parser.add_argument('--mode', choices=(brush_engine.EXACT, brush_engine.FAST, 'both'), default='both',
+                        help='brush modes to time, fast only applies to wash (default: both)')
+    parser.add_argument('--engines', default=','.join(ENGINES),
+                        help=f'engines to time, comma separated (default: {",".join(ENGINES)})')
+    parser.add_argument('--json', dest='json_path', help='write the results to this file')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'share a median can grow by before it is a regression (default: {DEFAULT_TOLERANCE})')
+    return parser
+
+
+def main(argv=None):
+    """ Bench command entry point.
+
+    Args:
+        argv (list): Command line arguments after "bench", sys.argv if None.
+
+    Returns:
+        status (int): 0, 1 if a case got slower than in the compared run, 2 for bad arguments.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+        steps = default_steps() if args.effects is None else pipeline.parse_chain(args.effects)
+    except ValueError as error:
+        parser.error(str(error))
+    if any(size < pipeline.MIN_IMAGE_SIZE for size in sizes):
+        parser.error(f'sizes must be at least {pipeline.MIN_IMAGE_SIZE}')
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    modes = (brush_engine.EXACT, brush_engine.FAST) if args.mode == 'both' else (args.mode,)
+    engines = tuple(engine for engine in args.engines.split(',') if engine)
+    if not engines or any(engine not in ENGINES for engine in engines):
+        parser.error(f'engines must be some of {", ".join(ENGINES)}')
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    #started on first use, so the pipeline and tiled engines alone start no worker
+    executors = {mode: batch_executor.BatchExecutor(mode=mode) for mode in (brush_engine.EXACT, brush_engine.FAST)}
+
+    def report(result):
+        print(format_result(result), flush=True)
+
+    results = []
+    try:
+        for size in sizes:
+            results += run_cases([(SYNTHETIC, synthetic_image(size))], steps, modes, args.repeat,
+                                 report, engines, executors)
+        for path in pipeline.expand_inputs(args.images):
+            try:
+                pixels = image_pixels(path)
+            except (OSError, ValueError) as error:
+                print(f'{path}: {error}', file=sys.stderr)
+                continue
+            results += run_cases([(os.path.basename(path), pixels)], steps, modes, args.repeat,
+                                 report, engines, executors)
+            del pixels
+    finally:
+        for executor in executors.values():
+            executor.close()
+
+    if args.json_path is not None:
+        with open(args.json_path, 'w') as results_file:
+            json.dump({'info': run_info(), 'repeat': args.repeat, 'results': results}, results_file, indent=2)
+
+    if baseline is None:
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for result, old in regressions:
+        print(f"slower: {result['effect']} {result['mode']} {result['engine']} {result['image']} {result['width']}x{result['height']} "
+              f"{old['median_ms']:.2f} ms -> {result['median_ms']:.2f} ms", file=sys.stderr)
+    print(f'{len(regressions)} of {len(results)} cases slower than {args.compare} by more than '
+          f'{args.tolerance:.0%}.')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Opens image files into a WorkingCanvas on a background thread.
+
+    Decoding a large photo takes seconds, so the window shows a copy decoded at the
+    size of the label first, see pipeline.load_scaled_image(), and the full image is
+    decoded here meanwhile. There is a single open at a time: opening another file,
+    or cancelling, makes the open running stale, and the canvas it makes is closed
+    as soon as it is done instead of being handed over.
+"""
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+import threading
+import lazy_modules
+#working_canvas brings NumPy in, it waits until an image is opened
+working_canvas = lazy_modules.lazy_import('working_canvas')
+
+
+class OpenJob(QRunnable):
+    """ Decodes a file on the thread pool and hands the canvas to its CanvasOpener.
+    """
+    def __init__(self, opener, path, ticket):
+        super(OpenJob, self).__init__()
+        self.opener = opener
+        self.path = path
+        self.ticket = ticket
+
+    def run(self):
+        if self.opener.stale(self.ticket):
+            return
+        try:
+            canvas = working_canvas.open_canvas(self.path)
+            error = None
+        except (OSError, ValueError) as error_raised:
+            canvas = None
+            error = str(error_raised)
+        self.opener.finish(self.ticket, canvas, error)
+
+
+class CanvasOpener(QObject):
+    """ Opens a file at a time on its own thread. The window takes the result
+        with take() once finished is emitted, or after wait().
+
+    Args:
+        parent (QObject): Owner of the opener, e.g. the window.
+    """
+    #the open is over, take() gets its canvas
+    finished = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super(CanvasOpener, self).__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.lock = threading.Lock()
+        #the open running is the one with this ticket, older ones are stale
+        self.ticket = 0
+        self.pending = False
+        #(canvas, error) of the open that finished, until taken
+        self.result = None
+
+    def open(self, path):
+        """ Starts opening a file, the open running before is made stale.
+
+        Args:
+            path (str): Image file path.
+        """
+        self.cancel()
+        with self.lock:
+            self.pending = True
+            ticket = self.ticket
+        self.pool.start(OpenJob(self, path, ticket))
+
+    def stale(self, ticket):
+        """ Helper to tell if an open was replaced or cancelled since it was started.
+        """
+        with self.lock:
+            return ticket != self.ticket
+
+    def busy(self):
+        """ Tells if an open was started and its canvas not taken yet.
+        """
+        return self.pending
+
+    def finish(self, ticket, canvas, error):
+        """ Helper for OpenJob to hand over its canvas, or the message of its error.
+        """
+        with self.lock:
+            stale = ticket != self.ticket
+            if not stale:
+                self.result = (canvas, error)
+        if stale:
+            if canvas is not None:
+                canvas.close()
+            return
+        self.finished.emit()
+
+    def take(self):
+        """ Takes the result of the open that finished.
+
+        Returns:
+            canvas (WorkingCanvas): The open image, None if it failed or if there is nothing to take.
+            error (str): Why it failed, None if it didn't.
+        """
+        with self.lock:
+            result = self.result
+            self.result = None
+            if result is None:
+                return None, None
+            self.pending = False
+        return result
+
+    def wait(self):
+        """ Blocks until the open running is over.
+        """
+        self.pool.waitForDone()
+
+    def cancel(self):
+        """ Makes the open running stale, its canvas is closed once it is done.
+            Call wait() to be sure it is, e.g. before quitting.
+        """
+        with self.lock:
+            self.ticket += 1
+            self.pending = False
+            result = self.result
+            self.result = None
+        if result is not None and result[0] is not None:
+            result[0].close()
@@ -0,0 +1,178 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" The label the image is shown on, updated only where the image changed.
+
+    The label keeps its own copy of the image, reduced by a whole factor so it is
+    less than twice the size of the label: every pixel of the copy is the average of
+    a factor by factor block of the image. The copy is drawn scaled to the label
+    when the label is painted, and Qt only paints the parts of the label that were
+    marked for update.
+
+    When the image changes, only the blocks under the changed rectangles are
+    averaged again and only the parts of the label over them are painted, so
+    a confetti square costs about its own size instead of a pass over the image.
+    The copy is the same whether a part of it or all of it was worked out again.
+"""
+from PyQt5.QtCore import QRect, QRectF
+from PyQt5.QtGui import QImage, QPainter
+from PyQt5.QtWidgets import QLabel
+import math
+import lazy_modules
+import profiler
+#NumPy and the reductions wait for the first image shown
+np = lazy_modules.lazy_import('numpy')
+effects_engine = lazy_modules.lazy_import('effects_engine')
+
+#Rows of blocks averaged at a time when the whole image is reduced.
+BAND_BLOCKS = 64
+#Past this share of the image, the changed rectangles are updated as a whole image.
+FULL_UPDATE_SHARE = 0.5
+
+
+def reduce_factor(height, width, label_height, label_width):
+    """ Helper to get the whole factor that makes an image less than twice the size of a label.
+    """
+    return max(1, min(height // max(1, label_height), width // max(1, label_width)))
+
+
+def reduce_blocks(pixels, factor, out, top, bottom, left, right, opaque):
+    """ Averages the factor by factor blocks of a part of an image.
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 array, the image.
+        factor (int): Side of a block.
+        out (ndarray): (height // factor, width // factor, 4) uint8 array that gets the averages.
+        top, bottom, left, right (int): Part of out to work out, in blocks.
+        opaque (bool): The image has no alpha, the 4th byte of out is set to 255.
+    """
+    source = pixels[top * factor:bottom * factor, left * factor:right * factor]
+    if factor == 1:
+        out[top:bottom, left:right] = source
+    else:
+        blocks = source.reshape(bottom - top, factor, right - left, factor, 4)
+        total = blocks.sum(axis=(1, 3), dtype=np.uint32)
+        area = factor * factor
+        out[top:bottom, left:right] = (total + area // 2) // area
+    if opaque:
+        effects_engine.fill_unused_byte(out[top:bottom, left:right])
+
+
+class CanvasView(QLabel):
+    """ QLabel that shows an image through a reduced copy, see show_image().
+        It is the imageLabel of abstract_image_editor.ui.
+    """
+    def __init__(self, parent=None):
+        super(CanvasView, self).__init__(parent)
+        self.reduced = None
+        self.reduced_pixels = None
+        self.factor = 1
+        #what the copy was made from
+        self.source = None
+
+    def show_image(self, source, rects=None):
+        """ Shows an image, or the parts of it that changed since it was last shown.
+            The caller holds whatever lock guards the image.
+
+        Args:
+            source (object): Holds the image as image (QImage) and pixels (ndarray),
+            e.g. a WorkingCanvas or a ProxyPreview.
+            rects (list): (top, bottom, left, right) of the changed parts, in pixels of the image.
+            None if it all changed. Ignored if the image isn't the one shown.
+        """
+        with profiler.span('reduce') as span:
+            span.nbytes = self.reduce_image(source, rects)
+
+    def reduce_image(self, source, rects):
+        """ Helper to work out the copy again where the image changed, see show_image().
+
+        Returns:
+            nbytes (int): Bytes of the image averaged.
+        """
+        pixels = source.pixels
+        image_format = source.image.format()
+        height, width = pixels.shape[:2]
+        factor = reduce_factor(height, width, self.height(), self.width())
+        fresh = (self.reduced is None or source is not self.source or factor != self.factor
+                 or self.reduced.format() != image_format)
+        if fresh or rects is None or self.changed_area(rects) > FULL_UPDATE_SHARE * height * width:
+            self.factor = factor
+            self.reduced = QImage(width // factor, height // factor, image_format)
+            self.reduced_pixels = effects_engine.qimage_view(self.reduced)
+            self.source = source
+            rows = self.reduced.height()
+            for top in range(0, rows, BAND_BLOCKS):
+                reduce_blocks(pixels, factor, self.reduced_pixels, top, min(rows, top + BAND_BLOCKS),
+                              0, self.reduced.width(), self.opaque())
+            self.update()
+            return pixels.nbytes
+
+        rows, columns = self.reduced_pixels.shape[:2]
+        nbytes = 0
+        for top, bottom, left, right in rects:
+            #the blocks the rectangle touches, the ones cut by the edge of the image are left out
+            block_top, block_left = top // factor, left // factor
+            block_bottom = min(rows, -(-bottom // factor))
+            block_right = min(columns, -(-right // factor))
+            if block_top >= block_bottom or block_left >= block_right:
+                continue
+            reduce_blocks(pixels, factor, self.reduced_pixels, block_top, block_bottom, block_left, block_right,
+                          self.opaque())
+            self.update(self.label_rect(block_top, block_bottom, block_left, block_right))
+            nbytes += (block_bottom - block_top) * (block_right - block_left) * factor * factor * pixels.shape[2]
+        return nbytes
+
+    def clear_image(self):
+        """ Forgets the image, e.g. when it is closed.
+        """
+        self.reduced = None
+        self.reduced_pixels = None
+        self.source = None
+        self.update()
+
+    def opaque(self):
+        return not self.reduced.hasAlphaChannel()
+
+    def changed_area(self, rects):
+        """ Helper to add up the pixels of the changed rectangles.
+        """
+        return sum((bottom - top) * (right - left) for top, bottom, left, right in rects)
+
+    def label_rect(self, top, bottom, left, right):
+        """ Helper to get the part of the label a part of the reduced copy is drawn on.
+            Smooth scaling blends every pixel with its neighbours, so the part grows
+            by a pixel of the copy on every side.
+        """
+        contents = self.contentsRect()
+        scale_x = contents.width() / self.reduced.width()
+        scale_y = contents.height() / self.reduced.height()
+        x0 = contents.x() + math.floor((left - 1) * scale_x)
+        x1 = contents.x() + math.ceil((right + 1) * scale_x)
+        y0 = contents.y() + math.floor((top - 1) * scale_y)
+        y1 = contents.y() + math.ceil((bottom + 1) * scale_y)
+        return QRect(x0, y0, x1 - x0, y1 - y0).intersected(contents)
+
+    def paintEvent(self, event):
+        if self.reduced is None:
+            super(CanvasView, self).paintEvent(event)
+            return
+        area = event.rect().intersected(self.contentsRect())
+        with profiler.span('paint', nbytes=area.width() * area.height() * 4):
+            painter = QPainter(self)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            #Qt clips to the parts marked for update, only those are scaled
+            painter.drawImage(QRectF(self.contentsRect()), self.reduced, QRectF(self.reduced.rect()))
+            painter.end()
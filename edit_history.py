@@ -0,0 +1,315 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Undo and redo for the window, keeping only the parts of the image every edit changed.
+
+    An edit is stored as the TILE_SIZE by TILE_SIZE tiles it changed, back to back
+    changed tiles of a row of tiles joined in a single run, with their bytes from
+    before and after the edit compressed. Confetti only stores its squares and Melt
+    the rows it moved, and undoing or redoing an edit only writes those tiles back.
+    When the rectangles an edit can have changed are known, only the tiles under
+    them are compared, see rect_runs().
+
+    An edit can carry a tag, e.g. the effect chain the image was made with, to be
+    put back along with the pixels, see tag().
+
+    The history holds at most MAX_EDITS edits. Once the compressed edits in memory
+    go over the memory budget, the least recently used ones are written to files in
+    the temp folder and read back when they are undone or redone.
+"""
+import os
+import tempfile
+import threading
+import zlib
+import numpy as np
+
+PIXEL_CONTENTS = 4
+MEGABYTE = 1024 * 1024
+
+TILE_SIZE = 64
+#zlib level, the tiles are compressed as the edits come in, so fast beats small.
+COMPRESSION = 1
+MEMORY_BUDGET = 256 * MEGABYTE
+MAX_EDITS = 100
+
+
+def join_tiles(changed):
+    """ Helper to join back to back changed tiles of a row of tiles.
+
+    Returns:
+        spans (list): (first tile, last tile + 1) of every run.
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], changed.astype(np.int8), [0]))))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def changed_runs(before, after, tile_size=TILE_SIZE, candidates=None):
+    """ Finds the tiles that differ between two images, a row of tiles at a time.
+
+    Args:
+        before (ndarray): (height, width, 4) uint8 array.
+        after (ndarray): Array of the same shape.
+        tile_size (int): Side of a tile in pixels.
+        candidates (list): Runs of tiles to compare, as rect_runs() gives them,
+        the tiles outside them are taken as unchanged. Every tile if None.
+
+    Returns:
+        runs (list): (first row, last row + 1, first column, last column + 1) of every
+        run of changed tiles, in the order they are in the image.
+    """
+    height, width = before.shape[:2]
+    if candidates is None:
+        candidates = [(top, min(height, top + tile_size), 0, width) for top in range(0, height, tile_size)]
+    runs = []
+    for top, bottom, left, right in candidates:
+        #a pixel is 4 bytes, compare them as one number
+        old = before[top:bottom, left:right].view(np.uint32)[..., 0]
+        new = after[top:bottom, left:right].view(np.uint32)[..., 0]
+        columns = (old != new).any(axis=0)
+        changed = np.add.reduceat(columns, np.arange(0, right - left, tile_size)) > 0
+        for first, last in join_tiles(changed):
+            runs.append((top, bottom, left + first * tile_size, min(right, left + last * tile_size)))
+    return runs
+
+
+def rect_runs(rects, height, width, tile_size=TILE_SIZE):
+    """ Finds the runs of tiles under rectangles, the only ones an edit that
+        reported them can have changed.
+
+    Args:
+        rects (list): (top, bottom, left, right) rectangles, clipped to the image.
+        height (int): Height of the image.
+        width (int): Width of the image.
+        tile_size (int): Side of a tile in pixels.
+
+    Returns:
+        runs (list): Runs shaped like the ones of changed_runs(), in the order they are in the image.
+    """
+    tiles = np.zeros((-(-height // tile_size), -(-width // tile_size)), dtype=bool)
+    for top, bottom, left, right in rects:
+        top, bottom = max(0, top), min(height, bottom)
+        left, right = max(0, left), min(width, right)
+        if top < bottom and left < right:
+            tiles[top // tile_size:-(-bottom // tile_size), left // tile_size:-(-right // tile_size)] = True
+    runs = []
+    for row, changed in enumerate(tiles):
+        top = row * tile_size
+        for first, last in join_tiles(changed):
+            runs.append((top, min(height, top + tile_size), first * tile_size, min(width, last * tile_size)))
+    return runs
+
+
+def pack_runs(pixels, runs):
+    """ Helper to compress the bytes of the runs of an image, one after another.
+    """
+    compressor = zlib.compressobj(COMPRESSION)
+    data = [compressor.compress(np.ascontiguousarray(pixels[top:bottom, left:right]))
+            for top, bottom, left, right in runs]
+    data.append(compressor.flush())
+    return b''.join(data)
+
+
+def unpack_runs(pixels, runs, packed):
+    """ Helper to write runs compressed by pack_runs back into an image.
+    """
+    data = zlib.decompress(packed)
+    offset = 0
+    for top, bottom, left, right in runs:
+        shape = (bottom - top, right - left, PIXEL_CONTENTS)
+        size = shape[0] * shape[1] * PIXEL_CONTENTS
+        pixels[top:bottom, left:right] = np.frombuffer(data, np.uint8, size, offset).reshape(shape)
+        offset += size
+
+
+class Edit:
+    """ The tiles an edit changed, before and after it.
+        The bytes are kept in memory, or in a file once the edit is evicted.
+    """
+    def __init__(self, runs, before, after, tag=None):
+        self.runs = runs
+        self.tag = tag
+        self.before = before
+        self.after = after
+        self.nbytes = len(before) + len(after)
+        #where the bytes from after the edit start in the file
+        self.split = len(before)
+        self.path = None
+        self.last_used = 0
+
+    def in_memory(self):
+        return self.path is None
+
+    def evict(self, folder):
+        """ Moves the bytes to a file.
+        """
+        handle, self.path = tempfile.mkstemp(suffix='.edit', dir=folder)
+        with os.fdopen(handle, 'wb') as edit_file:
+            edit_file.write(self.before)
+            edit_file.write(self.after)
+        self.before = None
+        self.after = None
+
+    def restore(self):
+        """ Moves the bytes back from the file into memory.
+        """
+        with open(self.path, 'rb') as edit_file:
+            data = edit_file.read()
+        self.before = data[:self.split]
+        self.after = data[self.split:]
+        self.discard()
+
+    def discard(self):
+        """ Deletes the file, if any.
+        """
+        if self.path is not None:
+            os.remove(self.path)
+            self.path = None
+
+
+class EditHistory:
+    """ Undo and redo stacks of the edits made to an image.
+
+    Args:
+        memory_budget (int): Bytes of compressed edits kept in memory.
+        max_edits (int): Most edits that can be undone.
+        folder (str): Where evicted edits go, the temp folder if None.
+    """
+    def __init__(self, memory_budget=MEMORY_BUDGET, max_edits=MAX_EDITS, folder=None):
+        self.memory_budget = memory_budget
+        self.max_edits = max_edits
+        self.folder = folder
+        self.done = []
+        self.undone = []
+        #tag of the image under the oldest edit kept
+        self.base_tag = None
+        self.uses = 0
+        #edits are recorded by the render thread and undone by the window
+        self.lock = threading.Lock()
+
+    def record(self, before, after, tag=None, rects=None):
+        """ Stores the change between two images as an edit that can be undone.
+            A new edit can't be redone past, so the undone edits are forgotten.
+
+        Args:
+            before (ndarray): (height, width, 4) uint8 array, the image before the edit.
+            after (ndarray): The image after the edit.
+            tag (object): Kept with the edit, see tag().
+            rects (list): (top, bottom, left, right) rectangles the images can differ in,
+            the whole images are compared if None.
+
+        Returns:
+            edit (Edit): The new edit, None if nothing changed and there is no tag.
+        """
+        candidates = None
+        if rects is not None:
+            candidates = rect_runs(rects, *before.shape[:2])
+        runs = changed_runs(before, after, candidates=candidates)
+        if not runs and tag is None:
+            return None
+        edit = Edit(runs, pack_runs(before, runs), pack_runs(after, runs), tag)
+        with self.lock:
+            self.touch(edit)
+            self.done.append(edit)
+            for forgotten in self.undone:
+                forgotten.discard()
+            self.undone = []
+            while len(self.done) > self.max_edits:
+                forgotten = self.done.pop(0)
+                forgotten.discard()
+                self.base_tag = forgotten.tag
+            self.fit_budget()
+        return edit
+
+    def undo(self, pixels):
+        """ Puts back the tiles of the last edit as they were before it.
+
+        Returns:
+            edit (Edit): The edit undone, None if there was nothing to undo.
+        """
+        with self.lock:
+            if not self.done:
+                return None
+            edit = self.done.pop()
+            unpack_runs(pixels, edit.runs, self.load(edit).before)
+            self.undone.append(edit)
+        return edit
+
+    def redo(self, pixels):
+        """ Makes the last undone edit again.
+
+        Returns:
+            edit (Edit): The edit redone, None if there was nothing to redo.
+        """
+        with self.lock:
+            if not self.undone:
+                return None
+            edit = self.undone.pop()
+            unpack_runs(pixels, edit.runs, self.load(edit).after)
+            self.done.append(edit)
+        return edit
+
+    def tag(self):
+        """ Gets the tag of the image as it is now: the tag of the last edit not undone,
+            None if every edit was undone.
+        """
+        with self.lock:
+            return self.done[-1].tag if self.done else self.base_tag
+
+    def can_undo(self):
+        return bool(self.done)
+
+    def can_redo(self):
+        return bool(self.undone)
+
+    def memory_bytes(self):
+        """ Helper to count the bytes of the edits held in memory.
+        """
+        return sum(edit.nbytes for edit in self.done + self.undone if edit.in_memory())
+
+    def clear(self):
+        """ Forgets every edit and deletes their files.
+        """
+        with self.lock:
+            for edit in self.done + self.undone:
+                edit.discard()
+            self.done = []
+            self.undone = []
+            self.base_tag = None
+
+    def touch(self, edit):
+        self.uses += 1
+        edit.last_used = self.uses
+
+    def load(self, edit):
+        """ Helper to bring an edit back into memory when it is used.
+        """
+        if not edit.in_memory():
+            edit.restore()
+        self.touch(edit)
+        self.fit_budget()
+        return edit
+
+    def fit_budget(self):
+        """ Helper to evict the least recently used edits until the rest fit in the budget.
+        """
+        in_memory = sorted((edit for edit in self.done + self.undone if edit.in_memory()),
+                           key=lambda edit: edit.last_used)
+        total = sum(edit.nbytes for edit in in_memory)
+        for edit in in_memory:
+            if total <= self.memory_budget:
+                break
+            edit.evict(self.folder)
+            total -= edit.nbytes
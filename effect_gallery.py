@@ -0,0 +1,178 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" The Gallery panel of the window: every effect button tried on the image at once.
+
+    The image is scaled down once to fit THUMBNAIL_SIZE, and every effect is rendered
+    on its own copy of that proxy. The copies are spread over a pool of worker processes,
+    see batch_executor.BatchExecutor.map_pixels(), and every thumbnail is shown as soon
+    as its effect is done. Clicking a thumbnail applies its effect to the image at full
+    resolution, the same way its button does.
+
+    While the panel is shown, the thumbnails are worked out again once the image has
+    stayed the same for REFRESH_DELAY. A refresh makes the one running stale: it runs to
+    the end, since its workers write into shared memory, but its thumbnails are dropped.
+"""
+from PyQt5.QtCore import QRunnable, QSize, QThreadPool, QTimer, pyqtSignal
+from PyQt5.QtGui import QIcon, QImage, QPixmap
+from PyQt5.QtWidgets import QDockWidget, QListView, QListWidget, QListWidgetItem
+import threading
+import lazy_modules
+#the thumbnails are rendered with the engines, they wait for the first image
+batch_executor = lazy_modules.lazy_import('batch_executor')
+effects_engine = lazy_modules.lazy_import('effects_engine')
+proxy_preview = lazy_modules.lazy_import('proxy_preview')
+
+#Longest side of a thumbnail, in pixels.
+THUMBNAIL_SIZE = 160
+#Milliseconds the image has to stay the same before the thumbnails are worked out again.
+REFRESH_DELAY = 300
+PIXEL_CONTENTS = 4
+
+
+class GalleryJob(QRunnable):
+    """ Renders the thumbnails of a refresh on the worker processes of its GalleryPanel.
+    """
+    def __init__(self, gallery, ticket, thumbnails, steps):
+        super(GalleryJob, self).__init__()
+        self.gallery = gallery
+        self.ticket = ticket
+        self.thumbnails = thumbnails
+        self.steps = steps
+
+    def run(self):
+        jobs = [(pixels, steps, None) for pixels, steps in zip(self.thumbnails, self.steps)]
+        for result in self.gallery.pool_executor().map_pixels(jobs):
+            if not self.gallery.stale(self.ticket):
+                self.gallery.rendered.emit(self.ticket, result.index, result.error or '')
+
+
+class GalleryPanel(QDockWidget):
+    """ Dock with a thumbnail per effect, see image_changed() and chosen.
+
+    Args:
+        effects (list): (title, step) of every thumbnail, step being a (name, setting) tuple.
+        parent (QWidget): The window.
+    """
+    #a thumbnail is done: the refresh it belongs to, its position and why it failed or an empty string
+    rendered = pyqtSignal(int, int, str)
+    #a thumbnail was clicked, its position
+    chosen = pyqtSignal(int)
+
+    def __init__(self, effects, parent=None):
+        super(GalleryPanel, self).__init__("Gallery", parent)
+        self.effects = effects
+        self.thumbnail_list = QListWidget()
+        self.thumbnail_list.setViewMode(QListView.IconMode)
+        self.thumbnail_list.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.thumbnail_list.setResizeMode(QListView.Adjust)
+        self.thumbnail_list.setMovement(QListView.Static)
+        for title, step in effects:
+            QListWidgetItem(title, self.thumbnail_list)
+        self.thumbnail_list.itemClicked.connect(lambda item: self.chosen.emit(self.thumbnail_list.row(item)))
+        self.setWidget(self.thumbnail_list)
+
+        self.canvas = None
+        #the image changed since the thumbnails were worked out
+        self.changed = True
+        self.thumbnails = []
+        self.thumbnail_format = QImage.Format_RGB32
+        self.ticket = 0
+        self.lock = threading.Lock()
+        self.executor = None
+        #one refresh at a time, its workers do the rendering
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(REFRESH_DELAY)
+        self.timer.timeout.connect(self.refresh)
+        self.rendered.connect(self.show_thumbnail)
+        self.visibilityChanged.connect(self.shown)
+
+    def image_changed(self, canvas):
+        """ Called by the window whenever the image changes.
+
+        Args:
+            canvas (WorkingCanvas): The open image, None if there is none.
+        """
+        self.canvas = canvas
+        self.changed = True
+        if canvas is None:
+            self.refresh()
+        elif self.isVisible():
+            self.timer.start()
+
+    def shown(self, visible):
+        """ Works the thumbnails out only while they can be seen.
+        """
+        if visible and self.changed:
+            self.refresh()
+        elif not visible:
+            self.timer.stop()
+
+    def refresh(self):
+        """ Scales the image down and sends every effect to the worker processes.
+        """
+        self.changed = False
+        with self.lock:
+            self.ticket += 1
+            ticket = self.ticket
+        if self.canvas is None:
+            self.thumbnails = []
+            for row in range(self.thumbnail_list.count()):
+                self.thumbnail_list.item(row).setIcon(QIcon())
+            return
+
+        proxy = proxy_preview.canvas_proxy(self.canvas, THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        self.thumbnail_format = proxy.image.format()
+        self.thumbnails = [proxy.pixels.copy() for effect in self.effects]
+        steps = [[proxy_preview.scale_step(step, proxy.scale)] for title, step in self.effects]
+        self.pool.start(GalleryJob(self, ticket, self.thumbnails, steps))
+
+    def stale(self, ticket):
+        with self.lock:
+            return ticket != self.ticket
+
+    def show_thumbnail(self, ticket, index, error):
+        """ Shows a thumbnail once it is rendered, unless a newer refresh started.
+        """
+        if self.stale(ticket) or error:
+            return
+        pixels = self.thumbnails[index]
+        if self.thumbnail_format == QImage.Format_RGB32:
+            effects_engine.fill_unused_byte(pixels)
+        height, width = pixels.shape[:2]
+        image = QImage(pixels.data, width, height, width * PIXEL_CONTENTS, self.thumbnail_format)
+        self.thumbnail_list.item(index).setIcon(QIcon(QPixmap.fromImage(image)))
+
+    def pool_executor(self):
+        """ Helper to get the worker processes, started on the first refresh.
+        """
+        if self.executor is None:
+            self.executor = batch_executor.BatchExecutor()
+        return self.executor
+
+    def close_pool(self):
+        """ Waits for the refresh running, if any, and stops the worker processes.
+        """
+        with self.lock:
+            self.ticket += 1
+        self.timer.stop()
+        self.pool.waitForDone()
+        if self.executor is not None:
+            self.executor.close()
+            self.executor = None
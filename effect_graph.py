@@ -0,0 +1,269 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" The edits of an image as a chain of steps that can be replayed over the original.
+
+    A step is an effect, its setting, the brush mode and the seed of its confetti
+    positions, so replaying the chain gives the same image every time. Steps can be
+    switched off, changed or removed, and the chain rendered again.
+
+    The image after every step is cached, keyed by a hash of the original pixels and
+    of every step up to it, so the same steps over the same image always get the same
+    key. Rendering a chain starts from the last step whose result is cached:
+    changing step 3 of 6 only renders steps 3 to 6 again, and switching a step off
+    and back on finds both images in the cache.
+    The cache forgets the least recently used images once it goes over CACHE_BYTES.
+"""
+from collections import OrderedDict, namedtuple
+from random import Random
+import hashlib
+import threading
+import numpy as np
+import brush_engine
+import pipeline
+
+MEGABYTE = 1024 * 1024
+
+CACHE_BYTES = 256 * MEGABYTE
+#Effects that need a seed to be rendered the same way again.
+SEEDED_EFFECTS = ('confetti',)
+#Rows hashed at a time, so mapped images aren't read in one go.
+HASH_ROWS = 256
+
+#An effect in the chain, setting is None for effects without one and seed None for effects without randomness.
+GraphStep = namedtuple('GraphStep', 'name setting mode seed enabled')
+
+
+def image_key(pixels):
+    """ Hashes the pixels of an image.
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 array.
+
+    Returns:
+        key (str): Hex digest.
+    """
+    digest = hashlib.blake2b(repr(pixels.shape).encode(), digest_size=16)
+    for top in range(0, pixels.shape[0], HASH_ROWS):
+        digest.update(np.ascontiguousarray(pixels[top:top + HASH_ROWS]))
+    return digest.hexdigest()
+
+
+def step_key(input_key, step):
+    """ Helper to get the key of the image a step makes out of the image with input_key.
+        Steps that are switched off leave the key as it is.
+    """
+    if not step.enabled:
+        return input_key
+    text = repr((input_key, step.name, step.setting, step.mode, step.seed))
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def step_rand(step):
+    """ Helper to get the source of the confetti positions of a step.
+    """
+    return Random(step.seed)
+
+
+def apply_step(pixels, step):
+    """ Applies a single step in place, the default for EffectGraph.render().
+    """
+    pipeline.apply_chain(pixels, [(step.name, step.setting)], step_rand(step), step.mode)
+
+
+def format_step(step):
+    """ Helper to write a step as in a chain, e.g. "confetti:30".
+    """
+    return pipeline.format_chain([(step.name, step.setting)])
+
+
+class ResultCache:
+    """ Images by key, the least recently used ones are dropped past a size limit.
+        The images are read only copies.
+
+    Args:
+        limit (int): Bytes of images kept.
+    """
+    def __init__(self, limit=CACHE_BYTES):
+        self.limit = limit
+        self.images = OrderedDict()
+        self.nbytes = 0
+        #filled by the render thread, read by either
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns the image with a key, or None.
+        """
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+            return image
+
+    def put(self, key, pixels):
+        """ Keeps a copy of an image, unless it is bigger than the whole cache.
+        """
+        if pixels.nbytes > self.limit:
+            return
+        with self.lock:
+            if key in self.images:
+                self.images.move_to_end(key)
+                return
+        image = pixels.copy()
+        image.flags.writeable = False
+        with self.lock:
+            self.images[key] = image
+            self.nbytes += image.nbytes
+            while self.nbytes > self.limit:
+                _, dropped = self.images.popitem(last=False)
+                self.nbytes -= dropped.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.nbytes = 0
+
+
+class EffectGraph:
+    """ The chain of steps made to an image, and the cache of their results.
+        The chain is a tuple, every change makes a new one, so a chain can be kept
+        as a snapshot and put back with restore().
+
+    Args:
+        original (ndarray): (height, width, 4) uint8 array, the image the chain starts from.
+        It must not change while the graph is used.
+        cache (ResultCache): Where results are kept, a new one if None.
+    """
+    def __init__(self, original, cache=None):
+        self.original = original
+        self.cache = ResultCache() if cache is None else cache
+        self.steps = ()
+        self.root_key = None
+
+    def snapshot(self):
+        return self.steps
+
+    def restore(self, steps):
+        """ Puts back a chain from snapshot().
+        """
+        self.steps = tuple(steps)
+
+    def append(self, name, setting, mode=brush_engine.EXACT, seed=None):
+        """ Adds a step at the end of the chain.
+
+        Returns:
+            steps (tuple): The new chain.
+        """
+        self.steps += (GraphStep(name, setting, mode, seed, True),)
+        return self.steps
+
+    def replace(self, index, name, setting):
+        """ Changes the effect and setting of a step, its mode, seed and switch stay.
+            A step changed into an effect that needs a seed gets a new one.
+
+        Returns:
+            steps (tuple): The new chain.
+        """
+        step = self.steps[index]._replace(name=name, setting=setting)
+        if name in SEEDED_EFFECTS and step.seed is None:
+            step = step._replace(seed=Random().getrandbits(32))
+        self.steps = self.steps[:index] + (step,) + self.steps[index + 1:]
+        return self.steps
+
+    def set_enabled(self, index, enabled):
+        """ Switches a step on or off.
+
+        Returns:
+            steps (tuple): The new chain.
+        """
+        step = self.steps[index]._replace(enabled=enabled)
+        self.steps = self.steps[:index] + (step,) + self.steps[index + 1:]
+        return self.steps
+
+    def remove(self, index):
+        """ Takes a step out of the chain.
+
+        Returns:
+            steps (tuple): The new chain.
+        """
+        self.steps = self.steps[:index] + self.steps[index + 1:]
+        return self.steps
+
+    def keys(self, steps=None):
+        """ Gets the key of the image after every step.
+
+        Args:
+            steps (tuple): A chain, the current one if None.
+
+        Returns:
+            keys (list): One key per step, the key of the original first.
+        """
+        if steps is None:
+            steps = self.steps
+        if self.root_key is None:
+            self.root_key = image_key(self.original)
+        keys = [self.root_key]
+        for step in steps:
+            keys.append(step_key(keys[-1], step))
+        return keys
+
+    def remember(self, pixels, steps=None):
+        """ Caches an image known to be the result of a chain, e.g. the canvas
+            once a render of the chain is over.
+        """
+        self.cache.put(self.keys(steps)[-1], pixels)
+
+    def render(self, out, steps=None, apply=apply_step):
+        """ Renders a chain from the last step whose result is cached,
+            caching the result of every step it renders.
+
+        Args:
+            out (ndarray): Array shaped like the original that gets the result.
+            steps (tuple): A chain, the current one if None.
+            apply (function): Called with out and a step to apply it in place.
+            It may raise to stop the render.
+
+        Returns:
+            rendered (int): Number of steps rendered, the ones found in the cache are not.
+        """
+        if steps is None:
+            steps = self.steps
+        keys = self.keys(steps)
+        start = len(steps)
+        cached = None
+        while start > 0:
+            cached = self.cache.get(keys[start])
+            if cached is not None:
+                break
+            start -= 1
+        np.copyto(out, self.original if cached is None else cached)
+
+        rendered = 0
+        for number in range(start, len(steps)):
+            step = steps[number]
+            if not step.enabled:
+                continue
+            apply(out, step)
+            rendered += 1
+            self.cache.put(keys[number + 1], out)
+        return rendered
+
+    def close(self):
+        """ Lets go of the cached images and of the original, which can be a canvas file
+            that is closed next.
+        """
+        self.cache.clear()
+        self.original = None
@@ -0,0 +1,457 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Vectorized color effects.
+
+    Every effect works in place on a (height, width, 4) uint8 array holding
+    the BGRA bytes of a 32 bit QImage, and produces exactly the same bytes as
+    the original per byte loops of the editor, including the way those loops
+    advance their position variable across neighbouring channels and pixels.
+
+    Zeus, mint and brighter only map every byte to a new value, so they are
+    compiled into 256 entry tables, and runs of them are fused into one table
+    that is applied in a single pass. They treat blue, green and red alike,
+    so a gray image stays gray and is looked up a whole pixel at a time.
+"""
+import numpy as np
+
+MAX_RGB_VALUE = 255
+MIN_RGB_VALUE = 0
+PIXEL_CONTENTS = 4
+
+#Arbitrary values that can be changed at will to create different effects.
+ZEUS_VALUE = 100
+MINT_VALUE = 1
+BRIGHTER_VALUE = 5
+NEON_VALUES = (-100, 70)
+WILD_WEST_VALUE = 100
+#Must stay within 1-254, see wrap_repeated().
+PATTERN_VALUE = 100
+
+#Upper bounds of the value bands used by zeus and mint, the last band is open.
+BAND_LIMITS = (50, 100, 150, 200)
+ZEUS_BANDS = (70, 120, 170, 225, 45)
+MINT_BANDS = (225, 170, 120, 70, 30)
+
+#Sketch thresholds.
+SKETCH_HIGH = 200
+SKETCH_LOW = 50
+
+#Sketch classifies every byte as kept, very bright or very dark.
+SKETCH_KEEP = 0
+SKETCH_BRIGHT = 1
+SKETCH_DARK = 2
+SKETCH_KIND = np.full(256, SKETCH_KEEP, dtype=np.uint8)
+SKETCH_KIND[SKETCH_HIGH + 1:] = SKETCH_BRIGHT
+SKETCH_KIND[:SKETCH_LOW] = SKETCH_DARK
+SKETCH_OUTPUT = np.array([MIN_RGB_VALUE, MIN_RGB_VALUE, MAX_RGB_VALUE], dtype=np.uint8)
+#For every combination of 3 kinds, the kind of the last byte that is not kept.
+SKETCH_WINNER = np.array([(code // 9) or ((code // 3) % 3) or (code % 3)
+                          for code in range(27)], dtype=np.uint8)
+
+
+def qimage_view(qImage):
+    """ Returns a writable (height, width, 4) uint8 view of a 32 bit QImage.
+        Writing to the view writes straight into the image's pixels.
+        Rows padded past their last pixel give a view that is not contiguous.
+
+    Args:
+        qImage (QImage): A RGB32, ARGB32 or ARGB32_Premultiplied image.
+
+    Raises:
+        ValueError: If the image is in any other format, its bytes aren't BGRA.
+
+    Returns:
+        pixels (ndarray): The view over the image buffer.
+    """
+    if qImage.format() not in (qImage.Format_RGB32, qImage.Format_ARGB32, qImage.Format_ARGB32_Premultiplied):
+        raise ValueError(f'Expected a 32 bit BGRA image, got format {int(qImage.format())}')
+    pointer = qImage.bits()
+    pointer.setsize(qImage.sizeInBytes())
+    rows = np.frombuffer(pointer, dtype=np.uint8).reshape(qImage.height(), qImage.bytesPerLine())
+    return rows[:, :qImage.width() * PIXEL_CONTENTS].reshape(qImage.height(), qImage.width(), PIXEL_CONTENTS)
+
+
+def fill_unused_byte(pixels):
+    """ Sets the 4th byte of the pixels of an RGB32 image to 255, in place, before Qt shows them.
+        Some effects change that byte, and Qt expects it to be 255.
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 BGRA array, or a view of part of one.
+    """
+    pixels[..., 3] = 255
+
+
+def flat_pixels(pixels):
+    """ Helper to see the image as one long list of pixels (rows joined end to end),
+        which is how the original loops walk the buffer.
+    """
+    return pixels.reshape(-1, PIXEL_CONTENTS)
+
+
+def band_table(offset, outputs):
+    """ Builds the 256 entry table of a band mapping effect.
+
+    Args:
+        offset (int): Value added to every byte before choosing its band.
+        outputs (tuple): Output value of each band, the last one is used for
+        everything outside of BAND_LIMITS.
+
+    Returns:
+        table (ndarray): uint8 table indexed by the original byte value.
+    """
+    value = np.arange(256) + offset
+    table = np.full(256, outputs[-1], dtype=np.uint8)
+    lower = MIN_RGB_VALUE
+    for upper, output in zip(BAND_LIMITS, outputs):
+        table[(value >= lower) & (value <= upper)] = output
+        lower = upper + 1
+    return table
+
+
+def wrap_table(amount):
+    """ Builds the table that adds amount to a byte and wraps it around
+        the 0-255 range the same way the wild west and pattern loops do.
+    """
+    value = np.arange(256) + amount
+    value = np.where(value < MIN_RGB_VALUE, MAX_RGB_VALUE + value, value)
+    value = np.where(value > MAX_RGB_VALUE, value - MAX_RGB_VALUE, value)
+    return value.astype(np.uint8)
+
+
+def wrap_repeated(values, amount, times):
+    """ Applies the wrap of wrap_table() to every value a different number of times.
+        Once wrapped, a byte rotates by amount modulo 255, with 255 standing in for 0,
+        so n wraps can be done in one step. Only valid for amounts between 1 and 254.
+
+    Args:
+        values (ndarray): The bytes to wrap.
+        amount (int): The value added on every wrap.
+        times (ndarray): How many times each byte is wrapped.
+
+    Returns:
+        values (ndarray): int64 array with the wrapped bytes.
+    """
+    values = values.astype(np.int64)
+    rotated = (values + amount * times.astype(np.int64)) % MAX_RGB_VALUE
+    rotated[rotated == 0] = MAX_RGB_VALUE
+    return np.where(times == 0, values, rotated)
+
+
+def identity_table():
+    """ Returns the (4, 256) table that leaves every byte as it is.
+    """
+    return np.tile(np.arange(256, dtype=np.uint8), (PIXEL_CONTENTS, 1))
+
+
+def color_table(table):
+    """ Turns a 256 entry byte table into a (4, 256) table, one row per
+        blue, green, red and alpha byte, that leaves the alpha byte untouched.
+    """
+    tables = identity_table()
+    tables[:3] = table
+    return tables
+
+
+def compose_tables(first, second):
+    """ Fuses two (4, 256) tables into one that gives the same bytes as
+        applying first and then second.
+    """
+    return np.take_along_axis(second, first.astype(np.intp), axis=1)
+
+
+def keeps_gray(table):
+    """ Helper to tell if a (4, 256) table maps opaque gray pixels to opaque gray pixels,
+        i.e. its blue, green and red rows are the same and it leaves an alpha of 255 as it is.
+    """
+    return bool((table[0] == table[1]).all() and (table[1] == table[2]).all()
+                and table[3][MAX_RGB_VALUE] == MAX_RGB_VALUE)
+
+
+def gray_table(table):
+    """ Helper to turn a (4, 256) table into the 256 entry table of the whole pixels
+        it makes out of opaque gray pixels, indexed by their blue byte.
+    """
+    rows = table.astype(np.uint32)
+    return rows[0] | (rows[1] << 8) | (rows[2] << 16) | (rows[3][MAX_RGB_VALUE] << 24)
+
+
+def apply_table(pixels, table, out=None, gray=False):
+    """ Maps every byte of the image through a (4, 256) table in a single pass.
+        Pairs of bytes are looked up together through 65536 entry tables,
+        which halves the number of lookups. Gray images only have their blue
+        bytes looked up, a whole pixel at a time.
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 array.
+        table (ndarray): (4, 256) uint8 table, one row per channel.
+        out (ndarray): Array of the same shape that receives the result.
+        If it is None, pixels is changed in place.
+        gray (bool): Every pixel is opaque gray, its blue, green and red bytes are the same
+        and its alpha is 255, e.g. an image opened from a grayscale file.
+
+    Returns:
+        out (ndarray): The array holding the result.
+    """
+    if out is None:
+        out = pixels
+
+    if not (pixels.flags.c_contiguous and out.flags.c_contiguous):
+        for channel in range(PIXEL_CONTENTS):
+            out[..., channel] = table[channel][pixels[..., channel]]
+        return out
+
+    if gray:
+        #a quarter of the lookups, from a table that stays in the cache
+        blue = pixels.reshape(-1)[::PIXEL_CONTENTS]
+        np.take(gray_table(table), blue, out=out.reshape(-1).view(np.uint32))
+        return out
+
+    codes = np.arange(65536)
+    pairs = pixels.reshape(-1).view('<u2').reshape(-1, 2)
+    out_pairs = out.reshape(-1).view('<u2').reshape(-1, 2)
+    for half in range(2):
+        low = table[2 * half][codes & 0xFF].astype(np.uint16)
+        high = table[2 * half + 1][codes >> 8].astype(np.uint16)
+        out_pairs[:, half] = (low | (high << 8))[pairs[:, half]]
+    return out
+
+
+def zeus_table():
+    """ The zeus bands, every byte jumps 100 values and lands in one of 5 colors.
+    """
+    return color_table(band_table(ZEUS_VALUE, ZEUS_BANDS))
+
+
+def mint_table():
+    """ The mint bands, the reverse of zeus with a darker last band.
+    """
+    return color_table(band_table(MINT_VALUE, MINT_BANDS))
+
+
+def brighter_table():
+    """ Bytes are incremented by BRIGHTER_VALUE,
+        the ones that would go over MAX_RGB_VALUE are darkened instead.
+    """
+    value = np.arange(256)
+    value = np.where(value + BRIGHTER_VALUE > MAX_RGB_VALUE,
+                     value - BRIGHTER_VALUE, value + BRIGHTER_VALUE)
+    return color_table(value.astype(np.uint8))
+
+
+def zeus(pixels):
+    """ The pixels of the image are shuffled painting the image with various colors.
+        Every blue, green and red byte is mapped through the zeus bands.
+    """
+    return apply_table(pixels, zeus_table())
+
+
+def mint(pixels):
+    """ Creates a contrast of colors on the image.
+        Every blue, green and red byte is mapped through the mint bands.
+    """
+    return apply_table(pixels, mint_table())
+
+
+def brighter(pixels):
+    """ The blue, green and red bytes are incremented by BRIGHTER_VALUE,
+        increasing the brightness of the image.
+    """
+    return apply_table(pixels, brighter_table())
+
+
+def sketch(pixels):
+    """ Most of the colors of the image are reduced to a few colors
+        turning the image similar to a sketch.
+        The original loop visits every byte (alpha included, except for the last 4)
+        and checks it together with the next two bytes,
+        the last of the three that is very bright or very dark decides the new value.
+    """
+    flat = pixels.reshape(-1)
+    end = len(flat) - PIXEL_CONTENTS
+    kind = SKETCH_KIND[flat[:end + 2]]
+    #one base 3 digit per byte of the window, the last byte is the most significant
+    code = kind[2:end + 2] * np.uint8(9)
+    code += kind[1:end + 1] * np.uint8(3)
+    code += kind[:end]
+    winner = SKETCH_WINNER[code]
+    result = SKETCH_OUTPUT[winner]
+    np.copyto(result, flat[:end], where=(winner == SKETCH_KEEP))
+    flat[:end] = result
+    return pixels
+
+
+def neon(pixels):
+    """ The rgb values are shuffled, painting the image in various neon colors.
+        The original loop starts on the green byte of every pixel, so it changes
+        green, red and alpha, borrowing from the neighbouring bytes when a value
+        would leave the 0-255 range. The last pixel is never visited.
+    """
+    flat = flat_pixels(pixels)
+    for value in NEON_VALUES:
+        blue = flat[:-1, 0].astype(np.int16)
+        green = flat[:-1, 1].astype(np.int16)
+        red = flat[:-1, 2].astype(np.int16)
+        alpha = flat[:-1, 3].astype(np.int16)
+        next_blue = flat[1:, 0].astype(np.int16)
+
+        green_value = green + value
+        green = np.where(green_value < MIN_RGB_VALUE, red,
+                         np.where(green_value > MAX_RGB_VALUE, blue, green_value))
+        red_value = red + value
+        red = np.where(red_value < MIN_RGB_VALUE, alpha,
+                       np.where(red_value > MAX_RGB_VALUE, green, red_value))
+        alpha_value = alpha + value
+        alpha = np.where(alpha_value < MIN_RGB_VALUE, next_blue,
+                         np.where(alpha_value > MAX_RGB_VALUE, red, alpha_value))
+
+        flat[:-1, 1] = green
+        flat[:-1, 2] = red
+        flat[:-1, 3] = alpha
+    return pixels
+
+
+def wild_west(pixels):
+    """ Creates a contrast of colors on the image.
+        The original loop moves 2 bytes at a time, so every pixel wraps its own blue
+        and red bytes, and then writes its wrapped green byte into the blue byte
+        of the next pixel, which wraps it again. The last pixel is never visited.
+    """
+    table = wrap_table(WILD_WEST_VALUE)
+    flat = flat_pixels(pixels)
+    green = flat[:-1, 1]
+    wrapped_green = table[green]
+
+    flat[:-1, 2] = table[flat[:-1, 2]]
+    flat[0, 0] = table[flat[0, 0]]
+    flat[1:-1, 0] = table[wrapped_green[:-1]]
+    flat[-1, 0] = wrapped_green[-1]
+    return pixels
+
+
+def pattern_context(pixels):
+    """ Helper to get the bytes of pattern() that come from the far ends of the image:
+        the alpha and red bytes of the last pixel and the red byte of the first one,
+        that seed the chains, and the green byte of the last pixel.
+    """
+    flat = flat_pixels(pixels)
+    return np.array([flat[-1, 3], flat[-1, 2], flat[0, 2]]), flat[-1, 1]
+
+
+def pattern(pixels, first_pixel=0, context=None):
+    """ Wraps the RGB values around the range of 0-255.
+        Creates a pattern on the image and reduces the amount of colors.
+        The original loop reads the green, red and alpha bytes of the previous pixel
+        (the last pixel for the first one) and moves 3 bytes at a time,
+        writing to the blue and alpha bytes of the current pixel and the red byte
+        of the next one. That chains the red and alpha bytes along the whole image,
+        every pixel wrapping the value of one three pixels before it twice more.
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 array, changed in place.
+        first_pixel (int): Position of the first pixel in the whole image,
+        when pixels is a band of it.
+        context (tuple): pattern_context() of the whole image, taken from pixels if None.
+
+    Returns:
+        pixels (ndarray): The same array.
+    """
+    table = wrap_table(PATTERN_VALUE)
+    flat = flat_pixels(pixels)
+    total = len(flat)
+    seeds, last_green = context if context is not None else pattern_context(pixels)
+
+    #blue bytes take the wrapped green byte of the previous pixel
+    previous_green = np.roll(flat[:, 1], 1)
+    if first_pixel == 0:
+        previous_green[0] = last_green
+
+    #chain[i] is the alpha value written by pixel i - 1,
+    #chain[0] is the untouched alpha of the last pixel.
+    #Every chain starts at one of three seeds and wraps twice every 3 pixels.
+    index = np.arange(first_pixel, first_pixel + total)
+    step = index // 3
+    times = np.where(index % 3 == 0, 2 * step, 2 * step + 1)
+    chain = wrap_repeated(seeds[index % 3], PATTERN_VALUE, times)
+
+    flat[:-1, 0] = table[previous_green[:-1]]
+    flat[1:, 2] = table[chain[:-1]]
+    flat[:-1, 3] = chain[1:]
+    return pixels
+
+
+#Effects that only map every byte to a new value, so they can be fused.
+#Sketch is not one of them, every byte depends on the two bytes after it.
+#All of them keep gray images gray, see keeps_gray().
+TABLE_EFFECTS = {
+    'zeus': zeus_table,
+    'mint': mint_table,
+    'brighter': brighter_table,
+}
+
+COLOR_EFFECTS = {
+    'zeus': zeus,
+    'mint': mint,
+    'brighter': brighter,
+    'sketch': sketch,
+    'neon': neon,
+    'wild_west': wild_west,
+    'pattern': pattern,
+}
+
+
+def compile_tables(names):
+    """ Fuses a run of table effects into a single (4, 256) table.
+
+    Args:
+        names (list): Names of effects in TABLE_EFFECTS, in the order they are applied.
+
+    Returns:
+        table (ndarray): The fused table.
+    """
+    table = identity_table()
+    for name in names:
+        table = compose_tables(table, TABLE_EFFECTS[name]())
+    return table
+
+
+def apply_effects(pixels, names, gray=False):
+    """ Applies a chain of color effects in order.
+        Back to back table effects are fused, so any number of them
+        costs a single pass over the image.
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 array, changed in place.
+        names (list): Names of effects in COLOR_EFFECTS.
+        gray (bool): Every pixel is opaque gray, see apply_table().
+
+    Returns:
+        pixels (ndarray): The same array.
+    """
+    run = []
+    for name in list(names) + [None]:
+        if name in TABLE_EFFECTS:
+            run.append(name)
+            continue
+        if run:
+            table = compile_tables(run)
+            apply_table(pixels, table, gray=gray)
+            gray = gray and keeps_gray(table)
+            run = []
+        if name is not None:
+            COLOR_EFFECTS[name](pixels)
+            gray = False
+    return pixels
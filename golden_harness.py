@@ -0,0 +1,354 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Checks the engines against the original per byte loops of reference_engine.
+
+    Every backend renders every step over a corpus of small seeded images, and its
+    pixels are compared with the reference's: the number of pixels that differ in any
+    byte and the largest difference of a byte. A backend passes a step when both stay
+    within the tolerance it declares for it in TOLERANCES, exact by default, so
+    the approximate fast Wash says how far from the reference it may be.
+
+    The reference outputs can be saved as golden files with --save and read back with
+    --golden, so the slow loops don't have to run every time.
+    Run it as "python -m abstract_image_editor golden ...".
+"""
+from collections import namedtuple
+from random import Random
+import argparse
+import json
+import os
+import sys
+import numpy as np
+import brush_engine
+import tiled_engine
+import pipeline
+import reference_engine
+
+#How far a backend may be from the reference: the largest difference of a byte,
+#the share of pixels that may differ at all and the mean difference of a byte.
+Tolerance = namedtuple('Tolerance', 'max_error max_share max_mean_error')
+EXACT_MATCH = Tolerance(0, 0.0, 0.0)
+
+#(height, width) of the corpus images, small enough for the reference loops.
+CORPUS_SIZES = ((4, 4), (5, 9), (16, 16), (33, 21), (64, 48))
+#Kinds of corpus images, see corpus_image().
+CORPUS_KINDS = ('noise', 'smooth', 'blocks', 'alpha')
+CORPUS_SEED = 7
+#Rows of a band for the tiled backend, small so the corpus images are cut in many bands.
+TILED_ROWS = 8
+
+GOLDEN_STEPS = ('zeus,mint,brighter,sketch,neon,wild_west,pattern,strie,diamond,zombie,dust,metal,'
+                'wash:diagonal,wash:cross,melt:1,melt:-1,melt:5,melt:-5,confetti:50')
+
+#Tolerances other than EXACT_MATCH, by backend and effect name.
+#The fast Wash reads every similarity from the untouched image, so most pixels of an image
+#with many similar neighbours take another similar neighbour's color than in the original loop.
+#Its quality target: no byte further than two similarity ranges from the reference, and a mean
+#difference of a byte of at most 5 levels on every image. The other brush effects have no fast
+#kernel, brush_engine.FAST runs them exactly like EXACT and they must match.
+TOLERANCES = {
+    'fast': {
+        'wash': Tolerance(2 * brush_engine.SIMILARITY_RANGE, 1.0, 5.0),
+    },
+}
+
+
+def render_exact(pixels, step, rand):
+    pipeline.apply_chain(pixels, [step], rand, brush_engine.EXACT)
+
+
+def render_fast(pixels, step, rand):
+    pipeline.apply_chain(pixels, [step], rand, brush_engine.FAST)
+
+
+def render_tiled(pixels, step, rand):
+    tiled_engine.apply_chain(pixels, [step], rand, brush_engine.EXACT, None, TILED_ROWS)
+
+
+#Backends checked, every one renders a step in place.
+BACKENDS = {
+    'exact': render_exact,
+    'fast': render_fast,
+    'tiled': render_tiled,
+}
+
+
+def corpus_image(kind, height, width, seed=CORPUS_SEED):
+    """ Makes a seeded test image.
+        noise: every byte random, opaque.
+        smooth: slow gradients with a little noise, so the brush effects find similar pixels.
+        blocks: a few flat colors in blocks of 4 by 4 pixels.
+        alpha: every byte random, alpha included.
+
+    Returns:
+        pixels (ndarray): (height, width, 4) uint8 BGRA array.
+    """
+    generator = np.random.default_rng([seed, CORPUS_KINDS.index(kind), height, width])
+    if kind == 'smooth':
+        rows = np.linspace(0, 1, height)[:, None, None]
+        columns = np.linspace(0, 1, width)[None, :, None]
+        base = generator.integers(0, 200, (1, 1, 4)) + 40 * rows + 30 * columns
+        pixels = (base + generator.integers(0, 6, (height, width, 4))).clip(0, 255).astype(np.uint8)
+    elif kind == 'blocks':
+        palette = generator.integers(0, 256, (4, 4), dtype=np.uint8)
+        picks = generator.integers(0, len(palette), (-(-height // 4), -(-width // 4)))
+        pixels = palette[picks].repeat(4, axis=0).repeat(4, axis=1)[:height, :width].copy()
+    else:
+        pixels = generator.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    if kind != 'alpha':
+        pixels[..., 3] = 255
+    return pixels
+
+
+def build_corpus(sizes=CORPUS_SIZES, kinds=CORPUS_KINDS):
+    """ Helper to make every kind of corpus image in every size.
+
+    Returns:
+        corpus (list): (name, pixels) tuples, e.g. ('noise_16x16', pixels).
+    """
+    return [(f'{kind}_{height}x{width}', corpus_image(kind, height, width))
+            for height, width in sizes for kind in kinds]
+
+
+def supported(step, pixels):
+    """ Helper to tell whether the reference loop is defined for a step on an image.
+    """
+    name, setting = step
+    return not (name == 'melt' and abs(setting) >= pixels.shape[0])
+
+
+def step_seed(image, step):
+    """ Helper to get the confetti seed of a case, the same on every run.
+    """
+    return sum(f'{image}:{pipeline.format_chain([step])}'.encode())
+
+
+def render_reference(pixels, step, seed):
+    """ Helper to render a case with the reference loops.
+
+    Returns:
+        reference (object): The output pixels, or the IndexError the loop raised.
+    """
+    out = pixels.copy()
+    try:
+        reference_engine.apply_chain(out, [step], Random(seed))
+    except IndexError as error:
+        #some effects go past the end of the buffer on small images, the engines must too
+        return error
+    return out
+
+
+def render_backend(backend, pixels, step, seed):
+    """ Helper to render a case with a backend, like render_reference().
+    """
+    out = pixels.copy()
+    try:
+        BACKENDS[backend](out, step, Random(seed))
+    except IndexError as error:
+        return error
+    return out
+
+
+def tolerance_for(backend, step):
+    return TOLERANCES.get(backend, {}).get(step[0], EXACT_MATCH)
+
+
+def compare_pixels(result, reference):
+    """ Measures how far an image is from the reference.
+
+    Returns:
+        differing (int): Pixels that differ in any byte.
+        max_error (int): Largest difference of a byte.
+        mean_error (float): Mean difference of a byte.
+    """
+    error = np.abs(result.astype(np.int16) - reference)
+    return int(error.any(axis=2).sum()), int(error.max(initial=0)), float(error.mean())
+
+
+def golden_path(folder, image, step):
+    """ Helper to get the golden file of a case.
+    """
+    effect = pipeline.format_chain([step]).replace(':', '_')
+    return os.path.join(folder, f'{image}__{effect}.npy')
+
+
+def save_golden(path, reference):
+    """ Helper to write a reference output, an empty array for a loop that raised IndexError.
+    """
+    np.save(path, np.zeros(0, np.uint8) if isinstance(reference, IndexError) else reference)
+
+
+def load_golden(path):
+    reference = np.load(path)
+    return IndexError('the reference loop went past the buffer') if reference.size == 0 else reference
+
+
+def compare_case(backend, image, pixels, step, seed, reference):
+    """ Renders a case with a backend and compares it with the reference output.
+        When the reference loop raised IndexError, an exact backend must raise it too.
+
+    Returns:
+        result (dict): backend, effect, image, height, width, compared, differing, share,
+        max_error, mean_error, tolerance and passed.
+    """
+    height, width = pixels.shape[:2]
+    result = render_backend(backend, pixels, step, seed)
+    tolerance = tolerance_for(backend, step)
+    raised = isinstance(result, IndexError), isinstance(reference, IndexError)
+    compared = tolerance == EXACT_MATCH or not raised[1]
+    if not compared or all(raised):
+        differing, max_error, mean_error = 0, 0, 0.0
+    elif any(raised):
+        #only one of them got an image, every pixel counts as different
+        differing, max_error, mean_error = height * width, 255, 255.0
+    else:
+        differing, max_error, mean_error = compare_pixels(result, reference)
+    share = differing / (height * width)
+    return {
+        'backend': backend,
+        'effect': pipeline.format_chain([step]),
+        'image': image,
+        'height': height,
+        'width': width,
+        'compared': compared,
+        'differing': differing,
+        'share': share,
+        'max_error': max_error,
+        'mean_error': mean_error,
+        'tolerance': tolerance._asdict(),
+        'passed': (max_error <= tolerance.max_error and share <= tolerance.max_share
+                   and mean_error <= tolerance.max_mean_error),
+    }
+
+
+def check(backends, steps, corpus, golden=None, save=None, report=None):
+    """ Renders every step over every corpus image with every backend and the reference.
+
+    Args:
+        backends (list): Names from BACKENDS.
+        steps (list): Steps from pipeline.parse_chain.
+        corpus (list): (name, pixels) tuples, see build_corpus().
+        golden (str): Folder to read the reference outputs from instead of running the loops.
+        save (str): Folder to write the reference outputs to.
+        report (function): Called with every result as soon as it is known.
+
+    Raises:
+        OSError: If a golden file is missing.
+
+    Returns:
+        results (list): A dict per case, see compare_case().
+    """
+    results = []
+    for image, pixels in corpus:
+        for step in steps:
+            if not supported(step, pixels):
+                continue
+            seed = step_seed(image, step)
+            if golden is not None:
+                reference = load_golden(golden_path(golden, image, step))
+            else:
+                reference = render_reference(pixels, step, seed)
+            if save is not None:
+                save_golden(golden_path(save, image, step), reference)
+            for backend in backends:
+                result = compare_case(backend, image, pixels, step, seed, reference)
+                results.append(result)
+                if report is not None:
+                    report(result)
+    return results
+
+
+def summarize(results):
+    """ Helper to sum up the results by backend and effect.
+
+    Returns:
+        rows (list): (backend, effect, cases, failed, differing pixels, worst share, max error,
+        worst mean error) tuples.
+    """
+    groups = {}
+    for result in results:
+        groups.setdefault((result['backend'], result['effect']), []).append(result)
+    rows = []
+    for (backend, effect), group in groups.items():
+        rows.append((backend, effect, len(group), sum(not result['passed'] for result in group),
+                     sum(result['differing'] for result in group), max(result['share'] for result in group),
+                     max(result['max_error'] for result in group), max(result['mean_error'] for result in group)))
+    return rows
+
+
+def build_parser():
+    """ Helper to build the command line arguments of the golden command.
+    """
+    parser = argparse.ArgumentParser(prog='python -m abstract_image_editor golden',
+                                     description='Check the engines against the original per byte loops.')
+    parser.add_argument('-b', '--backends', default=','.join(BACKENDS),
+                        help=f'backends to check, comma separated (default: {",".join(BACKENDS)})')
+    parser.add_argument('-e', '--effects', default=GOLDEN_STEPS, help='steps to check (default: every effect)')
+    parser.add_argument('--json', dest='json_path', help='write the results to this file')
+    golden = parser.add_mutually_exclusive_group()
+    golden.add_argument('--save', help='write the reference outputs to this folder as golden files')
+    golden.add_argument('--golden', help='read the reference outputs from this folder instead of running the loops')
+    return parser
+
+
+def main(argv=None):
+    """ Golden command entry point.
+
+    Args:
+        argv (list): Command line arguments after "golden", sys.argv if None.
+
+    Returns:
+        status (int): 0 if every backend is within its tolerances, 1 if not, 2 for bad arguments.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    backends = [backend for backend in args.backends.split(',') if backend]
+    unknown = [backend for backend in backends if backend not in BACKENDS]
+    if unknown or not backends:
+        parser.error(f'backends must be some of {", ".join(BACKENDS)}')
+    try:
+        steps = pipeline.parse_chain(args.effects)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.save is not None:
+        os.makedirs(args.save, exist_ok=True)
+
+    def report(result):
+        if not result['passed']:
+            print(f"FAILED {result['backend']} {result['effect']} {result['image']}: {result['differing']} pixels "
+                  f"differ, max error {result['max_error']}, mean error {result['mean_error']:.1f}", file=sys.stderr)
+
+    try:
+        results = check(backends, steps, build_corpus(), args.golden, args.save, report)
+    except OSError as error:
+        print(f"Can't read the golden files: {error}", file=sys.stderr)
+        return 1
+
+    for backend, effect, cases, failed, differing, share, max_error, mean_error in summarize(results):
+        status = 'ok' if not failed else f'{failed} FAILED'
+        print(f'{backend:<6} {effect:<14} {cases:>3} cases  {differing:>7} pixels differ  '
+              f'worst {share:6.1%}  max error {max_error:>3}  mean error {mean_error:5.1f}  {status}')
+    if args.json_path is not None:
+        with open(args.json_path, 'w') as results_file:
+            json.dump({'results': results}, results_file, indent=2)
+    failed = sum(not result['passed'] for result in results)
+    print(f'{len(results) - failed} of {len(results)} cases within tolerance.')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
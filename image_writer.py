@@ -0,0 +1,246 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Writes images to files on a background thread, with the encoder settings asked for.
+
+    A file is written to a temp file in the folder of the destination and renamed over
+    the destination once it is complete, so a save that fails or is cut short never
+    leaves half a file behind: the destination is either the old file or the new one.
+
+    ImageWriter writes the images given to submit() one after another on its own thread,
+    so the window can go on editing and a batch can work on the next image meanwhile.
+    At most max_queued images wait their turn and submit() blocks past that, so a
+    producer faster than the encoder doesn't pile up images in memory.
+    The images must not change until they are written, the window hands over a copy,
+    see WorkingCanvas.snapshot().
+"""
+from collections import namedtuple
+from PyQt5.QtCore import QBuffer, QIODevice
+from PyQt5.QtGui import QImageWriter
+import os
+import queue
+import tempfile
+import threading
+import raw_canvas
+
+#Images waiting to be written before submit() blocks.
+MAX_QUEUED = 2
+#The encoder's own default, JPEG quality 75 and zlib level 6 for PNG.
+DEFAULT = -1
+HIGH_JPEG_QUALITY = 95
+#PNG files written about 6 times faster than at the default level, and about 10% bigger.
+FAST_PNG_COMPRESSION = 1
+MAX_PNG_COMPRESSION = 9
+
+#Encoder settings: JPEG quality 0-100 and PNG zlib level 0-9, DEFAULT for the encoder's default.
+SaveOptions = namedtuple('SaveOptions', 'quality compression')
+DEFAULT_OPTIONS = SaveOptions(DEFAULT, DEFAULT)
+
+#Files are created with the permissions the umask allows, like open() does.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def png_quality(compression):
+    """ Helper to get the quality QImageWriter turns into a PNG zlib level,
+        it maps qualities 0-100 to levels 9-0.
+    """
+    if compression == DEFAULT:
+        return DEFAULT
+    compression = min(max(compression, 0), MAX_PNG_COMPRESSION)
+    return 100 - (compression * 91 + 8) // 9
+
+
+def write_image(image, path, options=DEFAULT_OPTIONS):
+    """ Writes a QImage, the file type comes from the extension of the path.
+
+    Args:
+        image (QImage): The image to write.
+        path (str): The destination, replaced once the new file is complete.
+        options (SaveOptions): Encoder settings.
+
+    Raises:
+        OSError: If the file can't be written.
+    """
+    def encode(temp_path):
+        writer = QImageWriter(temp_path, file_type(path).encode())
+        set_options(writer, file_type(path), options)
+        if not writer.write(image):
+            raise OSError(f"Can't write image '{path}': {writer.errorString()}")
+
+    replace(path, encode)
+
+
+def encode_image(image, image_type, options=DEFAULT_OPTIONS):
+    """ Encodes a QImage in memory, e.g. to send it over the network.
+
+    Args:
+        image (QImage): The image to encode.
+        image_type (str): File type, e.g. 'png' or 'jpg'.
+        options (SaveOptions): Encoder settings.
+
+    Raises:
+        OSError: If the image can't be encoded.
+
+    Returns:
+        data (bytes): The encoded file.
+    """
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    writer = QImageWriter(buffer, image_type.encode())
+    set_options(writer, image_type, options)
+    if not writer.write(image):
+        raise OSError(f"Can't encode image as {image_type}: {writer.errorString()}")
+    return bytes(buffer.data())
+
+
+def set_options(writer, image_type, options):
+    """ Helper to give the settings of options to a QImageWriter writing a file type.
+    """
+    if image_type == 'png':
+        writer.setQuality(png_quality(options.compression))
+    else:
+        writer.setQuality(options.quality)
+
+
+def write_canvas(canvas, path, options=DEFAULT_OPTIONS):
+    """ Writes a RawCanvas, PNG files a few rows at a time, see raw_canvas.export_png().
+
+    Args:
+        canvas (RawCanvas): The canvas to write.
+        path (str): The destination, replaced once the new file is complete.
+        options (SaveOptions): Encoder settings.
+
+    Raises:
+        OSError: If the file can't be written.
+    """
+    if file_type(path) != 'png':
+        write_image(canvas.image(), path, options)
+        return
+    compression = raw_canvas.PNG_COMPRESSION if options.compression == DEFAULT else options.compression
+    replace(path, lambda temp_path: raw_canvas.export_png(canvas, temp_path, compression))
+
+
+def write(source, path, options=DEFAULT_OPTIONS):
+    """ Writes a QImage or a RawCanvas, see write_image() and write_canvas().
+    """
+    if isinstance(source, raw_canvas.RawCanvas):
+        write_canvas(source, path, options)
+    else:
+        write_image(source, path, options)
+
+
+def file_type(path):
+    """ Helper to get the file type of a path from its extension, e.g. 'png'.
+    """
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    return 'jpg' if extension == 'jpeg' else extension
+
+
+def replace(path, write_file):
+    """ Helper to write a file through a temp file next to it, renamed over it once complete.
+
+    Args:
+        path (str): The destination.
+        write_file (function): Called with the temp path to write the file there.
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    try:
+        handle, temp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix=os.path.splitext(name)[1], dir=folder)
+    except OSError as error:
+        raise OSError(f"Can't write image '{path}': {error.strerror}") from error
+    os.close(handle)
+    try:
+        write_file(temp_path)
+        os.chmod(temp_path, 0o666 & ~UMASK)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class ImageWriter:
+    """ Writes images one after another on its own thread, see submit().
+
+    Args:
+        max_queued (int): Most images waiting to be written.
+    """
+    def __init__(self, max_queued=MAX_QUEUED):
+        self.jobs = queue.Queue(max_queued)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, source, path, options=DEFAULT_OPTIONS, done=None):
+        """ Queues an image to be written, waiting first if max_queued images already are.
+
+        Args:
+            source (QImage or RawCanvas): The image, it must not change until it is written.
+            path (str): The destination.
+            options (SaveOptions): Encoder settings.
+            done (function): Called on the writer's thread once the image is written,
+            as done(error), error being the reason it couldn't be written or None.
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='image writer', daemon=True)
+                self.thread.start()
+        self.jobs.put((source, path, options, done))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                source, path, options, done = job
+                try:
+                    write(source, path, options)
+                    error = None
+                except OSError as error_raised:
+                    error = str(error_raised)
+                except Exception as error_raised:
+                    #the thread writes the images after this one all the same
+                    error = f'{type(error_raised).__name__}: {error_raised}'
+                if done is not None:
+                    done(error)
+            finally:
+                self.jobs.task_done()
+
+    def busy(self):
+        """ Tells if images are waiting or being written.
+        """
+        return self.jobs.unfinished_tasks > 0
+
+    def wait(self):
+        """ Blocks until every image submitted is written.
+        """
+        self.jobs.join()
+
+    def close(self):
+        """ Writes the images still queued and stops the thread.
+        """
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            self.jobs.put(None)
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
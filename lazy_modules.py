@@ -0,0 +1,60 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Modules imported on first use, so the window shows up before NumPy and the effects are loaded.
+
+    lazy_import() puts a module in sys.modules that is only run the first time one
+    of its attributes is used. An import statement reads an attribute of the module,
+    so every module imported before the window shows gets the engines and NumPy
+    with lazy_import() instead.
+    The window loads them with load() once it is shown, before an image can be opened
+    or a render started on another thread.
+"""
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """ Gets a module that is imported the first time one of its attributes is used.
+
+    Args:
+        name (str): Name of the module, e.g. 'numpy'.
+
+    Raises:
+        ImportError: If there is no such module.
+
+    Returns:
+        module (module): The module, already imported if it was.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def load(modules):
+    """ Imports lazy modules right away, e.g. while the window waits for input.
+    """
+    for module in modules:
+        #any attribute runs the module
+        vars(module)
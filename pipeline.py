@@ -0,0 +1,457 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Runs chains of effects on image files without the window.
+
+    A chain is written as effect names separated by commas, effects that need
+    a setting take it after a colon, e.g. "neon,wash:diagonal,confetti:30".
+        melt:N       melts N rows, towards the top if N is positive, else towards the bottom.
+        wash:P       washes with the diagonal or the cross pattern (diagonal by default).
+        confetti:N   paints N confetti squares.
+
+    Only QImage is used to read and write the files, so nothing here needs a display
+    or a QApplication. Run it as "python -m abstract_image_editor batch ...".
+"""
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImage, QImageReader
+from random import Random
+import argparse
+import glob
+import os
+import sys
+import numpy as np
+import effects_engine
+import brush_engine
+import slider_engine
+import image_writer
+import profiler
+
+MIN_IMAGE_SIZE = 4
+
+#Brush effects that always use the same pattern.
+BRUSH_PATTERNS = {
+    'strie': 'cross',
+    'diamond': 'cross',
+    'zombie': 'cross',
+    'dust': 'diagonal',
+    'metal': 'diagonal',
+}
+WASH_PATTERNS = ('diagonal', 'cross')
+#Effects that need a whole number after the colon.
+COUNT_EFFECTS = ('melt', 'confetti')
+
+EFFECT_NAMES = tuple(effects_engine.COLOR_EFFECTS) + tuple(BRUSH_PATTERNS) + ('wash',) + COUNT_EFFECTS
+
+#Formats whose pixels are all gray if their colors are, see decode_image().
+GRAY_FORMATS = (QImage.Format_Mono, QImage.Format_MonoLSB, QImage.Format_Indexed8,
+                QImage.Format_Grayscale8, QImage.Format_Grayscale16)
+FORMAT_NAMES = {int(getattr(QImage, name)): name[len('Format_'):] for name in dir(QImage)
+                if name.startswith('Format_')}
+
+OUTPUT_FORMATS = ('jpg', 'png')
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png')
+
+
+def parse_chain(text):
+    """ Turns a chain like "neon,wash:diagonal,confetti:30" into a list of steps.
+
+    Args:
+        text (str): Effect names separated by commas.
+
+    Raises:
+        ValueError: If an effect or its setting is unknown.
+
+    Returns:
+        steps (list): (name, setting) tuples, setting is None for effects without one.
+    """
+    steps = []
+    for item in text.split(','):
+        name, _, setting = item.strip().partition(':')
+        name = name.strip().lower().replace('-', '_')
+        setting = setting.strip()
+
+        if name not in EFFECT_NAMES:
+            raise ValueError(f"Unknown effect '{name}', use one of: {', '.join(EFFECT_NAMES)}")
+
+        if name == 'wash':
+            setting = setting.lower() or WASH_PATTERNS[0]
+            if setting not in WASH_PATTERNS:
+                raise ValueError(f"Wash takes {' or '.join(WASH_PATTERNS)}, not '{setting}'")
+        elif name in COUNT_EFFECTS:
+            try:
+                setting = int(setting)
+            except ValueError:
+                raise ValueError(f"{name.capitalize()} needs a whole number, e.g. '{name}:20'") from None
+            if name == 'confetti' and setting < 0:
+                raise ValueError("Confetti can't be negative")
+        elif setting:
+            raise ValueError(f"{name.capitalize()} doesn't take a setting")
+        else:
+            setting = None
+
+        steps.append((name, setting))
+    return steps
+
+
+def format_chain(steps):
+    """ Helper to write a list of steps back as a chain.
+    """
+    return ','.join(name if setting is None else f'{name}:{setting}' for name, setting in steps)
+
+
+def apply_chain(pixels, steps, rand=None, mode=brush_engine.EXACT, gray=False, rects=None):
+    """ Applies a chain of effects in order.
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 BGRA array, changed in place.
+        steps (list): Steps from parse_chain.
+        rand (Random): Source of the confetti positions, a new unseeded one if None.
+        mode (str): brush_engine.EXACT or brush_engine.FAST for the brush effects.
+        gray (bool): Every pixel is opaque gray, e.g. the image of a grayscale file,
+        so the table effects at the start of the chain only look up the blue bytes.
+        rects (list): Gets the (top, bottom, left, right) rectangles Melt and Confetti change,
+        and None for every other step, those don't tell what they change.
+
+    Returns:
+        pixels (ndarray): The same array.
+    """
+    if rand is None:
+        rand = Random()
+    if not pixels.flags.c_contiguous:
+        #the effects walk the image as one long buffer, padded rows are worked on as a copy
+        pixels[:] = apply_chain(np.ascontiguousarray(pixels), steps, rand, mode, gray, rects)
+        return pixels
+
+    #back to back color effects go together, so table effects get fused
+    colors = []
+    for name, setting in list(steps) + [(None, None)]:
+        if name in effects_engine.COLOR_EFFECTS:
+            colors.append(name)
+            continue
+        if colors:
+            effects_engine.apply_effects(pixels, colors, gray)
+            colors = []
+            if rects is not None:
+                rects.append(None)
+        #only table effects keep the image gray, see effects_engine.keeps_gray()
+        gray = False
+
+        if name in BRUSH_PATTERNS:
+            brush_engine.brush(pixels, name, BRUSH_PATTERNS[name], mode)
+        elif name == 'wash':
+            brush_engine.brush(pixels, name, setting, mode)
+        elif name == 'melt':
+            slider_engine.melt(pixels, abs(setting), setting, rects)
+        elif name == 'confetti':
+            slider_engine.confetti(pixels, setting, rand, rects)
+        if (name in BRUSH_PATTERNS or name == 'wash') and rects is not None:
+            rects.append(None)
+    return pixels
+
+
+def probe_image(path):
+    """ Reads the size and type of an image from the header of its file, without decoding it.
+
+    Args:
+        path (str): Image file path.
+
+    Raises:
+        OSError: If the file can't be read.
+        ValueError: If the image is smaller than MIN_IMAGE_SIZE.
+
+    Returns:
+        height (int): Rows of the image, 0 if the header doesn't say.
+        width (int): Pixels on every row, 0 if the header doesn't say.
+        kind (str): Type of the file, e.g. 'jpeg' or 'png'.
+    """
+    reader = QImageReader(path)
+    if not reader.canRead():
+        raise OSError(f"Can't read image '{path}'")
+    size = reader.size()
+    if not size.isValid():
+        return 0, 0, bytes(reader.format()).decode()
+    if size.height() < MIN_IMAGE_SIZE or size.width() < MIN_IMAGE_SIZE:
+        raise ValueError(f"Image can't be less than {MIN_IMAGE_SIZE} by {MIN_IMAGE_SIZE} pixels!")
+    return size.height(), size.width(), bytes(reader.format()).decode()
+
+
+def working_format(image):
+    """ Helper to get the 32 bit format the effects work on for an image:
+        RGB32, or ARGB32_Premultiplied if it has transparency.
+    """
+    if image.hasAlphaChannel():
+        return QImage.Format_ARGB32_Premultiplied
+    return QImage.Format_RGB32
+
+
+def format_name(image_format):
+    """ Helper to get the name of a QImage.Format, e.g. 'Grayscale8'.
+    """
+    return FORMAT_NAMES.get(int(image_format), str(int(image_format)))
+
+
+def convert_image(image):
+    """ Converts a decoded image to its working_format(), once, as it is read.
+        The effects, the undo history and the label all work on that format, so
+        nothing converts the image again until it is saved.
+
+    Args:
+        image (QImage): The image as it was decoded.
+
+    Returns:
+        image (QImage): The same image if it already is in its working format, else a converted copy.
+    """
+    image_format = working_format(image)
+    if image.format() == image_format:
+        return image
+    with profiler.span('convert', format_name(image.format())) as span:
+        image = image.convertToFormat(image_format)
+        span.nbytes = image.sizeInBytes()
+    return image
+
+
+def is_gray(image):
+    """ Helper to tell if every pixel of a decoded image is opaque gray, without going over its pixels:
+        it is grayscale, or indexed or monochrome with only opaque gray colors.
+    """
+    return image.format() in GRAY_FORMATS and not image.hasAlphaChannel() and image.isGrayscale()
+
+
+def decode_image(path):
+    """ Reads an image file into a 32 bit QImage, the same format the window works on.
+        The size is checked from the header of the file before the image is decoded.
+
+    Args:
+        path (str): Image file path.
+
+    Raises:
+        OSError: If the file can't be read.
+        ValueError: If the image is smaller than MIN_IMAGE_SIZE.
+
+    Returns:
+        image (QImage): The image, RGB32 or ARGB32_Premultiplied if it has transparency.
+        gray (bool): Every pixel of the image is opaque gray, see apply_chain().
+    """
+    probe_image(path)
+    image = QImage(path)
+    if image.isNull():
+        raise OSError(f"Can't read image '{path}'")
+    if image.height() < MIN_IMAGE_SIZE or image.width() < MIN_IMAGE_SIZE:
+        raise ValueError(f"Image can't be less than {MIN_IMAGE_SIZE} by {MIN_IMAGE_SIZE} pixels!")
+    gray = is_gray(image)
+    return convert_image(image), gray
+
+
+def load_image(path):
+    """ Reads an image file into a 32 bit QImage, see decode_image().
+
+    Returns:
+        image (QImage): The image, RGB32 or ARGB32_Premultiplied if it has transparency.
+    """
+    return decode_image(path)[0]
+
+
+def load_scaled_image(path, height, width):
+    """ Reads an image file scaled down to a size, in the format load_image() gives.
+        JPEG files are decoded at a half, a quarter or an eighth of their size on the way,
+        so it costs a fraction of decoding the whole image. Other files are decoded whole.
+
+    Args:
+        path (str): Image file path.
+        height (int): Rows of the scaled image.
+        width (int): Pixels on every row of the scaled image.
+
+    Raises:
+        OSError: If the file can't be read.
+
+    Returns:
+        image (QImage): The scaled image.
+    """
+    reader = QImageReader(path)
+    reader.setScaledSize(QSize(width, height))
+    image = reader.read()
+    if image.isNull():
+        raise OSError(f"Can't read image '{path}'")
+    return convert_image(image)
+
+
+def save_image(image, path, options=image_writer.DEFAULT_OPTIONS):
+    """ Writes an image, the file type comes from the extension of the path.
+        The file is replaced once the new one is complete, see image_writer.
+
+    Args:
+        image (QImage): The image to write.
+        path (str): Image file path.
+        options (SaveOptions): JPEG quality and PNG compression, see image_writer.
+
+    Raises:
+        OSError: If the file can't be written.
+    """
+    image_writer.write_image(image, path, options)
+
+
+def render(image, steps, seed=None, mode=brush_engine.EXACT, gray=False):
+    """ Applies a chain of effects to a copy of an image.
+
+    Args:
+        image (QImage): A 32 bit image, e.g. from load_image.
+        steps (list or str): Steps from parse_chain, or a chain to parse.
+        seed (int): Seed of the confetti positions, the same seed gives the same image.
+        mode (str): brush_engine.EXACT or brush_engine.FAST for the brush effects.
+        gray (bool): Every pixel of the image is opaque gray, see decode_image().
+
+    Returns:
+        image (QImage): The edited copy.
+    """
+    if isinstance(steps, str):
+        steps = parse_chain(steps)
+    image = image.copy()
+    apply_chain(effects_engine.qimage_view(image), steps, Random(seed), mode, gray)
+    return image
+
+
+def process_file(source, destination, steps, seed=None, mode=brush_engine.EXACT,
+                 options=image_writer.DEFAULT_OPTIONS):
+    """ Reads an image, applies a chain of effects and writes the result.
+
+    Args:
+        source (str): Input image path.
+        destination (str): Output image path.
+        steps (list or str): Steps from parse_chain, or a chain to parse.
+        seed (int): Seed of the confetti positions.
+        mode (str): brush_engine.EXACT or brush_engine.FAST for the brush effects.
+        options (SaveOptions): JPEG quality and PNG compression, see image_writer.
+
+    Returns:
+        destination (str): The output path.
+    """
+    image, gray = decode_image(source)
+    save_image(render(image, steps, seed, mode, gray), destination, options)
+    return destination
+
+
+def expand_inputs(inputs):
+    """ Helper to turn files, folders and glob patterns into a sorted list of files.
+        Globs are expanded here as well, since not every shell does it.
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for image_pattern in IMAGE_PATTERNS:
+                paths.extend(glob.glob(os.path.join(item, image_pattern)))
+        elif glob.has_magic(item):
+            paths.extend(glob.glob(item, recursive=True))
+        else:
+            paths.append(item)
+    #drop repeated files, keeping the first time they show up
+    return list(dict.fromkeys(paths))
+
+
+def output_path(source, output_dir=None, suffix='_edited', output_format=None):
+    """ Helper to build the output path of an input file.
+
+    Args:
+        source (str): Input image path.
+        output_dir (str): Folder of the outputs, the input's folder if None.
+        suffix (str): Added to the input's name.
+        output_format (str): 'jpg' or 'png', the input's extension if None.
+
+    Returns:
+        path (str): The output path.
+    """
+    folder, name = os.path.split(source)
+    stem, extension = os.path.splitext(name)
+    if output_format is not None:
+        extension = '.' + output_format
+    if output_dir is not None:
+        folder = output_dir
+    return os.path.join(folder, stem + suffix + extension)
+
+
+def build_parser():
+    """ Helper to build the command line arguments of the batch command.
+    """
+    parser = argparse.ArgumentParser(prog='python -m abstract_image_editor batch',
+                                     description='Apply a chain of effects to image files without opening the window.')
+    parser.add_argument('inputs', nargs='+', help='image files, folders or glob patterns')
+    parser.add_argument('-e', '--effects', required=True,
+                        help='effect chain, e.g. "neon,wash:diagonal,confetti:30"')
+    parser.add_argument('-o', '--output-dir', help="output folder (default: next to each input)")
+    parser.add_argument('--suffix', default='_edited', help="added to every output name (default: _edited)")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, dest='output_format',
+                        help="output file type (default: same as the input)")
+    parser.add_argument('--quality', type=int, default=image_writer.DEFAULT,
+                        help='JPEG quality, 0 to 100 (default: 75)')
+    parser.add_argument('--png-compression', type=int, default=image_writer.DEFAULT,
+                        help='PNG compression, 0 (fastest) to 9 (smallest) (default: 6), 1 writes several times faster')
+    parser.add_argument('--seed', type=int, help='seed of the confetti positions, for repeatable outputs')
+    parser.add_argument('--fast', action='store_true',
+                        help='use the fast Wash kernel, close to but not byte for byte the exact one')
+    parser.add_argument('-j', '--workers', type=int,
+                        help='worker processes (default: one per CPU, 1 runs in this process)')
+    parser.add_argument('--max-in-flight', type=int,
+                        help='most images decoded at once, bounds the memory (default: 2 per worker)')
+    return parser
+
+
+def main(argv=None):
+    """ Batch command entry point.
+
+    Args:
+        argv (list): Command line arguments after "batch", sys.argv if None.
+
+    Returns:
+        status (int): 0 if every image was written, 1 if any failed, 2 for bad arguments.
+    """
+    #imported here, batch_executor imports this module
+    import batch_executor
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        steps = parse_chain(args.effects)
+    except ValueError as error:
+        parser.error(str(error))
+
+    sources = expand_inputs(args.inputs)
+    if not sources:
+        print('No input images found.', file=sys.stderr)
+        return 1
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if not (args.quality == image_writer.DEFAULT or 0 <= args.quality <= 100):
+        parser.error('--quality must be between 0 and 100')
+    if not (args.png_compression == image_writer.DEFAULT
+            or 0 <= args.png_compression <= image_writer.MAX_PNG_COMPRESSION):
+        parser.error(f'--png-compression must be between 0 and {image_writer.MAX_PNG_COMPRESSION}')
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    mode = brush_engine.FAST if args.fast else brush_engine.EXACT
+    jobs = ((source, output_path(source, args.output_dir, args.suffix, args.output_format), steps, args.seed)
+            for source in sources)
+
+    def report(result):
+        #one bad image doesn't stop the rest of the batch
+        if result.error is None:
+            print(f'{result.source} -> {result.destination}')
+        else:
+            print(f'{result.source}: {result.error}', file=sys.stderr)
+
+    options = image_writer.SaveOptions(args.quality, args.png_compression)
+    stats = batch_executor.run_files(jobs, args.workers, args.max_in_flight, mode, report, options)
+    print(stats.summary())
+    return 1 if stats.failed else 0
@@ -0,0 +1,108 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" The Profile panel of the window, the spans of the profiler summed up by effect and stage.
+
+    Only made when profiling is on, see profiler. It is worked out again every
+    REFRESH_INTERVAL while it is shown, and the spans can be written as a Chrome
+    trace or forgotten from it.
+"""
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import (QDockWidget, QFileDialog, QHBoxLayout, QMessageBox, QPushButton, QTableWidget,
+                             QTableWidgetItem, QVBoxLayout, QWidget)
+import profiler
+
+#Milliseconds between two refreshes of the table while it is shown.
+REFRESH_INTERVAL = 500
+COLUMNS = ('Effect', 'Stage', 'Runs', 'Total ms', 'Mean ms', 'Max ms', 'MB', 'Peak MB')
+
+
+def format_cell(value):
+    """ Helper to write a value of profiler.Profiler.summary() in the table.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return f'{value:.1f}'
+    return str(value)
+
+
+class ProfilePanel(QDockWidget):
+    """ Dock with the table of the spans recorded, see profiler.Profiler.summary().
+
+    Args:
+        parent (QWidget): The window.
+        recorder (Profiler): Where the spans come from.
+    """
+    def __init__(self, parent=None, recorder=profiler.PROFILER):
+        super(ProfilePanel, self).__init__("Profile", parent)
+        self.recorder = recorder
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        export_button = QPushButton("Export trace...")
+        export_button.clicked.connect(self.export_trace)
+        clear_button = QPushButton("Clear")
+        clear_button.clicked.connect(self.clear)
+        buttons = QHBoxLayout()
+        buttons.addWidget(export_button)
+        buttons.addWidget(clear_button)
+        buttons.addStretch()
+        layout = QVBoxLayout()
+        layout.addWidget(self.table)
+        layout.addLayout(buttons)
+        contents = QWidget()
+        contents.setLayout(layout)
+        self.setWidget(contents)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_INTERVAL)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.shown)
+
+    def shown(self, visible):
+        """ Refreshes the table only while it can be seen.
+        """
+        if visible:
+            self.refresh()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def refresh(self):
+        """ Fills the table with the summary of the spans recorded so far.
+        """
+        rows = self.recorder.summary()
+        self.table.setRowCount(len(rows))
+        for number, row in enumerate(rows):
+            for column, value in enumerate(row):
+                self.table.setItem(number, column, QTableWidgetItem(format_cell(value)))
+
+    def export_trace(self):
+        """ Asks for a file and writes the spans to it as a Chrome trace.
+        """
+        path = QFileDialog.getSaveFileName(self, "Export trace", 'trace.json', "Chrome trace (*.json)")[0]
+        if path == '':
+            return
+        try:
+            self.recorder.export_trace(path)
+        except OSError as error:
+            QMessageBox.warning(self, "Warning", f"The trace could not be written: {error}")
+
+    def clear(self):
+        self.recorder.clear()
+        self.refresh()
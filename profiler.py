@@ -0,0 +1,283 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Opt-in timing of the stages an effect goes through in the window.
+
+    Off unless the ABSTRACT_IMAGE_EDITOR_PROFILE environment variable is set or the
+    window is started with --profile. Every stage is recorded as a span with its
+    effect, its thread, the bytes it went over and, for kernels, the peak memory
+    traced while it ran:
+        load     reading and converting an image file into the canvas format.
+        convert  converting a decoded image into the canvas format, part of its load.
+        kernel   an effect working on the pixels, on the canvas or on the preview.
+        commit   recording the edit for undo and copying the changed tiles onto the canvas.
+        reduce   averaging the changed parts of the image into the label's copy.
+        paint    drawing the label's copy on the screen.
+        startup  from when the editor started loading to its first window.
+    The stages after a kernel are put down to the effect of the last kernel that ended.
+    tracemalloc has a single peak for the whole process, so it is only reset when no
+    other kernel is running. Kernels that overlap, e.g. a render and a preview of the
+    window, share a peak counted from when the first of them started, which is what
+    they took together rather than what each one took.
+
+    When it is off, span() hands back a shared span that does nothing, so the stages
+    only pay for a function call. The spans can be summed up by effect and stage,
+    see summary(), and written as Chrome trace events, see export_trace(), to be opened
+    in chrome://tracing or Perfetto.
+"""
+from collections import deque, namedtuple
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+ENABLE_VARIABLE = 'ABSTRACT_IMAGE_EDITOR_PROFILE'
+#Most spans kept, the oldest ones are dropped.
+MAX_EVENTS = 100000
+PHASES = ('startup', 'load', 'convert', 'kernel', 'commit', 'reduce', 'paint')
+
+#A stage that ran, start is time.perf_counter(), peak is in bytes or None.
+Event = namedtuple('Event', 'phase effect start duration thread nbytes peak')
+
+
+class Span:
+    """ Times a stage as a context manager, see Profiler.span().
+    """
+    def __init__(self, profiler, phase, effect, nbytes):
+        self.profiler = profiler
+        self.phase = phase
+        self.effect = effect
+        self.nbytes = nbytes
+        self.start = 0
+        #memory traced when the first of the kernels running started, the peak is counted from there
+        self.base = 0
+
+    def __enter__(self):
+        if self.phase == 'kernel':
+            self.base = self.profiler.kernel_started()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        end = time.perf_counter()
+        peak = None
+        if self.phase == 'kernel':
+            peak = self.profiler.kernel_ended() - self.base
+        self.profiler.record(self, end, peak)
+        return False
+
+
+class NoSpan:
+    """ The span handed back while profiling is off.
+    """
+    nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+class Profiler:
+    """ The spans recorded while profiling is on.
+        Spans come from the window and the render thread, the lock guards them.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.lock = threading.Lock()
+        self.threads = {}
+        #effect of the last kernel, the stages after it are put down to it
+        self.effect = None
+        #kernels running, and the memory traced when the first of them started
+        self.kernels = 0
+        self.kernel_base = 0
+        #where the trace is written when the window closes, if anywhere
+        self.trace_path = None
+
+    def enable(self, trace_path=None):
+        """ Starts recording, and tracing the memory Python and NumPy allocate.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+        self.trace_path = trace_path
+
+    def span(self, phase, effect=None, nbytes=0):
+        """ Times a stage, e.g. "with PROFILER.span('kernel', 'neon', pixels.nbytes):".
+            The bytes can be set on the span once they are known.
+
+        Args:
+            phase (str): One of PHASES.
+            effect (str): The effect worked on, the last kernel's if None.
+            nbytes (int): Bytes the stage goes over.
+        """
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, phase, effect, nbytes)
+
+    def mark(self, phase, effect, start):
+        """ Records a stage that started before it could be timed with span().
+
+        Args:
+            phase (str): One of PHASES.
+            effect (str): What the stage was about.
+            start (float): time.perf_counter() when it started, it ends now.
+        """
+        if self.enabled:
+            span = Span(self, phase, effect, 0)
+            span.start = start
+            self.record(span, time.perf_counter(), None)
+
+    def kernel_started(self):
+        """ Helper to count a kernel in, the peak is reset if no other kernel is running.
+
+        Returns:
+            base (int): Bytes traced when the first of the kernels running started.
+        """
+        with self.lock:
+            if self.kernels == 0:
+                tracemalloc.reset_peak()
+                self.kernel_base = tracemalloc.get_traced_memory()[0]
+            self.kernels += 1
+            return self.kernel_base
+
+    def kernel_ended(self):
+        """ Helper to count a kernel out.
+
+        Returns:
+            peak (int): Most bytes traced since the first of the kernels running started.
+        """
+        with self.lock:
+            self.kernels -= 1
+            return tracemalloc.get_traced_memory()[1]
+
+    def record(self, span, end, peak):
+        """ Helper to keep a finished span.
+        """
+        thread = threading.current_thread()
+        with self.lock:
+            effect = span.effect
+            if span.phase == 'kernel':
+                self.effect = effect
+            elif effect is None:
+                effect = self.effect
+            self.threads[thread.ident] = thread.name
+            self.events.append(Event(span.phase, effect, span.start, end - span.start,
+                                     thread.ident, int(span.nbytes), peak))
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.events)
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.effect = None
+
+    def summary(self):
+        """ Sums up the spans by effect and stage.
+
+        Returns:
+            rows (list): (effect, phase, count, total ms, mean ms, max ms, MB gone over,
+            peak MB or None) tuples, in the order the effects were first seen.
+        """
+        totals = {}
+        for event in self.snapshot():
+            key = (event.effect or '-', event.phase)
+            count, total, longest, nbytes, peak = totals.get(key, (0, 0.0, 0.0, 0, None))
+            if event.peak is not None:
+                peak = max(peak or 0, event.peak)
+            totals[key] = (count + 1, total + event.duration, max(longest, event.duration),
+                           nbytes + event.nbytes, peak)
+        rows = []
+        for (effect, phase), (count, total, longest, nbytes, peak) in totals.items():
+            rows.append((effect, phase, count, total * 1000, total * 1000 / count, longest * 1000,
+                         nbytes / 1e6, None if peak is None else peak / 1e6))
+        return rows
+
+    def trace_events(self):
+        """ Turns the spans into Chrome trace events, times in microseconds.
+
+        Returns:
+            trace (dict): {"traceEvents": [...]}, ready for json.dump().
+        """
+        process = os.getpid()
+        recorded = self.snapshot()
+        #the trace starts with the first stage
+        origin = min((event.start for event in recorded), default=0)
+        events = []
+        for event in recorded:
+            args = {'bytes': event.nbytes}
+            if event.peak is not None:
+                args['peak_bytes'] = event.peak
+            events.append({'name': f'{event.phase} {event.effect or ""}'.strip(), 'cat': event.phase, 'ph': 'X',
+                           'ts': (event.start - origin) * 1e6, 'dur': event.duration * 1e6,
+                           'pid': process, 'tid': event.thread, 'args': args})
+        with self.lock:
+            threads = dict(self.threads)
+        for ident, name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': process, 'tid': ident, 'args': {'name': name}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_trace(self, path):
+        """ Writes the spans as a Chrome trace event file.
+
+        Raises:
+            OSError: If the file can't be written.
+        """
+        with open(path, 'w') as trace_file:
+            json.dump(self.trace_events(), trace_file)
+
+
+#The profiler of the process, every stage records to it.
+PROFILER = Profiler()
+
+
+def span(phase, effect=None, nbytes=0):
+    """ Shortcut for PROFILER.span().
+    """
+    return PROFILER.span(phase, effect, nbytes)
+
+
+def enable_from(argv, environ=os.environ):
+    """ Turns profiling on if asked to by the environment or the command line.
+        ABSTRACT_IMAGE_EDITOR_PROFILE=1 or --profile turn it on, a file name given as
+        ABSTRACT_IMAGE_EDITOR_PROFILE=trace.json or --profile=trace.json also gets the
+        trace written to it when the window closes.
+
+    Args:
+        argv (list): Command line arguments.
+        environ (dict): Environment variables.
+
+    Returns:
+        enabled (bool): Whether profiling is on.
+    """
+    setting = environ.get(ENABLE_VARIABLE, '')
+    for argument in argv:
+        if argument == '--profile':
+            setting = setting or '1'
+        elif argument.startswith('--profile='):
+            setting = argument.split('=', 1)[1]
+    if setting in ('', '0'):
+        return False
+    PROFILER.enable(None if setting == '1' else setting)
+    return True
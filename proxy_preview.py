@@ -0,0 +1,152 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Low resolution previews of the slider effects while a slider is dragged.
+
+    The proxy is a copy of the canvas scaled down to about the size it is shown at.
+    The moves of the slider are rendered on it right away, and kept as full
+    resolution steps to be rendered on the canvas once the slider is let go.
+
+    Settings measured in pixels are scaled with the image:
+        melt         the rows to melt are scaled by the proxy's scale.
+        confetti     the side of the squares comes from the size of the image,
+                     see slider_engine.confetti_side(), so it scales by itself
+                     and the number of squares stays the same.
+    The brush effects compare fixed neighbours, they only look coarser on the proxy.
+"""
+from PyQt5.QtCore import Qt
+from random import Random
+import effects_engine
+import pipeline
+import profiler
+
+#Images with fewer than this many times the pixels of the label are previewed at full resolution.
+MIN_PROXY_RATIO = 2
+
+
+def proxy_scale(height, width, bound_height, bound_width):
+    """ Helper to get the scale that makes an image cover a box on both sides, at most 1.
+        The same scale is used on both sides, so the confetti squares stay square.
+    """
+    return min(1.0, max(bound_height / height, bound_width / width))
+
+
+def worth_a_proxy(height, width, bound_height, bound_width):
+    """ Helper to tell if an image is big enough next to the label to be previewed on a proxy.
+    """
+    scale = proxy_scale(height, width, bound_height, bound_width)
+    return scale * scale * MIN_PROXY_RATIO <= 1
+
+
+def proxy_size(height, width, bound_height, bound_width):
+    """ Helper to get the size of the proxy of an image.
+
+    Returns:
+        height (int): Rows of the proxy.
+        width (int): Pixels on every row of the proxy.
+    """
+    scale = proxy_scale(height, width, bound_height, bound_width)
+    return max(pipeline.MIN_IMAGE_SIZE, round(height * scale)), max(pipeline.MIN_IMAGE_SIZE, round(width * scale))
+
+
+def canvas_proxy(canvas, bound_height, bound_width):
+    """ Makes the proxy of a canvas, holding its lock while the canvas is scaled down.
+
+    Returns:
+        preview (ProxyPreview): The new proxy.
+    """
+    with canvas.lock:
+        return ProxyPreview(canvas.image, canvas.height, canvas.width, bound_height, bound_width)
+
+
+def scale_step(step, scale):
+    """ Scales the settings of a step that are measured in pixels.
+
+    Args:
+        step (tuple): (name, setting) from pipeline.parse_chain.
+        scale (float): Size of the proxy over the size of the image.
+
+    Returns:
+        step (tuple): The step for the proxy.
+    """
+    name, setting = step
+    if name == 'melt' and setting:
+        #a melt that moves the image keeps moving it on the proxy
+        rows = max(1, round(abs(setting) * scale))
+        return name, rows if setting > 0 else -rows
+    return step
+
+
+class ProxyPreview:
+    """ A scaled down copy of the canvas and the steps rendered on it.
+
+    Args:
+        image (QImage): The image to preview, at full resolution or already scaled down,
+        e.g. decoded at a reduced size while the canvas is opened.
+        full_height (int): Rows of the image at full resolution.
+        full_width (int): Pixels on every row of the image at full resolution.
+        bound_height (int): Height the image is shown at.
+        bound_width (int): Width the image is shown at.
+    """
+    def __init__(self, image, full_height, full_width, bound_height, bound_width):
+        height, width = proxy_size(full_height, full_width, bound_height, bound_width)
+        if image.height() != height or image.width() != width:
+            image = image.scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        self.image = image.convertToFormat(pipeline.working_format(image))
+        self.pixels = effects_engine.qimage_view(self.image)
+        #rows of the proxy per row of the image
+        self.scale = height / full_height
+        #its own confetti positions, the canvas' ones are left for the full resolution render
+        self.rand = Random()
+        #full resolution steps rendered on the proxy and not yet on the canvas
+        self.steps = []
+        #shown instead of the canvas, until the canvas has caught up
+        self.visible = True
+
+    def render(self, steps, mode, rand=None, chain=None):
+        """ Renders steps on the proxy right away and keeps them for the canvas.
+
+        Args:
+            steps (list): Full resolution (name, setting) tuples.
+            mode (str): brush_engine.EXACT or brush_engine.FAST for the brush effects.
+            rand (Random): Source of the confetti positions for the canvas.
+            chain (tuple): Effect chain of the canvas once the steps are done.
+        """
+        self.draw(steps, mode)
+        self.keep(steps, mode, rand, chain)
+
+    def draw(self, steps, mode):
+        """ Renders steps on the proxy only, e.g. before there is a canvas to keep them for.
+        """
+        proxy_steps = [scale_step(step, self.scale) for step in steps]
+        with profiler.span('kernel', f'preview {pipeline.format_chain(steps)}', self.pixels.nbytes):
+            pipeline.apply_chain(self.pixels, proxy_steps, self.rand, mode)
+        self.visible = True
+
+    def keep(self, steps, mode, rand=None, chain=None):
+        """ Keeps steps already drawn on the proxy for the canvas, see render().
+        """
+        self.steps.append((steps, mode, rand, chain))
+
+    def take_steps(self):
+        """ Helper to hand over the steps the canvas still needs, in order.
+
+        Returns:
+            steps (list): (steps, mode, rand, chain) tuples, as given to render().
+        """
+        steps = self.steps
+        self.steps = []
+        return steps
@@ -0,0 +1,292 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" A working canvas that lives in a memory mapped file, for images too big for memory.
+
+    The file is a HEADER_SIZE byte header followed by the rows of the image,
+    4 bytes per pixel in the blue, green, red, alpha order of a 32 bit QImage:
+        magic       8 bytes, MAGIC
+        version     uint32
+        header      uint32, size of the header in bytes
+        width       uint32
+        height      uint32
+        format      uint32, the QImage.Format of the pixels
+        row bytes   uint32, bytes from the start of a row to the next one
+    all little endian, the rest of the header is zeros.
+
+    The effects work on canvas.pixels in place like on any other array,
+    and the operating system only keeps the pages in use in memory.
+"""
+from PyQt5.QtGui import QImage, QImageReader
+from PyQt5 import sip
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+import profiler
+
+PIXEL_CONTENTS = 4
+MIN_IMAGE_SIZE = 4
+MEGABYTE = 1024 * 1024
+
+#Decoded size from which an image is edited in a canvas file rather than in memory.
+CANVAS_BYTES = 512 * MEGABYTE
+
+MAGIC = b'AIECANVS'
+VERSION = 1
+HEADER = struct.Struct('<8s6I')
+HEADER_SIZE = 64
+
+#Rows converted and compressed at a time when exporting.
+EXPORT_ROWS = 256
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_COMPRESSION = 6
+#PNG color types and the filter used on every row, each row minus the row above.
+PNG_RGB = 2
+PNG_RGBA = 6
+PNG_FILTER_UP = 2
+
+
+class RawCanvas:
+    """ An open canvas file.
+
+    Args:
+        path (str): The canvas file.
+        writable (bool): Open for reading and writing, or only for reading.
+    """
+    def __init__(self, path, writable=True):
+        self.path = path
+        with open(path, 'rb') as canvas_file:
+            header = canvas_file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"'{path}' is not a canvas file")
+        magic, version, header_size, width, height, image_format, row_bytes = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{path}' is not a canvas file")
+
+        self.width = width
+        self.height = height
+        self.image_format = QImage.Format(image_format)
+        self.row_bytes = row_bytes
+        self.header_size = header_size
+        self.writable = writable
+        #the whole file is mapped, a mapping has to start on a page
+        with open(path, 'r+b' if writable else 'rb') as canvas_file:
+            self.mapping = mmap.mmap(canvas_file.fileno(), header_size + height * row_bytes,
+                                     access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self.pixels, self.rows = self.views()
+
+    def views(self):
+        """ Helper to make the arrays of the pixels and of the rows on the mapping.
+        """
+        rows = np.frombuffer(self.mapping, np.uint8, self.height * self.row_bytes, self.header_size)
+        rows = rows.reshape(self.height, self.row_bytes)
+        #stride aware, rows may be padded past the last pixel
+        pixels = rows[:, :self.width * PIXEL_CONTENTS].reshape(self.height, self.width, PIXEL_CONTENTS)
+        return pixels, rows
+
+    def image(self):
+        """ Returns a QImage that reads and writes the canvas file without copying it.
+            The canvas must stay open while the image is used.
+        """
+        return QImage(sip.voidptr(self.rows.ctypes.data), self.width, self.height,
+                      self.row_bytes, self.image_format)
+
+    def flush(self):
+        """ Writes the changed pages back to the file.
+        """
+        if self.writable:
+            self.mapping.flush()
+
+    def close(self):
+        """ Flushes and unmaps the canvas. Every array taken from it must be let go of first.
+
+        Raises:
+            BufferError: If an array taken from the canvas is still around,
+            the canvas stays open then.
+        """
+        self.flush()
+        self.pixels = None
+        self.rows = None
+        try:
+            #the mapping refuses to close while an array still points into it
+            self.mapping.close()
+        except BufferError:
+            self.pixels, self.rows = self.views()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def create_canvas(path, height, width, image_format=QImage.Format_RGB32):
+    """ Creates a canvas file of the given size, every byte zero.
+
+    Args:
+        path (str): The new canvas file, replaced if it exists.
+        height (int): Rows of the image.
+        width (int): Pixels on every row.
+        image_format (QImage.Format): A 32 bit format, RGB32 or ARGB32_Premultiplied.
+
+    Returns:
+        canvas (RawCanvas): The open canvas.
+    """
+    row_bytes = width * PIXEL_CONTENTS
+    header = HEADER.pack(MAGIC, VERSION, HEADER_SIZE, width, height, int(image_format), row_bytes)
+    with open(path, 'wb') as canvas_file:
+        canvas_file.write(header.ljust(HEADER_SIZE, b'\0'))
+        #sparse on most file systems, the pages are only written when touched
+        canvas_file.truncate(HEADER_SIZE + height * row_bytes)
+    return RawCanvas(path)
+
+
+def decoded_bytes(source):
+    """ Helper to read the decoded size of an image from its header, 0 if the header doesn't say.
+    """
+    size = QImageReader(source).size()
+    if not size.isValid():
+        return 0
+    return size.height() * size.width() * PIXEL_CONTENTS
+
+
+def import_image(source, path):
+    """ Decodes an image file into a new canvas file.
+        Opaque images are decoded straight into the canvas, anything else is
+        converted to ARGB32_Premultiplied (the format the window works on) a few rows at a time,
+        so no full size copy is made on top of the decoded image.
+
+    Args:
+        source (str): Image file path.
+        path (str): The new canvas file.
+
+    Raises:
+        OSError: If the file can't be read.
+        ValueError: If the image is smaller than MIN_IMAGE_SIZE.
+
+    Returns:
+        canvas (RawCanvas): The open canvas.
+    """
+    reader = QImageReader(source)
+    size = reader.size()
+    if not reader.canRead():
+        raise OSError(f"Can't read image '{source}'")
+    if size.isValid() and (size.height() < MIN_IMAGE_SIZE or size.width() < MIN_IMAGE_SIZE):
+        raise ValueError(f"Image can't be less than {MIN_IMAGE_SIZE} by {MIN_IMAGE_SIZE} pixels!")
+
+    if size.isValid() and reader.imageFormat() == QImage.Format_RGB32:
+        canvas = create_canvas(path, size.height(), size.width(), QImage.Format_RGB32)
+        target = canvas.image()
+        #the reader reuses the buffer of an image of the right size and format
+        if reader.read(target) and int(target.constBits()) == canvas.rows.ctypes.data:
+            return canvas
+        canvas.close()
+        reader = QImageReader(source)
+
+    image = reader.read()
+    if image.isNull():
+        raise OSError(f"Can't read image '{source}'")
+    if image.height() < MIN_IMAGE_SIZE or image.width() < MIN_IMAGE_SIZE:
+        raise ValueError(f"Image can't be less than {MIN_IMAGE_SIZE} by {MIN_IMAGE_SIZE} pixels!")
+
+    if image.hasAlphaChannel():
+        image_format = QImage.Format_ARGB32_Premultiplied
+    else:
+        image_format = QImage.Format_RGB32
+    canvas = create_canvas(path, image.height(), image.width(), image_format)
+    with profiler.span('convert', os.path.basename(source), canvas.pixels.nbytes):
+        for start in range(0, image.height(), EXPORT_ROWS):
+            rows = min(EXPORT_ROWS, image.height() - start)
+            band = image.copy(0, start, image.width(), rows).convertToFormat(image_format)
+            canvas.pixels[start:start + rows] = image_view(band)
+    return canvas
+
+
+def image_view(image):
+    """ Helper to see a 32 bit QImage as a (height, width, 4) uint8 array, padded rows included.
+    """
+    pointer = image.constBits()
+    pointer.setsize(image.byteCount())
+    rows = np.frombuffer(pointer, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+    return rows[:, :image.width() * PIXEL_CONTENTS].reshape(image.height(), image.width(), PIXEL_CONTENTS)
+
+
+def png_chunk(kind, data):
+    """ Helper to build a PNG chunk: length, type, data and CRC.
+    """
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def export_png(canvas, destination, compression=PNG_COMPRESSION):
+    """ Writes a canvas to a PNG file a few rows at a time,
+        so the memory used doesn't grow with the size of the image.
+
+    Args:
+        canvas (RawCanvas): The canvas to write.
+        destination (str): The PNG file.
+        compression (int): zlib level, 0 (none) to 9 (smallest file).
+    """
+    alpha = canvas.image_format != QImage.Format_RGB32
+    #blue, green, red, alpha bytes to red, green, blue (and alpha) bytes
+    channels = [2, 1, 0, 3] if alpha else [2, 1, 0]
+    compressor = zlib.compressobj(compression)
+    previous = np.zeros(canvas.width * len(channels), dtype=np.uint8)
+
+    with open(destination, 'wb') as png_file:
+        png_file.write(PNG_SIGNATURE)
+        header = struct.pack('>IIBBBBB', canvas.width, canvas.height, 8,
+                             PNG_RGBA if alpha else PNG_RGB, 0, 0, 0)
+        png_file.write(png_chunk(b'IHDR', header))
+
+        for start in range(0, canvas.height, EXPORT_ROWS):
+            rows = canvas.pixels[start:start + EXPORT_ROWS]
+            if alpha:
+                #PNG keeps the colors apart from the alpha, undo the premultiplication like QImage does
+                band = QImage(rows.tobytes(), canvas.width, len(rows), canvas.width * PIXEL_CONTENTS,
+                              canvas.image_format).convertToFormat(QImage.Format_ARGB32)
+                rows = image_view(band)
+            values = rows[..., channels].reshape(len(rows), -1)
+
+            lines = np.empty((len(rows), values.shape[1] + 1), dtype=np.uint8)
+            lines[:, 0] = PNG_FILTER_UP
+            lines[0, 1:] = values[0] - previous
+            lines[1:, 1:] = values[1:] - values[:-1]
+            previous = values[-1].copy()
+
+            data = compressor.compress(lines.tobytes())
+            if data:
+                png_file.write(png_chunk(b'IDAT', data))
+
+        png_file.write(png_chunk(b'IDAT', compressor.flush()))
+        png_file.write(png_chunk(b'IEND', b''))
+
+
+def export_image(canvas, destination):
+    """ Writes a canvas to an image file, the type comes from the extension.
+        PNG files are streamed by export_png, other types are written by QImage
+        straight from the mapped file.
+
+    Raises:
+        OSError: If the file can't be written.
+    """
+    if os.path.splitext(destination)[1].lower() == '.png':
+        export_png(canvas, destination)
+        return
+    if not canvas.image().save(destination):
+        raise OSError(f"Can't write image '{destination}'")
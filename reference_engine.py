@@ -0,0 +1,345 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" The original per byte loops of the editor, kept as the reference the other engines
+    are checked against, see golden_harness.
+
+    Every effect is the loop the window first ran, on a list of ints copied from the
+    image and written back at the end, with the same position stepping, so they
+    are very slow and only meant for small images. Negative positions wrap around
+    to the end of the buffer and positions past it raise IndexError, like on the
+    buffer of the QImage.
+
+    Confetti paints its squares byte by byte like the original loop, at the centers
+    slider_engine.confetti_centers() draws, since the random positions changed.
+    Melts of the image height or more aren't supported, the original loop
+    doesn't end or goes out of the buffer there.
+"""
+from random import Random
+import effects_engine
+import brush_engine
+import slider_engine
+import pipeline
+
+MAX_RGB_VALUE = effects_engine.MAX_RGB_VALUE
+MIN_RGB_VALUE = effects_engine.MIN_RGB_VALUE
+PIXEL_CONTENTS = 4
+R_G_B = 3
+SIMILARITY_RANGE = brush_engine.SIMILARITY_RANGE
+
+
+def run_loop(pixels, loop, *args):
+    """ Helper to run a loop on a list of the bytes of an image and write the list back.
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 array, changed in place.
+        loop (function): Called with the list, the image width and args, changes the list.
+
+    Returns:
+        pixels (ndarray): The same array.
+    """
+    flat = pixels.reshape(-1)
+    array = flat.tolist()
+    loop(array, pixels.shape[1], *args)
+    flat[:] = array
+    return pixels
+
+
+def band_loop(array, width, bands):
+    for position in range(0, len(array), PIXEL_CONTENTS):
+        for iteration in range(R_G_B):
+            value = array[position] + bands[0]
+            if value >= 0 and value <= 50:
+                array[position] = bands[1]
+            elif value >= 51 and value <= 100:
+                array[position] = bands[2]
+            elif value >= 101 and value <= 150:
+                array[position] = bands[3]
+            elif value >= 151 and value <= 200:
+                array[position] = bands[4]
+            else:
+                array[position] = bands[5]
+            position += 1 #go forward 1 rgb value
+
+
+def zeus(pixels):
+    return run_loop(pixels, band_loop, (effects_engine.ZEUS_VALUE,) + effects_engine.ZEUS_BANDS)
+
+
+def mint(pixels):
+    return run_loop(pixels, band_loop, (effects_engine.MINT_VALUE,) + effects_engine.MINT_BANDS)
+
+
+def brighter_loop(array, width):
+    brighter_value = effects_engine.BRIGHTER_VALUE
+    for position in range(0, len(array), PIXEL_CONTENTS):
+        blue_green_red = [array[position], array[position + 1], array[position + 2]]
+        for color in blue_green_red:
+            if (color + brighter_value) > MAX_RGB_VALUE:
+                array[position] = color - brighter_value
+            else:
+                array[position] = color + brighter_value
+            position += 1 #go forward 1 rgb value
+
+
+def brighter(pixels):
+    return run_loop(pixels, brighter_loop)
+
+
+def neon_loop(array, width):
+    for value in effects_engine.NEON_VALUES:
+        for position in range(1, len(array) - PIXEL_CONTENTS, PIXEL_CONTENTS):
+            blue_green_red = [array[position], array[position + 1], array[position + 2]]
+            for color in blue_green_red:
+                if (color + value) < MIN_RGB_VALUE:
+                    array[position] = array[position + 1]
+                elif (color + value) > MAX_RGB_VALUE:
+                    array[position] = array[position - 1]
+                else:
+                    array[position] = color + value
+                position += 1 #go forward 1 grb value
+
+
+def neon(pixels):
+    return run_loop(pixels, neon_loop)
+
+
+def wild_west_loop(array, width):
+    ww_value = effects_engine.WILD_WEST_VALUE
+    for position in range(0, len(array) - PIXEL_CONTENTS, PIXEL_CONTENTS):
+        blue_green_red = [array[position], array[position + 2], array[position + 1]]
+        for color in blue_green_red:
+            if (color + ww_value) < MIN_RGB_VALUE:
+                array[position] = MAX_RGB_VALUE + color + ww_value
+            elif (color + ww_value) > MAX_RGB_VALUE:
+                array[position] = color + ww_value - MAX_RGB_VALUE
+            else:
+                array[position] = color + ww_value
+            position += 2 #go forward 2 rgb values
+
+
+def wild_west(pixels):
+    return run_loop(pixels, wild_west_loop)
+
+
+def sketch_loop(array, width):
+    for position in range(len(array) - PIXEL_CONTENTS):
+        rgb = [array[position], array[position + 1], array[position + 2]]
+        for color in rgb:
+            if color > effects_engine.SKETCH_HIGH:
+                array[position] = MIN_RGB_VALUE
+            elif color < effects_engine.SKETCH_LOW:
+                array[position] = MAX_RGB_VALUE
+
+
+def sketch(pixels):
+    return run_loop(pixels, sketch_loop)
+
+
+def pattern_loop(array, width):
+    pattern_value = effects_engine.PATTERN_VALUE
+    for position in range(0, len(array) - PIXEL_CONTENTS, PIXEL_CONTENTS):
+        blue_green_red = [array[position - 3], array[position - 2], array[position - 1]]
+        for color in blue_green_red:
+            if (color + pattern_value) < MIN_RGB_VALUE:
+                array[position] = MAX_RGB_VALUE + color + pattern_value
+            elif (color + pattern_value) > MAX_RGB_VALUE:
+                array[position] = color + pattern_value - MAX_RGB_VALUE
+            else:
+                array[position] = color + pattern_value
+            position += 3 #go forward 3 rgb values
+
+
+def pattern(pixels):
+    return run_loop(pixels, pattern_loop)
+
+
+COLOR_EFFECTS = {
+    'zeus': zeus,
+    'mint': mint,
+    'brighter': brighter,
+    'sketch': sketch,
+    'neon': neon,
+    'wild_west': wild_west,
+    'pattern': pattern,
+}
+
+
+def copy_bytes(array, target, source, channels=(0, 1, 2)):
+    """ Helper to copy 3 bytes one at a time, byte n of target taking byte channels[n] of source.
+    """
+    for byte, channel in enumerate(channels):
+        array[target + byte] = array[source + channel]
+
+
+def brush_loop(array, width, effect, pattern):
+    values_per_row = width * PIXEL_CONTENTS
+    total_rows = len(array) // values_per_row - 2
+    row_start = values_per_row + PIXEL_CONTENTS
+    row_end = (values_per_row * 2) - PIXEL_CONTENTS
+    perimeter = []
+
+    for row in range(total_rows):
+        for column in range(row_start, row_end, PIXEL_CONTENTS):
+            #select encircling pixels
+            if pattern == 'diagonal':
+                perimeter.append(column + values_per_row - PIXEL_CONTENTS) #bottom left pixel
+                perimeter.append(column - values_per_row + PIXEL_CONTENTS) #top right pixel
+            else:
+                perimeter.append(column - values_per_row) #top pixel
+                perimeter.append(column + PIXEL_CONTENTS) #side right pixel
+                perimeter.append(column + values_per_row) #bottom pixel
+                perimeter.append(column - PIXEL_CONTENTS) #side left pixel
+
+            current_red = array[column + 2]
+            current_green = array[column + 1]
+            current_blue = array[column]
+
+            for perimeter_pixel in perimeter:
+                red_diff = array[perimeter_pixel + 2] - current_red
+                gre_diff = array[perimeter_pixel + 1] - current_green
+                blu_diff = array[perimeter_pixel] - current_blue
+                if (abs(red_diff) > SIMILARITY_RANGE or abs(gre_diff) > SIMILARITY_RANGE
+                        or abs(blu_diff) > SIMILARITY_RANGE):
+                    continue
+
+                if effect == 'wash' or effect == 'zombie':
+                    copy_bytes(array, column, perimeter_pixel)
+                    if effect == 'zombie':
+                        column += 1 #go forward 1 rgb value
+                elif effect == 'strie' or effect == 'diamond':
+                    copy_bytes(array, perimeter_pixel, column)
+                    if effect == 'strie':
+                        column += 8 #go forward 2 pixels
+                    else:
+                        column += 1 #go forward 1 rgb value
+                elif effect == 'dust':
+                    copy_bytes(array, column, perimeter_pixel)
+                    column += 4 #go forward 1 pixel
+                    copy_bytes(array, perimeter_pixel, column)
+                    column += -20 #go back 5 pixels
+                    copy_bytes(array, perimeter_pixel, column)
+                    column += 8 #go forward 2 pixels
+                elif effect == 'metal':
+                    copy_bytes(array, column, perimeter_pixel, (1, 2, 0))
+                    column += -5 #go back 5 rgb values
+            perimeter.clear()
+
+        #move row_start and row_end to the next row
+        row_start += values_per_row
+        row_end += values_per_row
+
+
+def brush(pixels, effect, pattern):
+    """ Applies a brush effect, see brush_engine for what they do.
+        Anything other than 'diagonal' is treated as 'cross'.
+    """
+    return run_loop(pixels, brush_loop, effect, pattern)
+
+
+def melt_loop(array, width, rows_to_melt, direction):
+    rgb_values_per_row = width * PIXEL_CONTENTS
+    if direction > 0: #slide up
+        pixel_position = (rows_to_melt * rgb_values_per_row) - 1
+    else: #slide down
+        pixel_position = (len(array) - (rows_to_melt * rgb_values_per_row)) - 1
+
+    column = 0
+    done = False
+    while not done:
+        row_number = rgb_values_per_row
+        #travel up or down the current column for all of the n rows_to_melt
+        for pixel in range(rows_to_melt):
+            if direction > 0: #slide up
+                for byte in range(PIXEL_CONTENTS):
+                    array[(pixel_position - byte) - row_number] = array[pixel_position - byte]
+            else: #slide down
+                for byte in range(PIXEL_CONTENTS):
+                    array[(pixel_position - byte) + row_number] = array[pixel_position - byte]
+            row_number += rgb_values_per_row
+
+        column += PIXEL_CONTENTS
+        if column == rgb_values_per_row:
+            column = 0
+            #skip n rows_to_melt
+            if direction > 0:
+                pixel_position += (rows_to_melt * rgb_values_per_row)
+            else:
+                pixel_position -= (rows_to_melt * rgb_values_per_row)
+        else:
+            if direction > 0:
+                pixel_position += PIXEL_CONTENTS
+            else:
+                pixel_position -= PIXEL_CONTENTS
+
+        if pixel_position < 0 or pixel_position > len(array):
+            done = True
+
+
+def melt(pixels, rows_to_melt, direction):
+    """ Melts the image, rows_to_melt must be less than the image height.
+    """
+    if rows_to_melt >= pixels.shape[0]:
+        raise ValueError(f'The reference melt needs less than {pixels.shape[0]} rows, got {rows_to_melt}')
+    return run_loop(pixels, melt_loop, rows_to_melt, direction)
+
+
+def confetti_loop(array, width, confetti_quantity, rand):
+    height = len(array) // (width * PIXEL_CONTENTS)
+    side = slider_engine.confetti_side(height, width)
+    rgb_values_per_row = width * PIXEL_CONTENTS
+    rows, columns = slider_engine.confetti_centers(height, width, side, confetti_quantity, rand)
+    for row, column in zip(rows.tolist(), columns.tolist()):
+        center = (row * width + column) * PIXEL_CONTENTS
+        #the top left corner pixel of the confetti shape
+        start_pixel = center - side * PIXEL_CONTENTS - side * rgb_values_per_row
+        for square_row in range(side):
+            current_pixel = start_pixel
+            for pixel in range(side):
+                copy_bytes(array, current_pixel, center)
+                current_pixel += PIXEL_CONTENTS
+            start_pixel += rgb_values_per_row
+
+
+def confetti(pixels, confetti_quantity, rand):
+    return run_loop(pixels, confetti_loop, confetti_quantity, rand)
+
+
+def apply_chain(pixels, steps, rand=None):
+    """ Applies a chain of effects with the reference loops, like pipeline.apply_chain().
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 BGRA array, changed in place.
+        steps (list): Steps from pipeline.parse_chain.
+        rand (Random): Source of the confetti positions, a new unseeded one if None.
+
+    Returns:
+        pixels (ndarray): The same array.
+    """
+    if rand is None:
+        rand = Random()
+    for name, setting in steps:
+        if name in COLOR_EFFECTS:
+            COLOR_EFFECTS[name](pixels)
+        elif name in pipeline.BRUSH_PATTERNS:
+            brush(pixels, name, pipeline.BRUSH_PATTERNS[name])
+        elif name == 'wash':
+            brush(pixels, name, setting)
+        elif name == 'melt':
+            melt(pixels, abs(setting), setting)
+        elif name == 'confetti':
+            confetti(pixels, setting, rand)
+    return pixels
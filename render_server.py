@@ -0,0 +1,631 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Serves the effects over HTTP, for other tools on the same machine to call.
+
+    Run it as "python -m abstract_image_editor serve", it listens on localhost:
+        POST /render?effects=neon,melt:20   the body is an image file, the answer is the edited
+                                            image, encoded as the upload was or as format= asks.
+                                            Also takes seed=, fast=1 (a faster Wash), quality=
+                                            (JPEG, 0-100) and png_compression= (0-9).
+        GET /metrics                        JSON: requests by status, queue depth, latency
+                                            histograms and throughput.
+
+    The images are decoded, edited and encoded on a pool of worker processes, started
+    and warmed up by running every effect once before the server takes requests, and
+    again when a worker dies. Only the
+    encoded files go to and from the workers. Requests wait in a queue of at most
+    max_queue, past that they are answered 429 Too Many Requests at once. A single
+    dispatcher thread takes them from the queue and keeps at most IN_FLIGHT_PER_WORKER
+    batches per worker running: small images waiting together are sent to a worker as a
+    batch of up to batch_size, so they pay for a single trip to the worker.
+"""
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from urllib.parse import parse_qs, urlsplit
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice
+from PyQt5.QtGui import QImage, QImageReader
+import argparse
+import json
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import numpy as np
+import batch_executor
+import pipeline
+import tiled_engine
+import brush_engine
+import effects_engine
+import image_writer
+import raw_canvas
+
+PIXEL_CONTENTS = 4
+MEGABYTE = 1024 * 1024
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+#Requests waiting for a worker before new ones get a 429.
+MAX_QUEUE = 64
+#Most small requests sent to a worker at once.
+BATCH_SIZE = 8
+#Images up to this many decoded bytes (512 by 512 pixels) are batched together.
+SMALL_IMAGE_BYTES = 512 * 512 * PIXEL_CONTENTS
+#Batches running per worker, so a worker never idles while its next batch is sent.
+IN_FLIGHT_PER_WORKER = 2
+MAX_UPLOAD_BYTES = 64 * MEGABYTE
+#Seconds a request waits for its image before it is answered 504.
+REQUEST_TIMEOUT = 300
+#Seconds a client is told to wait after a 429.
+RETRY_AFTER = 1
+#Upper bounds of the latency histograms, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+#Runs every engine once in every worker before the server takes requests.
+WARM_UP_CHAIN = 'neon,wild_west,zeus,mint,brighter,sketch,pattern,strie,diamond,zombie,dust,metal,wash,melt:1,confetti:1'
+WARM_UP_SIZE = 16
+#Seconds a worker waits for the others to be warming up too, before its warm up fails.
+WARM_UP_TIMEOUT = 60
+
+CONTENT_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png'}
+
+#What a worker sends back for a request.
+DONE = 'done'
+ERROR = 'error'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """ Raised by RenderService.submit() when max_queue requests are already waiting.
+    """
+
+
+#Set in every worker by start_worker(), see warm_up().
+warm_up_barrier = None
+
+
+def start_worker(barrier):
+    """ Worker initializer: Ctrl+C reaches the workers too, the server stops them itself.
+    """
+    global warm_up_barrier
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    warm_up_barrier = barrier
+
+
+def warm_up():
+    """ Worker side of the warm up: runs every effect once on a small image, then waits
+        until every worker of the pool is warming up, so no worker takes two of them.
+
+    Raises:
+        BrokenBarrierError: If the other workers didn't start within WARM_UP_TIMEOUT.
+
+    Returns:
+        pid (int): The worker's process id.
+    """
+    pixels = np.zeros((WARM_UP_SIZE, WARM_UP_SIZE, PIXEL_CONTENTS), dtype=np.uint8)
+    pipeline.apply_chain(pixels, pipeline.parse_chain(WARM_UP_CHAIN), Random(0))
+    warm_up_barrier.wait(WARM_UP_TIMEOUT)
+    return os.getpid()
+
+
+def probe_data(data):
+    """ Reads the size and type of an uploaded image from its header, without decoding it.
+
+    Raises:
+        ValueError: If the data is not an image Qt can read.
+
+    Returns:
+        nbytes (int): Bytes of the decoded pixels, 0 if the header doesn't say.
+        kind (str): Type of the file, 'jpg', 'png' or what Qt calls it.
+    """
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    buffer.open(QIODevice.ReadOnly)
+    reader = QImageReader(buffer)
+    if not reader.canRead():
+        raise ValueError("The body is not an image that can be read")
+    size = reader.size()
+    kind = image_writer.file_type('image.' + bytes(reader.format()).decode())
+    if not size.isValid():
+        return 0, kind
+    return size.height() * size.width() * PIXEL_CONTENTS, kind
+
+
+def render_request(data, steps, seed, mode, output_format, options):
+    """ Worker side of a request: decodes the upload, applies the chain and encodes the result.
+
+    Returns:
+        outcome (tuple): (DONE, encoded image, pixel bytes), (ERROR, message) if the image is
+        wrong, or (FAILED, message) if the effects failed.
+    """
+    image = QImage.fromData(data)
+    if image.isNull():
+        return ERROR, "The image can't be decoded"
+    if image.height() < pipeline.MIN_IMAGE_SIZE or image.width() < pipeline.MIN_IMAGE_SIZE:
+        return ERROR, f"Image can't be less than {pipeline.MIN_IMAGE_SIZE} by {pipeline.MIN_IMAGE_SIZE} pixels!"
+    try:
+        gray = pipeline.is_gray(image)
+        image = pipeline.convert_image(image)
+        tiled_engine.apply_chain(effects_engine.qimage_view(image), steps, Random(seed), mode, gray=gray)
+        return DONE, image_writer.encode_image(image, output_format, options), image.sizeInBytes()
+    except Exception as error:
+        return FAILED, f'{type(error).__name__}: {error}'
+
+
+def render_batch(jobs):
+    """ Worker side of a batch: the outcome of render_request() for every job, in order.
+    """
+    return [render_request(*job) for job in jobs]
+
+
+class RenderRequest:
+    """ An image waiting to be rendered, see RenderService.submit().
+
+    Args:
+        data (bytes): The uploaded image file.
+        steps (list): Steps from pipeline.parse_chain.
+        seed (int): Seed of the confetti positions, None for random ones.
+        mode (str): brush_engine.EXACT or brush_engine.FAST for the brush effects.
+        output_format (str): 'jpg' or 'png'.
+        options (SaveOptions): JPEG quality and PNG compression.
+        nbytes (int): Bytes of the decoded pixels, from probe_data().
+    """
+    def __init__(self, data, steps, seed, mode, output_format, options, nbytes):
+        self.job = (data, steps, seed, mode, output_format, options)
+        self.output_format = output_format
+        self.small = nbytes <= SMALL_IMAGE_BYTES
+        self.received = time.perf_counter()
+        self.dispatched = None
+        self.outcome = None
+        self.done = threading.Event()
+
+    def finish(self, outcome):
+        self.outcome = outcome
+        self.done.set()
+
+
+class Histogram:
+    """ Counts values in LATENCY_BUCKETS, the way Prometheus histograms do.
+    """
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value):
+        position = 0
+        while position < len(self.bounds) and value > self.bounds[position]:
+            position += 1
+        self.counts[position] += 1
+        self.total += value
+        self.count += 1
+
+    def snapshot(self):
+        """ Helper to write the histogram as JSON: the count of values up to every bound, and past the last one.
+        """
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(list(self.bounds) + ['+Inf'], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'buckets': buckets, 'sum': self.total, 'count': self.count,
+                'mean': self.total / self.count if self.count else None}
+
+
+class ServiceMetrics:
+    """ Counts the requests of a RenderService, see snapshot().
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statuses = {}
+        self.images = 0
+        self.nbytes = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.latency = Histogram()
+        self.queue_wait = Histogram()
+        self.lock = threading.Lock()
+
+    def responded(self, status, request=None):
+        """ Records the status a request was answered with, and its latency if it was rendered.
+        """
+        with self.lock:
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            if request is not None and request.outcome is not None:
+                self.latency.add(time.perf_counter() - request.received)
+
+    def dispatched(self, batch):
+        with self.lock:
+            self.batches += 1
+            self.batched_requests += len(batch)
+            for request in batch:
+                self.queue_wait.add(request.dispatched - request.received)
+
+    def rendered(self, nbytes):
+        with self.lock:
+            self.images += 1
+            self.nbytes += nbytes
+
+    def snapshot(self):
+        """ Helper to write the metrics as JSON.
+        """
+        with self.lock:
+            elapsed = max(time.perf_counter() - self.started, 1e-9)
+            return {
+                'uptime_seconds': elapsed,
+                'requests': dict(self.statuses),
+                'images': self.images,
+                'megabytes': self.nbytes / MEGABYTE,
+                'images_per_second': self.images / elapsed,
+                'megabytes_per_second': self.nbytes / MEGABYTE / elapsed,
+                'batches': self.batches,
+                'mean_batch_size': self.batched_requests / self.batches if self.batches else None,
+                'latency_seconds': self.latency.snapshot(),
+                'queue_wait_seconds': self.queue_wait.snapshot(),
+            }
+
+
+class RenderService:
+    """ The worker processes and the queue of requests in front of them.
+
+    Args:
+        workers (int): Worker processes, one per CPU if None.
+        max_queue (int): Most requests waiting for a worker.
+        batch_size (int): Most small requests sent to a worker at once.
+    """
+    def __init__(self, workers=None, max_queue=MAX_QUEUE, batch_size=BATCH_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.requests = queue.Queue(max_queue)
+        self.metrics = ServiceMetrics()
+        self.pool = None
+        self.pool_lock = threading.Lock()
+        self.running = threading.BoundedSemaphore(self.workers * IN_FLIGHT_PER_WORKER)
+        self.in_flight = 0
+        self.dispatcher = None
+
+    def start(self):
+        """ Starts the worker processes, waits for every one of them to be warmed up,
+            and starts taking requests from the queue.
+        """
+        self.pool = self.start_pool()
+        self.dispatcher = threading.Thread(target=self.dispatch, name='render dispatcher', daemon=True)
+        self.dispatcher.start()
+
+    def start_pool(self):
+        """ Helper to start the worker processes and warm every one of them up.
+
+        Returns:
+            pool (ProcessPoolExecutor): The warm pool.
+        """
+        context = batch_executor.pool_context()
+        barrier = context.Barrier(self.workers)
+        pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=start_worker,
+                                   initargs=(barrier,))
+        for future in [pool.submit(warm_up) for _ in range(self.workers)]:
+            future.result()
+        return pool
+
+    def replace_pool(self, broken):
+        """ Helper to start a new warm pool in place of one a worker of died, pool_lock must be held.
+            Every batch of the broken pool fails, only the first one replaces it.
+        """
+        if broken is self.pool:
+            broken.shutdown(wait=False)
+            self.pool = self.start_pool()
+
+    def close(self):
+        """ Answers the requests still queued with an error and stops the workers.
+        """
+        self.requests.put(None)
+        if self.dispatcher is not None:
+            self.dispatcher.join()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    def queue_depth(self):
+        return self.requests.qsize()
+
+    def submit(self, request):
+        """ Queues a request, see RenderRequest.done.
+
+        Raises:
+            QueueFull: If max_queue requests are already waiting.
+        """
+        try:
+            self.requests.put_nowait(request)
+        except queue.Full:
+            raise QueueFull() from None
+
+    def dispatch(self):
+        """ Dispatcher thread: sends the requests to the workers as they come,
+            the small ones that are waiting together in a batch.
+        """
+        held = None
+        stopping = False
+        while not stopping:
+            request = held if held is not None else self.requests.get()
+            held = None
+            if request is None:
+                break
+            batch = [request]
+            while request.small and len(batch) < self.batch_size:
+                try:
+                    waiting = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if waiting is None:
+                    #close() was called, this batch is the last one sent
+                    stopping = True
+                    break
+                if not waiting.small:
+                    #goes on its own, after this batch
+                    held = waiting
+                    break
+                batch.append(waiting)
+            self.running.acquire()
+            self.send(batch)
+
+        #answered, the server is going down
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request.finish((FAILED, 'The server is shutting down'))
+
+    def send(self, batch):
+        """ Helper to send a batch to the workers, a slot of running is held until it is done.
+        """
+        now = time.perf_counter()
+        for request in batch:
+            request.dispatched = now
+        self.metrics.dispatched(batch)
+        jobs = [request.job for request in batch]
+        with self.pool_lock:
+            self.in_flight += len(batch)
+            try:
+                future = self.pool.submit(render_batch, jobs)
+            except BrokenProcessPool:
+                #a worker died between two batches
+                self.replace_pool(self.pool)
+                future = self.pool.submit(render_batch, jobs)
+            pool = self.pool
+        future.add_done_callback(lambda future: self.finish(batch, future, pool))
+
+    def finish(self, batch, future, pool):
+        """ Helper to hand the outcomes of a batch to its requests, pool is the one it was sent to.
+        """
+        try:
+            outcomes = future.result()
+        except BrokenProcessPool:
+            #a worker died, the pool is started and warmed up again for the next batches
+            outcomes = [(FAILED, 'worker process died')] * len(batch)
+            with self.pool_lock:
+                self.replace_pool(pool)
+        except CancelledError:
+            outcomes = [(FAILED, 'The server is shutting down')] * len(batch)
+        except Exception as error:
+            outcomes = [(FAILED, f'{type(error).__name__}: {error}')] * len(batch)
+        with self.pool_lock:
+            self.in_flight -= len(batch)
+        for request, outcome in zip(batch, outcomes):
+            if outcome[0] == DONE:
+                self.metrics.rendered(outcome[2])
+            request.finish(outcome)
+        self.running.release()
+
+    def metrics_snapshot(self):
+        """ The metrics with the queue as it is now.
+        """
+        metrics = self.metrics.snapshot()
+        with self.pool_lock:
+            in_flight = self.in_flight
+        metrics.update({'workers': self.workers, 'queue_depth': self.queue_depth(),
+                        'queue_limit': self.max_queue, 'in_flight': in_flight})
+        return metrics
+
+
+def parse_request(query, kind):
+    """ Helper to read the settings of a render request from its query string.
+
+    Args:
+        query (str): The query string of the URL.
+        kind (str): Type of the uploaded file, the output type if format= isn't given.
+
+    Raises:
+        ValueError: If a setting is missing or wrong.
+
+    Returns:
+        settings (tuple): (steps, seed, mode, output format, SaveOptions).
+    """
+    fields = {name: values[-1] for name, values in parse_qs(query).items()}
+    if not fields.get('effects'):
+        raise ValueError("effects= is missing, e.g. /render?effects=neon,melt:20")
+    steps = pipeline.parse_chain(fields['effects'])
+    output_format = fields.get('format', kind if kind in pipeline.OUTPUT_FORMATS else 'png').lower()
+    output_format = image_writer.file_type('image.' + output_format)
+    if output_format not in pipeline.OUTPUT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(pipeline.OUTPUT_FORMATS)}")
+    try:
+        seed = int(fields['seed']) if 'seed' in fields else None
+        quality = int(fields.get('quality', image_writer.DEFAULT))
+        compression = int(fields.get('png_compression', image_writer.DEFAULT))
+    except ValueError:
+        raise ValueError("seed, quality and png_compression must be whole numbers") from None
+    if not (quality == image_writer.DEFAULT or 0 <= quality <= 100):
+        raise ValueError("quality must be between 0 and 100")
+    if not (compression == image_writer.DEFAULT or 0 <= compression <= image_writer.MAX_PNG_COMPRESSION):
+        raise ValueError(f"png_compression must be between 0 and {image_writer.MAX_PNG_COMPRESSION}")
+    mode = brush_engine.FAST if fields.get('fast', '0') not in ('', '0', 'false') else brush_engine.EXACT
+    return steps, seed, mode, output_format, image_writer.SaveOptions(quality, compression)
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """ Answers the requests of a RenderServer, see the top of the module.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if urlsplit(self.path).path == '/metrics':
+            self.send_json(200, self.server.service.metrics_snapshot())
+        else:
+            self.send_json(404, {'error': f"No such page '{self.path}', use POST /render or GET /metrics"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/render':
+            self.send_json(404, {'error': f"No such page '{url.path}', use POST /render"})
+            return
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.send_json(411, {'error': 'Content-Length is needed'})
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            #the end of the body can't be found, so neither can the next request
+            self.close_connection = True
+            self.send_json(400, {'error': 'Content-Length must be a whole number of bytes'})
+            return
+        if length > MAX_UPLOAD_BYTES:
+            #the body is left unread, it mustn't be taken for the next request
+            self.close_connection = True
+            self.send_json(413, {'error': f'Uploads are limited to {MAX_UPLOAD_BYTES // MEGABYTE} MB'})
+            return
+        data = self.rfile.read(length)
+
+        try:
+            nbytes, kind = probe_data(data)
+            steps, seed, mode, output_format, options = parse_request(url.query, kind)
+        except ValueError as error:
+            self.send_json(400, {'error': str(error)})
+            return
+        if nbytes >= raw_canvas.CANVAS_BYTES:
+            self.send_json(413, {'error': f'Images are limited to {raw_canvas.CANVAS_BYTES // MEGABYTE} MB of pixels'})
+            return
+
+        service = self.server.service
+        request = RenderRequest(data, steps, seed, mode, output_format, options, nbytes)
+        try:
+            service.submit(request)
+        except QueueFull:
+            self.send_json(429, {'error': 'Too many requests waiting, try again later'},
+                           {'Retry-After': str(RETRY_AFTER)})
+            return
+        if not request.done.wait(REQUEST_TIMEOUT):
+            self.send_json(504, {'error': 'The image took too long'})
+            return
+
+        status, value = request.outcome[:2]
+        if status == DONE:
+            self.send_body(200, value, CONTENT_TYPES[output_format], request=request)
+        else:
+            self.send_json(400 if status == ERROR else 500, {'error': value}, request=request)
+
+    def send_json(self, status, content, headers=None, request=None):
+        self.send_body(status, json.dumps(content).encode(), 'application/json', headers, request)
+
+    def send_body(self, status, body, content_type, headers=None, request=None):
+        """ Helper to answer with a body, and count the answer in the metrics.
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.service.metrics.responded(status, request)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(RenderHandler, self).log_message(format, *args)
+
+
+class RenderServer(ThreadingHTTPServer):
+    """ HTTP server answering every request on a thread of its own, in front of a RenderService.
+
+    Args:
+        address (tuple): (host, port), port 0 picks a free one.
+        service (RenderService): Started, see RenderService.start().
+        verbose (bool): Logs every request to stderr.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        super(RenderServer, self).__init__(address, RenderHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+def build_parser():
+    """ Helper to build the command line arguments of the serve command.
+    """
+    parser = argparse.ArgumentParser(prog='python -m abstract_image_editor serve',
+                                     description='Serve the effects over HTTP, POST /render and GET /metrics.')
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'address to listen on (default: {DEFAULT_HOST})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('-j', '--workers', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE,
+                        help=f'requests waiting before new ones get a 429 (default: {MAX_QUEUE})')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f'most small images sent to a worker at once (default: {BATCH_SIZE})')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every request')
+    return parser
+
+
+def main(argv=None):
+    """ Serve command entry point, runs until interrupted.
+
+    Args:
+        argv (list): Command line arguments after "serve", sys.argv if None.
+
+    Returns:
+        status (int): 0 once interrupted, 1 if the port can't be used, 2 for bad arguments.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.max_queue < 1 or args.batch_size < 1:
+        parser.error('--max-queue and --batch-size must be at least 1')
+
+    service = RenderService(args.workers, args.max_queue, args.batch_size)
+    try:
+        server = RenderServer((args.host, args.port), service, args.verbose)
+    except OSError as error:
+        print(f"Can't listen on {args.host}:{args.port}: {error}", file=sys.stderr)
+        return 1
+    service.start()
+    host, port = server.server_address[:2]
+    print(f'Serving on http://{host}:{port} with {service.workers} workers, Ctrl+C to stop.', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
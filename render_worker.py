@@ -0,0 +1,287 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Runs the effects of the window on a background thread, so the window never blocks.
+
+    There is a single render at a time. It works on its own buffers, never on the
+    pixels on screen, and copies its result onto the WorkingCanvas when it is done,
+    or every PUBLISH_INTERVAL while it keeps getting new steps.
+    A request made while a render is running supersedes it: the running render takes
+    the new steps on at its next step boundary instead of a new render being queued
+    behind it, and publishes once at the end. Effects stack, so no request is dropped.
+
+    Cancelling stops the render at the next band, drops the step being worked on and
+    every step not started, and keeps the steps already done.
+    Every publication is a single edit in the canvas' undo history, tagged with the
+    effect chain of the last step done.
+    Steps that report the rectangles they change, e.g. Confetti, only have those
+    copied between the buffers and compared with the canvas.
+"""
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from functools import partial
+import threading
+import time
+import lazy_modules
+import profiler
+#NumPy and the engines wait for the first render
+np = lazy_modules.lazy_import('numpy')
+effect_graph = lazy_modules.lazy_import('effect_graph')
+pipeline = lazy_modules.lazy_import('pipeline')
+tiled_engine = lazy_modules.lazy_import('tiled_engine')
+
+MEGABYTE = 1024 * 1024
+
+#Bands of about this size when rendering for the window, so a render stops quickly when cancelled.
+RENDER_TILE_BYTES = 2 * MEGABYTE
+#Seconds between two publications of a render that keeps getting new steps.
+PUBLISH_INTERVAL = 0.1
+
+
+class RenderCancelled(Exception):
+    """ Raised inside a render to stop it at the next band.
+    """
+
+
+def render_step(step, mode, rand, pixels, executor, tile_rows, check, rects):
+    """ Helper to render a step submitted with RenderWorker.submit().
+    """
+    with profiler.span('kernel', pipeline.format_chain([step]), pixels.nbytes):
+        tiled_engine.apply_chain(pixels, [step], rand, mode, executor, tile_rows, check, rects=rects)
+
+
+def render_graph(graph, steps, pixels, executor, tile_rows, check, rects):
+    """ Helper to render a chain submitted with RenderWorker.submit_chain().
+    """
+    #the chain is rendered over the original, anything can change
+    rects.append(None)
+    def apply(out, step):
+        with profiler.span('kernel', effect_graph.format_step(step), out.nbytes):
+            tiled_engine.apply_chain(out, [(step.name, step.setting)], effect_graph.step_rand(step),
+                                     step.mode, executor, tile_rows, check)
+
+    graph.render(pixels, steps, apply)
+
+
+def copy_rects(out, pixels, rects):
+    """ Helper to copy rectangles of an image onto another, the whole image if rects is None.
+    """
+    if rects is None:
+        np.copyto(out, pixels)
+        return
+    for top, bottom, left, right in rects:
+        top, left = max(0, top), max(0, left)
+        out[top:bottom, left:right] = pixels[top:bottom, left:right]
+
+
+class RenderJob(QRunnable):
+    """ The render running on the thread pool, takes its steps from its RenderWorker.
+    """
+    def __init__(self, worker, canvas, executor):
+        super(RenderJob, self).__init__()
+        self.setAutoDelete(False)
+        self.worker = worker
+        self.canvas = canvas
+        self.executor = executor
+        self.cancelled = threading.Event()
+        self.keep_done = True
+
+    def run(self):
+        canvas = self.canvas
+        height, width = canvas.pixels.shape[:2]
+        tile_rows = tiled_engine.tile_rows_for(width, RENDER_TILE_BYTES)
+        buffers = canvas.scratch()
+        #the canvas is only read until the render publishes
+        front = canvas.pixels
+        #where the buffer that isn't front differs from it, None if it can be anywhere
+        stale = None
+        #rectangles changed since the last publication
+        changed = []
+        published = time.perf_counter()
+        error = None
+        #chain of the last step done
+        tag = None
+
+        while True:
+            taken = self.worker.take_step(self)
+            if taken is None:
+                break
+            (work, step_tag), number, count = taken
+            if front is canvas.pixels:
+                back = canvas.scratch_copy()
+            else:
+                back = buffers[0] if front is not buffers[0] else buffers[1]
+                copy_rects(back, front, stale)
+            rects = []
+
+            def check(done, total):
+                if self.cancelled.is_set():
+                    raise RenderCancelled()
+                self.worker.progress.emit(int(100 * (number + done / total) / count))
+
+            try:
+                work(back, self.executor, tile_rows, check, rects)
+            except RenderCancelled:
+                break
+            except Exception as error_raised:
+                error = f'{type(error_raised).__name__}: {error_raised}'
+                self.worker.cancel()
+                break
+            #back started as a copy of front, so now they only differ where the step changed
+            stale = None if front is canvas.pixels or None in rects else rects
+            front = back
+            changed.extend(rects)
+            if step_tag is not None:
+                tag = step_tag
+
+            if not self.worker.has_steps() or time.perf_counter() - published > PUBLISH_INTERVAL:
+                self.publish(front, tag, changed)
+                front = canvas.pixels
+                changed = []
+                published = time.perf_counter()
+
+        if front is not canvas.pixels and self.keep_done:
+            self.publish(front, tag, changed)
+        self.worker.job_stopped(self, error)
+
+    def publish(self, pixels, tag, rects):
+        """ Helper to commit a result to the canvas and tell the window.
+        """
+        self.canvas.commit(pixels, tag, None if None in rects else rects)
+        self.worker.published.emit()
+
+
+class RenderWorker(QObject):
+    """ Takes effect requests from the window and renders them in the background.
+
+    Signals:
+        published: The canvas has new pixels to show.
+        progress (int): Percent done of the steps the render knows of.
+        idle: The render stopped, there is nothing left to do.
+        failed (str): A step raised, the steps after it were dropped.
+    """
+    published = pyqtSignal()
+    progress = pyqtSignal(int)
+    idle = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super(RenderWorker, self).__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.lock = threading.Lock()
+        self.job = None
+        self.steps = []
+        #steps the running render has taken, for the progress
+        self.taken = 0
+
+    def busy(self):
+        """ Tells if a render is running or about to.
+        """
+        with self.lock:
+            return self.job is not None
+
+    def submit(self, steps, mode, rand, canvas, executor=None, tag=None):
+        """ Renders steps on top of every step submitted before.
+
+        Args:
+            steps (list): (name, setting) tuples, see pipeline.parse_chain.
+            mode (str): brush_engine.EXACT or brush_engine.FAST for the brush effects.
+            rand (Random): Source of the confetti positions.
+            canvas (WorkingCanvas): The canvas the result is published to.
+            executor (BatchExecutor): Worker processes for the bands of large images, if any.
+            tag (tuple): Effect chain of the image once the steps are done, see effect_graph.
+        """
+        work = [(partial(render_step, step, mode, rand), None) for step in steps]
+        if work:
+            work[-1] = (work[-1][0], tag)
+        self.queue(work, canvas, executor)
+
+    def submit_chain(self, graph, steps, canvas, executor=None):
+        """ Replaces the image with a chain of effects rendered over the original,
+            after every step submitted before.
+
+        Args:
+            graph (EffectGraph): The graph of the canvas.
+            steps (tuple): The chain, a snapshot of the graph.
+            canvas (WorkingCanvas): The canvas the result is published to.
+            executor (BatchExecutor): Worker processes for the bands of large images, if any.
+        """
+        self.queue([(partial(render_graph, graph, steps), steps)], canvas, executor)
+
+    def queue(self, work, canvas, executor):
+        """ Helper to add (function, tag) tuples to the steps and start a render if none runs.
+        """
+        with self.lock:
+            self.steps.extend(work)
+            if self.job is not None:
+                #the running render takes them on at its next step
+                return
+            self.job = RenderJob(self, canvas, executor)
+            self.taken = 0
+        self.pool.start(self.job)
+
+    def take_step(self, job):
+        """ Render side: the next step to work on, with its number and the steps known so far,
+            or None once there is nothing left or the render was cancelled.
+            A render that gets None is done, the next submit starts a new one.
+        """
+        with self.lock:
+            if job.cancelled.is_set() or not self.steps:
+                return None
+            number = self.taken
+            self.taken += 1
+            return self.steps.pop(0), number, number + 1 + len(self.steps)
+
+    def has_steps(self):
+        with self.lock:
+            return bool(self.steps)
+
+    def job_stopped(self, job, error):
+        """ Render side: the render is over, start another if steps came in since its last take_step.
+        """
+        restart = None
+        with self.lock:
+            if self.job is job:
+                self.job = None
+            #cancel() drops the steps it finds, so these came after it
+            if self.job is None and self.steps:
+                #taken in the same lock, so a queue() from the window can't start a render of its own
+                restart = self.job = RenderJob(self, job.canvas, job.executor)
+                self.taken = 0
+            busy = self.job is not None
+        if error is not None:
+            self.failed.emit(error)
+        if restart is not None:
+            self.pool.start(restart)
+        elif not busy:
+            self.idle.emit()
+
+    def cancel(self, keep_done=True):
+        """ Stops the render at its next band and drops the steps not done yet.
+
+        Args:
+            keep_done (bool): Publish the steps already done, or throw them away too.
+        """
+        with self.lock:
+            self.steps = []
+            if self.job is not None:
+                self.job.keep_done = keep_done
+                self.job.cancelled.set()
+
+    def wait(self):
+        """ Blocks until the render is over, e.g. before saving or closing the image.
+        """
+        self.pool.waitForDone()
@@ -0,0 +1,244 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" The Melt and Confetti slider effects.
+
+    Both work in place on a (height, width, 4) uint8 array holding the BGRA bytes
+    of the image, and don't depend on the window, so they can run headless.
+    Both can add the (top, bottom, left, right) rectangles they change to a list,
+    so the rest of the image doesn't have to be compared to find them.
+"""
+import math
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+PIXEL_CONTENTS = 4
+
+#Keeps the proportions of the confetti shape similar, independent of image dimensions.
+CONFETTI_PROPORTION = 14899
+#BGRA bytes read as a little endian number, so alpha is the high byte on any machine.
+PIXEL_WORD = np.dtype('<u4')
+COLOR_BITS = np.uint32(0x00FFFFFF)
+ALPHA_BITS = np.uint32(0xFF000000)
+#From this side on, squares are painted a pixel at a time instead of a byte at a time.
+WORD_PAINT_SIDE = 20
+
+
+def melt_rects(height, width, rows_to_melt):
+    """ Helper to get the rectangles melt() changes: every row, since the first anchor
+        of a melt up wraps around to the last pixel, or none if it leaves the image as it is.
+    """
+    if rows_to_melt <= 0 or rows_to_melt >= height:
+        return []
+    return [(0, height, 0, width)]
+
+
+def melt(pixels, rows_to_melt, direction, rects=None):
+    """ The pixels of the image form squares and either blend towards
+        the top or the bottom depending on the direction,
+        creating the effect of a melting image.
+
+        Every rows_to_melt + 1 rows, a row of anchor pixels is copied over the
+        rows_to_melt rows above it (below it when melting down), a whole block of rows
+        at a time, see melt_window(). A melt of 0 rows, or of as many rows as the image
+        has or more, leaves the image as it is: no anchor is that far inside the image.
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 array, changed in place.
+        rows_to_melt (int): How many rows every melted row is copied over.
+        direction (int): Positive to melt towards the top, otherwise towards the bottom.
+        rects (list): Gets the rectangles changed, see melt_rects().
+
+    Returns:
+        pixels (ndarray): The same array.
+    """
+    height = pixels.shape[0]
+    if rects is not None:
+        rects.extend(melt_rects(height, pixels.shape[1], rows_to_melt))
+    if rows_to_melt <= 0 or rows_to_melt >= height:
+        return pixels
+    first_anchor = melt_first_anchor(pixels, rows_to_melt) if direction > 0 else None
+    return melt_window(pixels, 0, height, rows_to_melt, direction, first_anchor)
+
+
+def confetti_side(height, width):
+    """ Helper to get the length of the side of a confetti square for an image size.
+    """
+    total_pixels = height * width
+    side = int(math.sqrt(total_pixels / CONFETTI_PROPORTION))
+    #ensure a minimum length for the side of a confetti shape
+    return max(side, 1)
+
+
+def confetti_centers(height, width, side, confetti_quantity, rand):
+    """ Draws the centers of the confetti squares, all at once.
+        A center is at least side pixels away from every edge, so its square,
+        which ends right above and left of it, never leaves the image.
+
+    Args:
+        height (int): Height of the image.
+        width (int): Width of the image.
+        side (int): Side of a confetti square.
+        confetti_quantity (int): How many centers are drawn.
+        rand (Random): Source of the random positions, the same state gives the same centers.
+
+    Returns:
+        rows (ndarray): Row of every center, empty if the image has no room for a square.
+        columns (ndarray): Column of every center.
+    """
+    if confetti_quantity <= 0 or height - side <= side or width - side <= side:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    generator = np.random.default_rng(rand.getrandbits(64))
+    rows = generator.integers(side, height - side, confetti_quantity)
+    columns = generator.integers(side, width - side, confetti_quantity)
+    return rows, columns
+
+
+def confetti(pixels, confetti_quantity, rand, rects=None):
+    """ Blends random areas of the image creating a confetti effect.
+        Only the confetti squares are touched, so the image can be as big as needed,
+        e.g. a memory mapped one.
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 array, changed in place.
+        confetti_quantity (int): How many confetti squares are painted.
+        rand (Random): Source of the random confetti positions.
+        rects (list): Gets the square of every confetti.
+
+    Returns:
+        pixels (ndarray): The same array.
+    """
+    height, width = pixels.shape[:2]
+    side = confetti_side(height, width)
+    rows, columns = confetti_centers(height, width, side, confetti_quantity, rand)
+    if rects is not None:
+        rects.extend((row - side, row, column - side, column)
+                     for row, column in zip(rows.tolist(), columns.tolist()))
+
+    if side < WORD_PAINT_SIDE:
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            #squares are painted in order, a center under an earlier square takes its color
+            pixels[row - side:row, column - side:column, :3] = pixels[row, column, :3]
+        return pixels
+
+    #a pixel as one number, the color is the low 3 bytes and the alpha the high one
+    words = pixels.view(PIXEL_WORD)[..., 0]
+    for row, column in zip(rows.tolist(), columns.tolist()):
+        color = words[row, column] & COLOR_BITS
+        square = words[row - side:row, column - side:column]
+        np.bitwise_and(square, ALPHA_BITS, out=square)
+        np.bitwise_or(square, color, out=square)
+
+    return pixels
+
+
+def copy_anchors(flat, run_start, block_start, rows, width):
+    """ Copies a run of anchor pixels over a block of rows, the part of both inside flat.
+
+    Args:
+        flat (ndarray): (pixels, 4) uint8 array, the rows being melted.
+        run_start (int): Position of the first anchor in flat, can be outside it.
+        block_start (int): Position the first row of the block starts at in flat.
+        rows (int): Rows of the block, every one width pixels, a row apart.
+        width (int): Width of the image, the number of anchors in the run.
+    """
+    count = len(flat)
+    first = max(0, -run_start)
+    last = min(width, count - run_start)
+    if first >= last:
+        return
+    anchors = flat[run_start + first:run_start + last]
+    #rows of the block that get every anchor inside flat
+    top = max(0, -((block_start + first) // width))
+    bottom = min(rows, (count - block_start - last) // width + 1)
+    if top < bottom:
+        start = block_start + top * width
+        if first == 0 and last == width:
+            flat[start:start + (bottom - top) * width].reshape(bottom - top, width, PIXEL_CONTENTS)[:] = anchors
+        else:
+            block = as_strided(flat[start + first:], (bottom - top, last - first, PIXEL_CONTENTS),
+                               (width * flat.strides[0],) + flat.strides)
+            block[:] = anchors
+    #the rows cut by the start or end of flat
+    for row in sorted({top - 1, bottom} - {-1, rows}):
+        start = block_start + row * width
+        row_first = max(first, -start)
+        row_last = min(last, count - start)
+        if row_first < row_last:
+            flat[start + row_first:start + row_last] = anchors[row_first - first:row_last - first]
+
+
+def melt_window(pixels, first_row, height, rows_to_melt, direction, first_anchor=None):
+    """ Applies melt() to a band of rows of a larger image, or to the whole image.
+        Gives the same bytes as melting the whole image for every row of the band
+        with at least rows_to_melt rows of the image below it (above it when melting down)
+        inside the band, the other rows are left to the bands that have their anchors.
+
+        An anchor run is width pixels back to back in the buffer, the runs are
+        (rows_to_melt + 1) * width - 1 pixels apart, so every run starts a pixel before
+        the row the previous one would. Melting up, the runs start at the last pixel of row
+        rows_to_melt - 1 and every run is copied over the rows_to_melt * width pixels before
+        it. Melting down, the runs end at the pixel before the last rows_to_melt rows and
+        are copied over the pixels after them. The runs are copied in that order, each run
+        read before the next block writes over its end pixel, and a run that goes past
+        the image only copies the anchors inside it.
+
+    Args:
+        pixels (ndarray): (rows, width, 4) uint8 band, changed in place.
+        first_row (int): Row of the whole image the band starts on.
+        height (int): Height of the whole image, more than rows_to_melt.
+        rows_to_melt (int): As in melt(), more than 0.
+        direction (int): As in melt().
+        first_anchor (ndarray): The 4 bytes of the first anchor of the whole image,
+        only needed when melting up, see melt_first_anchor().
+
+    Returns:
+        pixels (ndarray): The same array.
+    """
+    width = pixels.shape[1]
+    total = height * width
+    first_pixel = first_row * width
+    flat = pixels.reshape(-1, PIXEL_CONTENTS)
+    count = len(flat)
+    period = (rows_to_melt + 1) * width - 1
+    span = rows_to_melt * width
+
+    if direction > 0:
+        #the first anchor's top copy is a pixel before the buffer, so it wraps around
+        #to the last pixel, before that pixel is read as an anchor
+        last = total - 1 - first_pixel
+        if 0 <= last < count:
+            flat[last] = first_anchor
+        run = span - 1
+        #skip the runs that end before the band
+        run += period * max(0, -((run + width - 1 - first_pixel) // period))
+        while run < min(first_pixel + count, total):
+            copy_anchors(flat, run - first_pixel, run - span - first_pixel, rows_to_melt, width)
+            run += period
+    else:
+        run = total - span - width
+        #skip the runs that start after the band
+        run -= period * max(0, -((first_pixel + count - 1 - run) // period))
+        while run + width > first_pixel:
+            copy_anchors(flat, run - first_pixel, run + width - first_pixel, rows_to_melt, width)
+            run -= period
+    return pixels
+
+
+def melt_first_anchor(pixels, rows_to_melt):
+    """ Helper to get the bytes melting up copies onto the last pixel, see melt_window().
+    """
+    return pixels.reshape(-1, PIXEL_CONTENTS)[rows_to_melt * pixels.shape[1] - 1].copy()
@@ -0,0 +1,125 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Coalesces the moves of the effect sliders, so dragging one doesn't queue up a render per move.
+
+    The values a slider sends are held for FRAME_INTERVAL, and for as long as a render
+    is running, then handed to the slider's handler:
+        LATEST   only the last value is handed over, the ones before it are dropped.
+                 Handlers that measure the move from the last value they got, like
+                 get_slider_direction(), see the whole move at once.
+        ALL      every value is handed over in order, for effects whose moves add up
+                 to the same image however they are grouped, like Confetti.
+"""
+from PyQt5.QtCore import QObject, QTimer
+
+#Milliseconds slider moves are held for, about one frame.
+FRAME_INTERVAL = 16
+
+LATEST = 'latest'
+ALL = 'all'
+
+
+class SliderCounts:
+    """ Counts the moves of a slider since it was last pressed.
+    """
+    def __init__(self):
+        self.moves = 0
+        self.rendered = 0
+        self.dropped = 0
+
+    def summary(self):
+        return f'{self.moves} moves, {self.rendered} rendered, {self.dropped} dropped'
+
+
+class SliderScheduler(QObject):
+    """ Holds slider moves and hands them to their handlers once per frame, when no render runs.
+
+    Args:
+        busy (function): Tells if a render is running, moves are held until it isn't.
+        parent (QObject): Owner of the scheduler.
+    """
+    def __init__(self, busy, parent=None):
+        super(SliderScheduler, self).__init__(parent)
+        self.busy = busy
+        self.sliders = {}
+        self.counts = {}
+        #values waiting, by slider, in the order the sliders first moved
+        self.pending = {}
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(FRAME_INTERVAL)
+        self.timer.timeout.connect(self.flush)
+
+    def add_slider(self, key, slider, handler, mode=LATEST):
+        """ Sends the moves of a slider through the scheduler.
+
+        Args:
+            key (str): Name of the slider, e.g. 'melt'.
+            slider (QSlider): The slider.
+            handler (function): Called with a value of the slider.
+            mode (str): LATEST or ALL.
+        """
+        self.sliders[key] = (handler, mode)
+        self.counts[key] = SliderCounts()
+        slider.valueChanged.connect(lambda value: self.push(key, value))
+        slider.sliderPressed.connect(lambda: self.counts.__setitem__(key, SliderCounts()))
+
+    def push(self, key, value):
+        """ Holds a new value of a slider until the next flush.
+        """
+        self.counts[key].moves += 1
+        self.pending.setdefault(key, []).append(value)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        """ Hands the values held to their handlers, unless a render is running.
+            Called by the frame timer, and should be called when the render is over.
+        """
+        if not self.pending or self.busy():
+            return
+        self.timer.stop()
+        pending = self.pending
+        self.pending = {}
+        for key, values in pending.items():
+            handler, mode = self.sliders[key]
+            counts = self.counts[key]
+            if mode == LATEST:
+                counts.dropped += len(values) - 1
+                values = values[-1:]
+            counts.rendered += len(values)
+            for value in values:
+                handler(value)
+
+    def drop(self):
+        """ Forgets the values held, e.g. when the sliders are put back before a reset.
+
+        Returns:
+            latest (dict): The last value held for every slider that had any.
+        """
+        self.timer.stop()
+        latest = {}
+        for key, values in self.pending.items():
+            self.counts[key].dropped += len(values)
+            latest[key] = values[-1]
+        self.pending = {}
+        return latest
+
+    def summary(self, key):
+        """ Helper to describe the moves of a slider since it was last pressed.
+        """
+        return self.counts[key].summary()
@@ -0,0 +1,27 @@
+""" Checks the engines against the original per byte loops, see golden_harness.
+"""
+import pytest
+import golden_harness
+import pipeline
+
+CORPUS = golden_harness.build_corpus()
+STEPS = pipeline.parse_chain(golden_harness.GOLDEN_STEPS)
+
+
+@pytest.mark.parametrize('step', STEPS, ids=[pipeline.format_chain([step]) for step in STEPS])
+def test_engines_match_reference(step):
+    results = golden_harness.check(['exact', 'tiled', 'fast'], [step], CORPUS)
+    failed = [(result['backend'], result['image'], result['differing'], result['max_error'])
+              for result in results if not result['passed']]
+    assert not failed
+
+
+def test_changed_byte_fails():
+    image, pixels = CORPUS[0]
+    step = ('neon', None)
+    seed = golden_harness.step_seed(image, step)
+    reference = golden_harness.render_reference(pixels, step, seed)
+    reference[1, 1, 0] ^= 1
+    result = golden_harness.compare_case('exact', image, pixels, step, seed, reference)
+    assert not result['passed']
+    assert (result['differing'], result['max_error']) == (1, 1)
@@ -0,0 +1,119 @@
+""" Checks the render service over HTTP on localhost, see render_server.
+"""
+import http.client
+import json
+import socket
+import sys
+import threading
+import pytest
+from PyQt5.QtGui import QImage
+import image_writer
+import render_server
+
+
+def png_image(width=32, height=24):
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(0xff336699)
+    return image_writer.encode_image(image, 'png')
+
+
+def serve(service):
+    """ Helper to start a RenderServer on a free port, on a thread of its own.
+    """
+    server = render_server.RenderServer(('127.0.0.1', 0), service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def request(server, method, path, body=None):
+    """ Helper to make a request, returns the status, headers and body of the answer.
+    """
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=60)
+    try:
+        connection.request(method, path, body)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+@pytest.fixture(scope='module')
+def server():
+    service = render_server.RenderService(1)
+    service.start()
+    server = serve(service)
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.close()
+
+
+def test_render(server):
+    status, headers, body = request(server, 'POST', '/render?effects=neon,melt:2&seed=1', png_image())
+    assert status == 200
+    assert headers['Content-Type'] == 'image/png'
+    image = QImage.fromData(body)
+    assert (image.width(), image.height()) == (32, 24)
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/render?effects=nope', png_image()),
+    ('/render', png_image()),
+    ('/render?effects=neon', b'not an image'),
+])
+def test_bad_request(server, path, body):
+    status, headers, body = request(server, 'POST', path, body)
+    assert status == 400
+    assert json.loads(body)['error']
+
+
+def test_upload_too_big(server):
+    with socket.create_connection(server.server_address[:2], timeout=60) as connection:
+        connection.sendall(b'POST /render?effects=neon HTTP/1.1\r\nHost: localhost\r\n'
+                           b'Content-Length: %d\r\n\r\n' % (render_server.MAX_UPLOAD_BYTES + 1))
+        answer = b''
+        while True:
+            data = connection.recv(4096)
+            if not data:
+                break
+            answer += data
+    #the connection is closed after the one answer
+    assert answer.startswith(b'HTTP/1.1 413')
+    assert answer.count(b'HTTP/1.1') == 1
+
+
+def test_queue_full():
+    #not started, so the request put in the queue stays there
+    service = render_server.RenderService(1, max_queue=1)
+    server = serve(service)
+    try:
+        service.submit(render_server.RenderRequest(None, [], None, None, 'png', None, 0))
+        status, headers, body = request(server, 'POST', '/render?effects=neon', png_image())
+        assert status == 429
+        assert headers['Retry-After'] == str(render_server.RETRY_AFTER)
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.requests.get_nowait()
+        service.close()
+
+
+def test_metrics(server):
+    request(server, 'POST', '/render?effects=neon', png_image())
+    status, headers, body = request(server, 'GET', '/metrics')
+    assert status == 200
+    metrics = json.loads(body)
+    assert metrics['workers'] == 1
+    assert metrics['requests']['200'] >= 1
+    assert metrics['images'] >= 1
+    for field in ('queue_depth', 'queue_limit', 'in_flight', 'batches', 'mean_batch_size',
+                  'images_per_second', 'megabytes_per_second'):
+        assert field in metrics
+    for histogram in ('latency_seconds', 'queue_wait_seconds'):
+        assert metrics[histogram]['count'] >= 1
+        assert '+Inf' in metrics[histogram]['buckets']
+
+
+if __name__ == '__main__':
+    #the worker processes are started by a fork server, which imports this module again
+    sys.exit(pytest.main([__file__]))
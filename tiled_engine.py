@@ -0,0 +1,359 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Runs effect chains on big images one band of rows at a time.
+
+    The original loops walk the image as one long buffer, so a band is always made
+    of whole rows, and the bands are overlapped by the rows every effect can reach
+    above and below a pixel. The chain is split in stages:
+        LOCAL        bands are worked on independently, on a copy of the band and its
+                     overlap, in a pool of processes when an executor is given.
+                     Pattern and Melt get the few bytes they need from the rest of the image.
+        SEQUENTIAL   the exact brush effects, where every pixel sees the pixels before it,
+                     run band after band in place.
+        CANVAS       Confetti only touches its squares, it runs on the whole image in place.
+        WHOLE        anything that can reach past the overlap runs on the whole image.
+    The result is byte for byte the same as running the chain on the whole image,
+    and the memory used on top of the image grows with the band size times the workers.
+"""
+from multiprocessing import shared_memory
+from random import Random
+import numpy as np
+import pipeline
+import effects_engine
+import brush_engine
+import slider_engine
+
+PIXEL_CONTENTS = 4
+MEGABYTE = 1024 * 1024
+
+#Size of a band, big enough that the overlap is a small part of it.
+TILE_BYTES = 16 * MEGABYTE
+MIN_TILE_ROWS = 16
+
+#What a band worker sends back, as BatchExecutor expects it.
+DONE = 'done'
+
+LOCAL = 'local'
+SEQUENTIAL = 'sequential'
+CANVAS = 'canvas'
+WHOLE = 'whole'
+
+#Rows above and below a pixel that the color effects read or write.
+#They walk the buffer a few bytes at a time, so they can reach into the next
+#or previous row, and the first and last pixel of the image are special.
+COLOR_OVERLAPS = {
+    'zeus': (0, 0),
+    'mint': (0, 0),
+    'brighter': (0, 0),
+    'sketch': (0, 1),
+    'neon': (0, 1),
+    'wild_west': (1, 1),
+    'pattern': (1, 1),
+}
+#Steps that need bytes from the other end of the image, see step_context().
+CONTEXT_EFFECTS = ('pattern', 'melt')
+
+
+def step_plan(step, height, width, mode):
+    """ Finds how a step runs on bands.
+
+    Args:
+        step (tuple): (name, setting) from pipeline.parse_chain.
+        height (int): Height of the whole image.
+        width (int): Width of the whole image.
+        mode (str): brush_engine.EXACT or brush_engine.FAST.
+
+    Returns:
+        plan (tuple): (kind, rows above, rows below) the step needs around a band.
+    """
+    name, setting = step
+    if name in COLOR_OVERLAPS:
+        return (LOCAL,) + COLOR_OVERLAPS[name]
+
+    if name in pipeline.BRUSH_PATTERNS or name == 'wash':
+        pattern = pipeline.BRUSH_PATTERNS.get(name, setting)
+        pattern = 'diagonal' if pattern == 'diagonal' else 'cross'
+        reach = brush_engine.row_reach(name, pattern, width)
+        if mode == brush_engine.FAST and name in brush_engine.FAST_EFFECTS:
+            #plus the row the brush skips at the edge of the band
+            return LOCAL, reach + 1, reach + 1
+        if brush_engine.fits_inside(name, pattern, width, height):
+            return SEQUENTIAL, reach, reach
+        return WHOLE, 0, 0
+
+    if name == 'melt':
+        rows_to_melt = abs(setting)
+        if rows_to_melt == 0:
+            return LOCAL, 0, 0
+        if rows_to_melt >= height:
+            return WHOLE, 0, 0
+        if setting > 0:
+            return LOCAL, 0, rows_to_melt + 1
+        return LOCAL, rows_to_melt + 1, 0
+
+    return CANVAS, 0, 0
+
+
+def plan_stages(steps, height, width, mode):
+    """ Splits a chain in stages, back to back LOCAL steps share a stage
+        and their overlaps add up.
+
+    Returns:
+        stages (list): (kind, steps, rows above, rows below) tuples.
+    """
+    stages = []
+    for step in steps:
+        kind, above, below = step_plan(step, height, width, mode)
+        #the bytes a step needs from the rest of the image are read before its stage
+        joins = stages and stages[-1][0] == LOCAL and step[0] not in CONTEXT_EFFECTS
+        if kind == LOCAL and joins:
+            last_kind, last_steps, last_above, last_below = stages[-1]
+            stages[-1] = (LOCAL, last_steps + [step], last_above + above, last_below + below)
+        else:
+            stages.append((kind, [step], above, below))
+    return stages
+
+
+def step_context(pixels, step):
+    """ Helper to read what a LOCAL step needs from the rest of the image.
+    """
+    name, setting = step
+    if name == 'pattern':
+        return effects_engine.pattern_context(pixels)
+    if name == 'melt' and setting > 0:
+        return slider_engine.melt_first_anchor(pixels, setting)
+    return None
+
+
+def apply_window(window, steps, contexts, first_row, height, mode, gray=False):
+    """ Applies LOCAL steps to a band of rows and its overlap.
+
+    Args:
+        window (ndarray): (rows, width, 4) uint8 array, changed in place.
+        steps (list): The steps of a LOCAL stage.
+        contexts (list): step_context() of every step, taken before the stage.
+        first_row (int): Row of the whole image the window starts on.
+        height (int): Height of the whole image.
+        mode (str): brush_engine.EXACT or brush_engine.FAST.
+        gray (bool): Every pixel is opaque gray, see pipeline.apply_chain().
+
+    Returns:
+        window (ndarray): The same array.
+    """
+    plain = []
+    for step, context in list(zip(steps, contexts)) + [((None, None), None)]:
+        name, setting = step
+        if name is not None and name not in CONTEXT_EFFECTS:
+            plain.append(step)
+            continue
+        #steps that don't care where the window is go together, so table effects get fused
+        if plain:
+            pipeline.apply_chain(window, plain, None, mode, gray)
+            plain = []
+        gray = False
+
+        if name == 'pattern':
+            effects_engine.pattern(window, first_row * window.shape[1], context)
+        elif name == 'melt' and setting != 0:
+            slider_engine.melt_window(window, first_row, height, abs(setting), setting, context)
+    return window
+
+
+def render_window(slot_name, shape, steps, contexts, first_row, height, mode, gray=False):
+    """ Worker side of a band: the window is in the slot, apply the stage in place.
+
+    Returns:
+        outcome (tuple): (DONE, bytes of the window).
+    """
+    memory = shared_memory.SharedMemory(name=slot_name)
+    try:
+        window = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+        apply_window(window, steps, contexts, first_row, height, mode, gray)
+        del window
+    finally:
+        memory.close()
+    return DONE, int(np.prod(shape))
+
+
+def tile_rows_for(width, tile_bytes=TILE_BYTES):
+    """ Helper to get how many rows make a band of about tile_bytes.
+    """
+    return max(MIN_TILE_ROWS, tile_bytes // (width * PIXEL_CONTENTS))
+
+
+def band_windows(height, tile_rows, above, below):
+    """ Splits the rows of an image in bands.
+
+    Returns:
+        bands (list): (band start, band stop, window start, window stop) row ranges,
+        the window being the band and its overlap.
+    """
+    bands = []
+    for start in range(0, height, tile_rows):
+        stop = min(height, start + tile_rows)
+        bands.append((start, stop, max(0, start - above), min(height, stop + below)))
+    return bands
+
+
+def apply_chain(pixels, steps, rand=None, mode=brush_engine.EXACT, executor=None, tile_rows=None,
+                progress=None, gray=False, rects=None):
+    """ Applies a chain of effects in order, one band of rows at a time.
+        Images that fit in a single band are left to pipeline.apply_chain.
+
+    Args:
+        pixels (ndarray): (height, width, 4) uint8 BGRA array, changed in place.
+        It can be a memory mapped file.
+        steps (list): Steps from pipeline.parse_chain.
+        rand (Random): Source of the confetti positions, a new unseeded one if None.
+        mode (str): brush_engine.EXACT or brush_engine.FAST for the brush effects.
+        executor (BatchExecutor): Runs the LOCAL bands in parallel, in this process if None.
+        tile_rows (int): Rows of a band, about TILE_BYTES worth if None.
+        progress (function): Called as progress(done, total) before every band or stage
+        is worked on, it can raise to stop the chain, leaving the pixels half done.
+        gray (bool): Every pixel is opaque gray, see pipeline.apply_chain().
+        rects (list): Gets the rectangles the steps change, see pipeline.apply_chain().
+
+    Returns:
+        pixels (ndarray): The same array.
+    """
+    height, width = pixels.shape[:2]
+    if tile_rows is None:
+        tile_rows = tile_rows_for(width)
+    if height <= tile_rows:
+        if progress is not None:
+            progress(0, 1)
+        return pipeline.apply_chain(pixels, steps, rand, mode, gray, rects)
+    if rand is None:
+        rand = Random()
+
+    stages = []
+    for kind, stage, above, below in plan_stages(steps, height, width, mode):
+        rows = tile_rows
+        if kind == LOCAL:
+            #keep the overlap a small part of every window
+            rows = max(tile_rows, 2 * (above + below))
+        bands = len(band_windows(height, rows, above, below)) if kind in (LOCAL, SEQUENTIAL) else 1
+        stages.append((kind, stage, above, below, rows, bands))
+
+    total = sum(stage[-1] for stage in stages)
+    done = [0]
+
+    def tick():
+        if progress is not None:
+            progress(done[0], total)
+        done[0] += 1
+
+    for kind, stage, above, below, rows, bands in stages:
+        if kind == LOCAL:
+            run_local(pixels, stage, above, below, mode, executor, rows, tick, gray)
+        elif kind == SEQUENTIAL:
+            run_sequential(pixels, stage[0], above, mode, rows, tick)
+        else:
+            tick()
+            pipeline.apply_chain(pixels, stage, rand, mode, gray, rects)
+        if kind in (LOCAL, SEQUENTIAL) and rects is not None:
+            for name, setting in stage:
+                if name == 'melt':
+                    rects.extend(slider_engine.melt_rects(height, width, abs(setting)))
+                else:
+                    rects.append(None)
+        #only the first stage works on the image as it came in
+        gray = False
+    return pixels
+
+
+def run_sequential(pixels, step, reach, mode, tile_rows, tick=None):
+    """ Applies an exact brush effect band after band, in place.
+        Every band sees the rows before it already brushed, like the original loop.
+        tick() is called before every band.
+    """
+    height = pixels.shape[0]
+    name, setting = step
+    pattern = pipeline.BRUSH_PATTERNS.get(name, setting)
+    for start, stop, window_start, window_stop in band_windows(height, tile_rows, reach, reach):
+        if tick is not None:
+            tick()
+        #the brush never visits the first and last row of the window,
+        #which are those of the image on the first and last band
+        rows = (start - window_start, stop - window_start)
+        brush_engine.brush(pixels[window_start:window_stop], name, pattern, mode, rows)
+
+
+def run_local(pixels, steps, above, below, mode, executor, tile_rows, tick=None, gray=False):
+    """ Applies a LOCAL stage to every band, on copies of the bands and their overlap.
+        A band is only written back once every window that overlaps it has been copied,
+        so every window sees the image as it was before the stage.
+        tick() is called before every band is copied.
+    """
+    height = pixels.shape[0]
+    contexts = [step_context(pixels, step) for step in steps]
+    bands = band_windows(height, tile_rows, above, below)
+    #the last band whose window reads each band
+    last_reader = []
+    for start, stop, window_start, window_stop in bands:
+        readers = [number for number, band in enumerate(bands) if band[2] < stop and band[3] > start]
+        last_reader.append(max(readers))
+
+    copied = [-1]
+    finished = {}
+
+    def read_window(number):
+        if tick is not None:
+            tick()
+        start, stop, window_start, window_stop = bands[number]
+        copied[0] = number
+        return pixels[window_start:window_stop]
+
+    def flush(everything=False):
+        for number in sorted(finished):
+            if everything or last_reader[number] <= copied[0]:
+                start, stop = bands[number][:2]
+                pixels[start:stop] = finished.pop(number)
+
+    def keep(number, window):
+        start, stop, window_start, window_stop = bands[number]
+        finished[number] = window[start - window_start:stop - window_start].copy()
+        flush()
+
+    if executor is None:
+        for number in range(len(bands)):
+            window = read_window(number).copy()
+            flush()
+            apply_window(window, steps, contexts, bands[number][2], height, mode, gray)
+            keep(number, window)
+    else:
+        def submit(pool, slot, number):
+            window = read_window(number)
+            slot.pixels(window.shape)[:] = window
+            return pool.submit(render_window, slot.name, window.shape, steps, contexts,
+                               bands[number][2], height, mode, gray)
+
+        def finish(slot, number, outcome):
+            status, value = outcome
+            if status != DONE:
+                raise RuntimeError(f'Band {number} failed: {value}')
+            start, stop, window_start, window_stop = bands[number]
+            keep(number, slot.pixels((window_stop - window_start,) + pixels.shape[1:]))
+            return number
+
+        def window_size(number):
+            start, stop, window_start, window_stop = bands[number]
+            return (window_stop - window_start) * pixels.shape[1] * PIXEL_CONTENTS
+
+        for number in executor.run(range(len(bands)), submit, finish, window_size):
+            pass
+    flush(everything=True)
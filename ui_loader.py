@@ -0,0 +1,110 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" Builds the widgets of the window from abstract_image_editor.ui.
+
+    The .ui file is compiled ahead of time into the abstract_image_editor_ui module,
+    so starting the window doesn't parse its XML or import PyQt5.uic. The compiled
+    module is made again with:
+        python -m abstract_image_editor build-ui
+    The compiled module keeps a checksum of the .ui file it was made from. If it is
+    missing, or the .ui file was edited since, the .ui file is loaded as it is at
+    runtime instead, with the same widgets.
+    Both are looked for next to this file, not in the folder the window is started from.
+"""
+import io
+import os
+import zlib
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+UI_FILE = os.path.join(FOLDER, 'abstract_image_editor.ui')
+COMPILED_MODULE = 'abstract_image_editor_ui'
+COMPILED_FILE = os.path.join(FOLDER, COMPILED_MODULE + '.py')
+
+
+def ui_checksum(path=UI_FILE):
+    """ Helper to get the checksum of a .ui file, None if there is no such file.
+    """
+    try:
+        with open(path, 'rb') as ui_file:
+            return zlib.crc32(ui_file.read())
+    except OSError:
+        return None
+
+
+def compiled_form():
+    """ Helper to get the form class of the compiled module, None if it can't stand in for the .ui file.
+        Without the .ui file, e.g. in an executable, the compiled module is all there is.
+    """
+    try:
+        import abstract_image_editor_ui
+    except ImportError:
+        return None
+    checksum = ui_checksum()
+    if checksum is not None and checksum != getattr(abstract_image_editor_ui, 'UI_CHECKSUM', None):
+        return None
+    return abstract_image_editor_ui.Ui_mainWIndow
+
+
+def load_ui(window):
+    """ Builds the widgets of the .ui file onto a window.
+
+    Args:
+        window (QMainWindow): The window of the editor.
+
+    Returns:
+        form (object): Holds every widget with an object name as an attribute of that name,
+        e.g. form.openButton.
+    """
+    form_class = compiled_form()
+    if form_class is not None:
+        form = form_class()
+        form.setupUi(window)
+        return form
+    from PyQt5 import uic
+    uic.loadUi(UI_FILE, window)
+    return window
+
+
+def compile_ui(ui_path=UI_FILE, module_path=COMPILED_FILE):
+    """ Compiles the .ui file into the module load_ui() builds the window with.
+
+    Raises:
+        OSError: If a file can't be read or written.
+    """
+    from PyQt5 import uic
+    with open(ui_path, 'rb') as ui_file:
+        source = io.BytesIO(ui_file.read())
+    #named in the header of the module, without the folder it was built in
+    source.name = os.path.basename(ui_path)
+    with open(module_path, 'w', encoding='utf-8') as module_file:
+        uic.compileUi(source, module_file)
+        module_file.write(f'\n#checksum of the .ui file, see ui_loader\nUI_CHECKSUM = {ui_checksum(ui_path)}\n')
+
+
+def main(argv):
+    """ Entry point of the build-ui command, takes no options.
+
+    Returns:
+        status (int): 0, or 1 if the module couldn't be written.
+    """
+    try:
+        compile_ui()
+    except OSError as error:
+        print(f'Could not compile {UI_FILE}: {error}')
+        return 1
+    print(f'Wrote {COMPILED_FILE}')
+    return 0
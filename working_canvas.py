@@ -0,0 +1,308 @@
+#--------------------------------------------------------------------------------------
+#Copyright (c) 2022 Alvaro Angel
+#    This program is free software: you can redistribute it and/or modify it
+#    under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License,
+#    or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty
+#    of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#    See the GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU
+#    General Public License along with this program.
+#    If not, see <https://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------
+""" The image the window edits.
+
+    A WorkingCanvas owns a single 32 bit QImage and a NumPy view of its bytes.
+    Effects change the view in place, and the image is only turned into a QPixmap
+    when it is shown, so an effect doesn't pay for a copy and a format conversion
+    on its way in and another one on its way out.
+    Images bigger than raw_canvas.CANVAS_BYTES live in a memory mapped canvas file.
+
+    Background renders work on the scratch() buffers and copy their result onto the
+    pixels holding the lock, which show() holds as well. Only the tiles that changed
+    are copied, and only those are shown again, see canvas_view.
+    The buffer last committed is the same as the pixels until they change again,
+    so the next render can start on it without copying the pixels, see scratch_copy().
+    Every change goes through commit(), which records it in the canvas' EditHistory
+    so it can be undone, along with the effect chain of the new pixels, which is
+    kept in the canvas' EffectGraph.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pipeline
+import effects_engine
+import edit_history
+import effect_graph
+import image_writer
+import profiler
+import raw_canvas
+
+#Past this many changed runs waiting to be shown, the whole image is shown again.
+MAX_DIRTY_RUNS = 1024
+
+
+def run_bytes(runs):
+    """ Helper to count the bytes of the pixels in runs.
+    """
+    return sum((bottom - top) * (right - left) for top, bottom, left, right in runs) * edit_history.PIXEL_CONTENTS
+
+
+class WorkingCanvas:
+    """ The pixels of an open image and a copy of them as they were opened.
+
+    Args:
+        image (QImage): A RGB32 or ARGB32_Premultiplied image, the canvas owns it from now on.
+        backing (RawCanvas): The canvas file image is mapped from, if any.
+        gray (bool): Every pixel of the image is opaque gray, see pipeline.decode_image().
+    """
+    def __init__(self, image, backing=None, gray=False):
+        self.image = image
+        self.backing = backing
+        self.gray = gray
+        self.lock = threading.Lock()
+        self.buffers = None
+        self.scratch_canvases = []
+        #the scratch buffer holding the same bytes as the pixels, if any
+        self.synced = None
+        self.history = edit_history.EditHistory()
+        #runs of tiles changed since the pixels were last shown, None if they all have
+        self.dirty = None
+        if backing is None:
+            self.pixels = effects_engine.qimage_view(image)
+            self.original = self.pixels.copy()
+            self.backup = None
+        else:
+            self.pixels = backing.pixels
+            #the copy for reset is a second canvas file
+            backup_path = backing.path + '.original'
+            backing.flush()
+            shutil.copyfile(backing.path, backup_path)
+            self.backup = raw_canvas.RawCanvas(backup_path, writable=False)
+            self.original = self.backup.pixels
+        self.graph = effect_graph.EffectGraph(self.original)
+
+    @property
+    def height(self):
+        return self.image.height()
+
+    @property
+    def width(self):
+        return self.image.width()
+
+    def is_gray(self):
+        """ Tells if every pixel is opaque gray: the image opened gray and only effects
+            that keep it gray are on in the chain, see effects_engine.keeps_gray().
+        """
+        return self.gray and all(step.name in effects_engine.TABLE_EFFECTS
+                                 for step in self.graph.steps if step.enabled)
+
+    def commit(self, pixels, chain=None, rects=None):
+        """ Copies new pixels onto the canvas, as an edit that can be undone.
+
+        Args:
+            pixels (ndarray): Array shaped like the pixels.
+            chain (tuple): The graph snapshot the pixels are the result of, if known.
+            They are cached for the graph.
+            rects (list): (top, bottom, left, right) rectangles outside which pixels
+            is known to be the same as the canvas, see EditHistory.record().
+        """
+        with profiler.span('commit') as span:
+            #the canvas only changes on one thread at a time, the lock is for show()
+            edit = self.history.record(self.pixels, pixels, chain, rects)
+            if chain is not None:
+                self.graph.remember(pixels, chain)
+            self.synced = next((buffer for buffer in self.buffers or () if buffer is pixels), None)
+            if edit is None:
+                return
+            with self.lock:
+                for top, bottom, left, right in edit.runs:
+                    self.pixels[top:bottom, left:right] = pixels[top:bottom, left:right]
+                self.mark_dirty(edit.runs)
+            span.nbytes = run_bytes(edit.runs)
+
+    def reset(self):
+        """ Puts back the pixels as they were opened, in place, with an empty chain.
+            The reset can be undone.
+        """
+        self.graph.restore(())
+        self.commit(self.original, ())
+
+    def undo(self):
+        """ Takes back the last edit, and puts back the chain from before it.
+
+        Returns:
+            undone (bool): False if there was nothing to undo.
+        """
+        with self.lock:
+            edit = self.history.undo(self.pixels)
+            if edit is not None:
+                self.synced = None
+                self.mark_dirty(edit.runs)
+        self.sync_chain()
+        return edit is not None
+
+    def redo(self):
+        """ Makes the last undone edit again, with its chain.
+
+        Returns:
+            redone (bool): False if there was nothing to redo.
+        """
+        with self.lock:
+            edit = self.history.redo(self.pixels)
+            if edit is not None:
+                self.synced = None
+                self.mark_dirty(edit.runs)
+        self.sync_chain()
+        return edit is not None
+
+    def sync_chain(self):
+        """ Puts back the chain of the pixels as they are now, e.g. after effects were
+            cancelled or failed and never made it to the pixels.
+        """
+        chain = self.history.tag()
+        self.graph.restore(() if chain is None else chain)
+
+    def mark_dirty(self, runs):
+        """ Helper to add runs to the ones to show again, holding the lock.
+        """
+        if self.dirty is not None:
+            self.dirty.extend(runs)
+            if len(self.dirty) > MAX_DIRTY_RUNS:
+                self.dirty = None
+
+    def show(self, view):
+        """ Shows the pixels on a CanvasView, only the parts that changed since they were last shown.
+
+        Args:
+            view (CanvasView): The label of the window.
+        """
+        with self.lock:
+            view.show_image(self, self.dirty)
+            self.dirty = []
+
+    def scratch(self):
+        """ Two arrays shaped like the pixels for background renders to work on,
+            made on first use and kept. Canvas files for mapped images.
+        """
+        if self.buffers is None:
+            if self.backing is None:
+                self.buffers = (np.empty_like(self.pixels), np.empty_like(self.pixels))
+            else:
+                for number in range(2):
+                    path = f'{self.backing.path}.scratch{number}'
+                    self.scratch_canvases.append(raw_canvas.create_canvas(path, self.height, self.width,
+                                                                          self.backing.image_format))
+                self.buffers = tuple(canvas.pixels for canvas in self.scratch_canvases)
+        return self.buffers
+
+    def scratch_copy(self):
+        """ A scratch() buffer holding a copy of the pixels, for a render to start on.
+            The buffer last committed still is one, so it is given without copying anything.
+            Until the buffer is committed, the render owns it.
+        """
+        buffers = self.scratch()
+        buffer = self.synced
+        if buffer is None:
+            buffer = buffers[0]
+            np.copyto(buffer, self.pixels)
+        self.synced = None
+        return buffer
+
+    def save(self, path, options=image_writer.DEFAULT_OPTIONS):
+        """ Writes the image, the file type comes from the extension of the path.
+            Mapped images are written to PNG a few rows at a time.
+
+        Args:
+            path (str): Image file path.
+            options (SaveOptions): JPEG quality and PNG compression, see image_writer.
+
+        Raises:
+            OSError: If the file can't be written.
+        """
+        image_writer.write(self.image if self.backing is None else self.backing, path, options)
+
+    def snapshot(self):
+        """ A copy of the pixels as they are now, for an ImageWriter to write while the canvas
+            keeps changing. Effects write through the NumPy view, which Qt's copy on write
+            doesn't see, so the copy is made here: a QImage, or a second canvas file for mapped images.
+
+        Returns:
+            source (QImage or RawCanvas): The copy.
+            release (function): Lets go of the copy once it is written.
+        """
+        if self.backing is None:
+            with self.lock:
+                return self.image.copy(), lambda: None
+
+        handle, path = tempfile.mkstemp(suffix='.canvas', dir=os.path.dirname(self.backing.path))
+        os.close(handle)
+        with self.lock:
+            self.backing.flush()
+            shutil.copyfile(self.backing.path, path)
+        copy = raw_canvas.RawCanvas(path, writable=False)
+
+        def release():
+            copy.close()
+            os.remove(path)
+        return copy, release
+
+    def close(self):
+        """ Lets go of the pixels and deletes the canvas files and the edit history files, if any.
+        """
+        self.history.clear()
+        self.graph.close()
+        self.pixels = None
+        self.original = None
+        self.image = None
+        self.buffers = None
+        self.synced = None
+        for canvas in [self.backing, self.backup] + self.scratch_canvases:
+            if canvas is not None:
+                canvas.close()
+                os.remove(canvas.path)
+        self.backing = None
+        self.backup = None
+        self.scratch_canvases = []
+
+
+def open_canvas(path):
+    """ Reads an image file into a new WorkingCanvas.
+
+    Args:
+        path (str): Image file path.
+
+    Raises:
+        OSError: If the file can't be read.
+        ValueError: If the image is smaller than pipeline.MIN_IMAGE_SIZE.
+
+    Returns:
+        canvas (WorkingCanvas): The open image.
+    """
+    with profiler.span('load', os.path.basename(path)) as span:
+        canvas = read_canvas(path)
+        span.nbytes = canvas.pixels.nbytes
+    return canvas
+
+
+def read_canvas(path):
+    """ Helper to read an image file into a WorkingCanvas, mapped if it is large, see open_canvas().
+    """
+    if raw_canvas.decoded_bytes(path) < raw_canvas.CANVAS_BYTES:
+        image, gray = pipeline.decode_image(path)
+        return WorkingCanvas(image, gray=gray)
+
+    handle, canvas_path = tempfile.mkstemp(suffix='.canvas')
+    os.close(handle)
+    try:
+        backing = raw_canvas.import_image(path, canvas_path)
+    except (OSError, ValueError):
+        os.remove(canvas_path)
+        raise
+    return WorkingCanvas(backing.image(), backing)